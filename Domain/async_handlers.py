@@ -0,0 +1,59 @@
+"""
+    By Etienne Quenon
+
+    The handlers of handlers.py for an AbstractAsyncWorker: the same steps, run by awaiting every call they yield.
+"""
+
+import functools
+import handlers
+import worker
+from typing import Callable, Generator
+
+
+async def run_steps(steps: Generator):
+    """ Runs steps on an async worker, returns what they return. """
+    try:
+        call = next(steps)
+        while True:
+            call = steps.send(await call)
+    except StopIteration as stop:
+        return stop.value
+
+
+def handler(sync_handler: Callable) -> Callable:
+    """ The coroutine function running the steps of sync_handler (see handlers.handler) in a unit of work of the async worker w. """
+    steps = sync_handler.steps
+
+    @functools.wraps(steps)
+    async def handle(command, w: worker.AbstractAsyncWorker):
+        async with w:
+            return await run_steps(steps(command, w))
+    handle.steps = steps
+    return handle
+
+
+publish_advertisement = handler(handlers.publish_advertisement)
+un_publish_advertisement = handler(handlers.un_publish_advertisement)
+update_ad_published_date = handler(handlers.update_ad_published_date)
+update_ad_location = handler(handlers.update_ad_location)
+update_ad_services = handler(handlers.update_ad_services)
+update_ad_prices = handler(handlers.update_ad_prices)
+promote_ad_to_premium = handler(handlers.promote_ad_to_premium)
+delete_ad = handler(handlers.delete_ad)
+expire_ad = handler(handlers.expire_ad)
+expire_premium_ad = handler(handlers.expire_premium_ad)
+add_comment = handler(handlers.add_comment)
+modify_comment = handler(handlers.modify_comment)
+delete_comment = handler(handlers.delete_comment)
+send_sms_visitor = handler(handlers.send_sms_visitor)
+report = handler(handlers.report)
+comment_report = handler(handlers.comment_report)
+open_report = handler(handlers.open_report)
+close_report = handler(handlers.close_report)
+claim_report = handler(handlers.claim_report)
+close_reports = handler(handlers.close_reports)
+activate_user = handler(handlers.activate_user)
+disable_user = handler(handlers.disable_user)
+set_private_pics = handler(handlers.set_private_pics)
+set_profile_pic = handler(handlers.set_profile_pic)
+update_billing = handler(handlers.update_billing)
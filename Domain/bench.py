@@ -0,0 +1,373 @@
+"""
+    By Etienne Quenon
+
+    Benchmarks of the domain objects and handlers, run with: python bench.py --help
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable, List
+import commands
+import database
+import handlers
+import instrumentation
+import outbox
+import user
+import worker
+
+
+def memory_per_object(factory: Callable[[int], object], count: int = 100_000) -> float:
+    """ Average number of bytes allocated for one object built by factory(i). """
+    gc.collect()
+    tracemalloc.start()
+    objects = [factory(i) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+
+def _location(i: int) -> user.Location:
+    return user.Location("Rue des fleurs", i, "Bruxelles", 1000, "Brabant", "Belgium")
+
+
+def _advertisement(i: int) -> user.Advertisement:
+    now = datetime.datetime.now()
+    return user.Advertisement("Title", "Description", now, now, None, None, None, "owner", True, str(i))
+
+
+def _comment(i: int) -> user.Comment:
+    return user.Comment("target", "owner", datetime.datetime.now(), None, "Content", str(i))
+
+
+def _report(i: int) -> user.Report:
+    return user.Report("target", "owner", datetime.datetime.now(), "Content", "NEW", str(i))
+
+
+def _premium_ad(i: int) -> user.PremiumAdvertisement:
+    now = datetime.datetime.now()
+    return user.PremiumAdvertisement("owner", str(i), now, now)
+
+
+def _billing(i: int) -> user.Billing:
+    return user.Billing(str(i), datetime.date.today(), "000", "Full Name")
+
+
+def _provider(i: int) -> user.Provider:
+    return user.Provider("username", str(i), "password", "e@mail.com", [], False, False, None)
+
+
+def _visitor(i: int) -> user.Visitor:
+    return user.Visitor("username", str(i), "password", "e@mail.com", None, "Address", None, {}, False, [])
+
+
+MEMORY_FACTORIES = {
+    "Location": _location,
+    "Billing": _billing,
+    "PremiumAdvertisement": _premium_ad,
+    "Advertisement": _advertisement,
+    "Comment": _comment,
+    "Report": _report,
+    "Provider": _provider,
+    "Visitor": _visitor,
+}
+
+
+def memory_benchmark(count: int = 100_000) -> dict:
+    return {name: memory_per_object(factory, count) for name, factory in MEMORY_FACTORIES.items()}
+
+
+# Synthetic datasets, the same for a given scale: the uuids are derived from positions.
+
+@dataclass
+class Dataset:
+    """ scale ads spread over providers of ads_per_provider ads, and a visitor and a report thread per provider. """
+    providers: List[user.Provider] = field(default_factory=list)
+    visitors: List[user.Visitor] = field(default_factory=list)
+    reports: List[user.Report] = field(default_factory=list)
+    moderator: user.Moderator = None
+    admin: user.Admin = None
+
+    @property
+    def objects(self) -> list:
+        return [self.moderator, self.admin, *self.providers, *self.visitors, *self.reports]
+
+
+def _active(u: user.User) -> user.User:
+    u._activate()
+    return u
+
+
+def make_provider(i: int, ads: int) -> user.Provider:
+    provider = _active(user.Provider(f"provider{i}", f"provider-{i}", "password", "e@mail.com", [], True, True, None))
+    for j in range(ads):
+        provider.publish_ad(f"Ad {j}", "Description", {"hour": 100 + j % 50}, None, {"massage": True}, f"ad-{i}-{j}")
+    return provider
+
+
+def make_visitor(i: int, comments: int) -> user.Visitor:
+    visitor = _active(user.Visitor(f"visitor{i}", f"visitor-{i}", "password", "e@mail.com", None, "Address", None, {}, False, []))
+    for j in range(comments):
+        visitor.add_comment(f"ad-{i}-{j % 100}", "Comment", f"comment-{i}-{j}")
+    return visitor
+
+
+def make_report(i: int, moderator: user.Moderator, comments: int) -> user.Report:
+    report = user.Report(f"provider-{i}", f"visitor-{i}", datetime.datetime.now(), "Report", "NEW", f"report-{i}")
+    moderator.open_report(report, f"report-{i}-open")
+    for j in range(comments):
+        moderator.comment_report(report, "Comment", f"report-{i}-{j}")
+    return report
+
+
+def make_dataset(scale: int, ads_per_provider: int = 1000, comments_per_visitor: int = 1000, report_length: int = 1000) -> Dataset:
+    dataset = Dataset(moderator=_active(user.Moderator("moderator", "moderator", "password", "e@mail.com")),
+                      admin=_active(user.Admin("admin", "admin", "password", "e@mail.com")))
+    for i in range(math.ceil(scale / ads_per_provider)):
+        dataset.providers.append(make_provider(i, min(ads_per_provider, scale - i * ads_per_provider)))
+        dataset.visitors.append(make_visitor(i, comments_per_visitor))
+        dataset.reports.append(make_report(i, dataset.moderator, report_length))
+    return dataset
+
+
+def dataset_memory(scale: int, **sizes) -> float:
+    """ Bytes allocated by make_dataset(scale). """
+    gc.collect()
+    tracemalloc.start()
+    dataset = make_dataset(scale, **sizes)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del dataset
+    return size
+
+
+def measure(operation: Callable[[int], object], count: int) -> dict:
+    """ Calls operation(0) ... operation(count - 1), timing each call. """
+    histogram = instrumentation.Histogram()
+    gc.collect()
+    start = time.perf_counter()
+    for i in range(count):
+        begin = time.perf_counter()
+        operation(i)
+        histogram.record(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    return {
+        "count": count,
+        "ops_per_sec": count / elapsed if elapsed else float("inf"),
+        "mean_us": histogram.mean * 1e6,
+        "p50_us": histogram.quantile(0.5) * 1e6,
+        "p99_us": histogram.quantile(0.99) * 1e6,
+    }
+
+
+# Domain methods, on the first provider, visitor and report of a fresh dataset.
+# Every setup returns operation(i); the operations that consume an ad or a comment use a different one for each i.
+
+def _ad_uuid(i: int) -> str:
+    return f"ad-0-{i}"
+
+
+DOMAIN_BENCHMARKS = {
+    "Provider.publish_ad": lambda d: lambda i: d.providers[0].publish_ad("New", "Description", {}, None, {}, f"new-{i}"),
+    "Provider.get_ad": lambda d: lambda i: d.providers[0].get_ad(_ad_uuid(i)),
+    "Provider.update_ad_prices": lambda d: lambda i: d.providers[0].update_ad_prices(_ad_uuid(i), {"hour": i}),
+    "Provider.update_ad_published_date": lambda d: lambda i: d.providers[0].update_ad_published_date(_ad_uuid(i)),
+    "Provider.promote_ad_to_premium": lambda d: lambda i: d.providers[0].promote_ad_to_premium(_ad_uuid(i)),
+    "Provider.un_publish_ad": lambda d: lambda i: d.providers[0].un_publish_ad(_ad_uuid(i)),
+    "Provider.delete_ad": lambda d: lambda i: d.providers[0].delete_ad(_ad_uuid(i)),
+    "Visitor.add_comment": lambda d: lambda i: d.visitors[0].add_comment("ad-0-0", "Comment", f"new-{i}"),
+    "Visitor.modify_comment": lambda d: lambda i: d.visitors[0].modify_comment(f"comment-0-{i}", "Modified"),
+    "Visitor.delete_comment": lambda d: lambda i: d.visitors[0].delete_comment(f"comment-0-{i}"),
+    "User.comment_report": lambda d: lambda i: d.visitors[0].comment_report(d.reports[0], "Comment", f"new-{i}"),
+    "Moderator.open_report": lambda d: lambda i: d.moderator.open_report(d.reports[0], f"new-{i}"),
+}  # Type Dict[str, Callable[[Dataset], Callable[[int], object]]]
+
+
+# Handlers, on the same dataset stored in the backend of the worker
+
+def _handler(w: worker.AbstractWorker, command: Callable[[int], commands.Command], handler: Callable) -> Callable[[int], object]:
+    return lambda i: handler(command(i), w)
+
+
+HANDLER_BENCHMARKS = {
+    "publish_advertisement": lambda w: _handler(w, lambda i: commands.PublishAdvertisement(f"New {i}", "Description", None, {}, {}, "provider-0"), handlers.publish_advertisement),
+    "update_ad_prices": lambda w: _handler(w, lambda i: commands.UpdateAdvertisementPrices("provider-0", _ad_uuid(i), {"hour": i}), handlers.update_ad_prices),
+    "update_ad_published_date": lambda w: _handler(w, lambda i: commands.UpdateAdvertisementPublishedDate("provider-0", _ad_uuid(i)), handlers.update_ad_published_date),
+    "promote_ad_to_premium": lambda w: _handler(w, lambda i: commands.PromoteAdvertisementToPremium("provider-0", _ad_uuid(i)), handlers.promote_ad_to_premium),
+    "un_publish_advertisement": lambda w: _handler(w, lambda i: commands.UnPublishAdvertisement("provider-0", _ad_uuid(i)), handlers.un_publish_advertisement),
+    "delete_ad": lambda w: _handler(w, lambda i: commands.DeleteAdvertisement("provider-0", _ad_uuid(i)), handlers.delete_ad),
+    "add_comment": lambda w: _handler(w, lambda i: commands.AddComment("ad-0-0", "visitor-0", "Comment"), handlers.add_comment),
+    "modify_comment": lambda w: _handler(w, lambda i: commands.ModifyComment("visitor-0", f"comment-0-{i}", "Modified"), handlers.modify_comment),
+    "delete_comment": lambda w: _handler(w, lambda i: commands.DeleteComment("visitor-0", f"comment-0-{i}"), handlers.delete_comment),
+    "report": lambda w: _handler(w, lambda i: commands.Report("visitor-0", "provider-0", "Report"), handlers.report),
+    "comment_report": lambda w: _handler(w, lambda i: commands.CommentReport("visitor-0", "report-0", "Comment"), handlers.comment_report),
+    "send_sms": lambda w: _handler(w, lambda i: commands.SendSms("visitor-0", "+32000000000", "Message"), handlers.send_sms_visitor),
+}  # Type Dict[str, Callable[[worker.AbstractWorker], Callable[[int], object]]]
+
+
+class MemoryDatabase(database.AbstractDatabase):
+    def __init__(self):
+        self._objects = {}  # Type Dict[str, object]
+
+    def create(self, obj: object):
+        self._objects[obj.uuid] = obj
+
+    def read(self, uuid: str):
+        return self._objects.get(uuid)
+
+    def delete(self, uuid: str):
+        self._objects.pop(uuid, None)
+
+    def update(self, obj: object):
+        self._objects[obj.uuid] = obj
+
+
+class MemoryWorker(worker.AbstractWorker):
+    """ The handlers without any storage cost, the baseline of the persistent backends. """
+
+    def __init__(self):
+        self.db = MemoryDatabase()
+        self.outbox = outbox.MemoryOutbox()
+
+    def _commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class Backends:
+    """ Workers holding a fresh copy of the dataset of a scale, built once per backend and scale. """
+
+    def __init__(self, directory: str, **sizes):
+        self.directory = directory
+        self.sizes = sizes
+        self._templates = {}  # Type Dict[int, str], scale -> stored dataset
+
+    def memory(self, scale: int) -> worker.AbstractWorker:
+        w = MemoryWorker()
+        for obj in make_dataset(scale, **self.sizes).objects:
+            w.db.db.create(obj)
+        return w
+
+    def sqlite(self, scale: int) -> worker.AbstractWorker:
+        template = self._templates.get(scale)
+        if template is None:
+            template = self._templates[scale] = os.path.join(self.directory, f"dataset-{scale}.sqlite3")
+            w = worker.SqliteWorker(template)
+            with w:
+                for obj in make_dataset(scale, **self.sizes).objects:
+                    w.db.create(obj)
+                w.commit()
+            w.connection.close()  # Checkpoints the WAL, the file can be copied
+        path = os.path.join(self.directory, "bench.sqlite3")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        shutil.copyfile(template, path)
+        return worker.SqliteWorker(path)
+
+
+BACKENDS = ("memory", "sqlite")
+
+
+def run(scales: List[int], count: int = 1000, backends=BACKENDS, ads_per_provider: int = 1000, comments_per_visitor: int = 1000,
+        report_length: int = 1000, memory_count: int = 10_000) -> dict:
+    """ Every benchmark at every scale, as a JSON-serialisable dict (see compare). """
+    sizes = {"ads_per_provider": ads_per_provider, "comments_per_visitor": comments_per_visitor, "report_length": report_length}
+    count = min(count, ads_per_provider, min(scales), comments_per_visitor)  # The operations consuming an ad or a comment need one per call
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "sqlite": database.sqlite3.sqlite_version,
+            "count": count,
+            **sizes,
+        },
+        "memory": memory_benchmark(memory_count),
+        "scales": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        stores = Backends(directory, **sizes)
+        for scale in scales:
+            entry = results["scales"][str(scale)] = {"dataset_bytes": dataset_memory(scale, **sizes), "domain": {}}
+            for name, setup in DOMAIN_BENCHMARKS.items():
+                entry["domain"][name] = measure(setup(make_dataset(scale, **sizes)), count)
+            for backend in backends:
+                entry[backend] = {}
+                for name, setup in HANDLER_BENCHMARKS.items():
+                    w = getattr(stores, backend)(scale)
+                    entry[backend][name] = measure(setup(w), count)
+                    if hasattr(w, "connection"):
+                        w.connection.close()
+    return results
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.2) -> List[str]:
+    """ The benchmarks whose mean latency grew by more than tolerance (0.2 = 20%) since baseline. """
+    regressions = []
+    for scale, entry in current["scales"].items():
+        for group, benchmarks in entry.items():
+            if not isinstance(benchmarks, dict):
+                continue
+            for name, result in benchmarks.items():
+                before = baseline.get("scales", {}).get(scale, {}).get(group, {}).get(name)
+                if before and before["mean_us"] and result["mean_us"] > before["mean_us"] * (1 + tolerance):
+                    regressions.append(f"{scale} {group} {name}: {before['mean_us']:.1f}us -> {result['mean_us']:.1f}us "
+                                       f"(+{(result['mean_us'] / before['mean_us'] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _print(results: dict):
+    for name, size in results["memory"].items():
+        print(f"{name:<24}{size:>8.0f} bytes/object")
+    for scale, entry in results["scales"].items():
+        print(f"\nscale {scale}: dataset {entry['dataset_bytes'] / 2 ** 20:.1f} MiB")
+        for group, benchmarks in entry.items():
+            if isinstance(benchmarks, dict):
+                for name, result in benchmarks.items():
+                    print(f"  {group:<8}{name:<36}{result['ops_per_sec']:>12.0f} ops/s"
+                          f"{result['p50_us']:>10.1f}us p50{result['p99_us']:>10.1f}us p99")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Domain and handler benchmarks on synthetic datasets.")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1000], help="number of ads in the dataset, e.g. 1000 100000 1000000")
+    parser.add_argument("--count", type=int, default=1000, help="calls per benchmark")
+    parser.add_argument("--backend", choices=BACKENDS, nargs="+", default=list(BACKENDS))
+    parser.add_argument("--ads-per-provider", type=int, default=1000)
+    parser.add_argument("--comments-per-visitor", type=int, default=1000)
+    parser.add_argument("--report-length", type=int, default=1000)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run, exits with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.count, args.backend, args.ads_per_provider, args.comments_per_visitor, args.report_length)
+    _print(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
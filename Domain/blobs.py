@@ -0,0 +1,108 @@
+"""
+    By Etienne Quenon
+"""
+
+import hashlib
+import mmap
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, Union
+
+
+CHUNK_SIZE = 64 * 1024
+
+# First bytes of the image formats we accept, so the files get an extension the web server can serve
+SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+
+@dataclass(frozen=True, slots=True)
+class BlobRef:
+    """ What the domain objects keep of a picture, the bytes stay on disk until a BlobStore opens them. """
+    digest: str  # sha256, hex
+    size: int
+    extension: str = ""
+
+    @property
+    def name(self) -> str:
+        return f"{self.digest[:2]}/{self.digest[2:4]}/{self.digest}{self.extension}"
+
+
+def _extension(head: bytes) -> str:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return next((extension for signature, extension in SIGNATURES if head.startswith(signature)), "")
+
+
+class BlobStore:
+    """
+        Content-addressed files under root, named after the sha256 of their content:
+        storing the same picture twice writes it once, and a stored file never changes.
+    """
+
+    def __init__(self, root: str):
+        self.root = str(root)  # Nothing is created on disk before create() or the first put()
+
+    def create(self):
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def put(self, data: Union[bytes, BinaryIO, Iterable[bytes]]) -> BlobRef:
+        """ Stores bytes, a file object (read CHUNK_SIZE at a time) or an iterable of chunks (e.g. an upload). """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            chunks = (bytes(data),)
+        elif hasattr(data, "read"):
+            chunks = iter(lambda: data.read(CHUNK_SIZE), b"")
+        else:
+            chunks = data
+        digest, size, head = hashlib.sha256(), 0, b""
+        try:
+            fd, temporary = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        except FileNotFoundError:
+            self.create()
+            fd, temporary = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    digest.update(chunk)
+                    size += len(chunk)
+                    file.write(chunk)
+            ref = BlobRef(digest.hexdigest(), size, _extension(head))
+            path = self.path(ref)
+            if os.path.exists(path):
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temporary, 0o644)  # mkstemp creates it private, it is served as media
+                os.replace(temporary, path)  # Atomic: a reader never sees a partial file
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return ref
+
+    def path(self, ref: BlobRef) -> str:
+        return os.path.join(self.root, *ref.name.split("/"))
+
+    def __contains__(self, ref: BlobRef) -> bool:
+        return os.path.exists(self.path(ref))
+
+    def open(self, ref: BlobRef) -> BinaryIO:
+        return open(self.path(ref), "rb")
+
+    def map(self, ref: BlobRef):
+        """ Read-only memory map of the blob, pages are only read from disk when they are accessed. """
+        if ref.size == 0:
+            return b""  # Empty files can't be mapped
+        with self.open(ref) as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, ref: BlobRef) -> bytes:
+        with self.open(ref) as file:
+            return file.read()
@@ -0,0 +1,231 @@
+"""
+    By Etienne Quenon
+
+    Streaming import and export of advertisements, as CSV or JSON Lines, run with: python bulk.py --help
+    While the site runs, use python manage.py bulk_ads instead: its workers invalidate the cached pages of the imported ads.
+"""
+
+import argparse
+import contextlib
+import csv
+import datetime
+import itertools
+import json
+import sys
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+import commands
+import messagebus
+import user
+import worker
+
+
+# Columns of both formats, a CSV file has this header. service and prices are JSON objects (encoded as text in CSV).
+FIELDS = ("uuid", "owner", "title", "description", "published", "date_published", "expiry_date",
+          "street", "number", "city", "zip_code", "state", "country", "latitude", "longitude", "service", "prices")
+LOCATION_FIELDS = ("street", "number", "city", "zip_code", "state", "country", "latitude", "longitude")
+FORMATS = ("csv", "jsonl")
+FLAGS = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+
+
+class InvalidRow(Exception):
+    """ This row can't be imported as an Advertisement ! """
+
+
+@dataclass
+class RowError:
+    line: int
+    message: str
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    failed: int = 0
+    errors: List[RowError] = field(default_factory=list)  # The first max_errors failures only
+
+
+# Reading, one row at a time
+
+def read_csv(file: TextIO) -> Iterator[Tuple[int, dict]]:
+    """ Yields (line number, row) for every row after the header. """
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(file: TextIO) -> Iterator[Tuple[int, dict]]:
+    for line_number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, InvalidRow(f"Invalid JSON: {e}")
+                continue
+            yield line_number, row if isinstance(row, dict) else InvalidRow("not a JSON object")
+
+
+def read(file: TextIO, format: str) -> Iterator[Tuple[int, dict]]:
+    return read_csv(file) if format == "csv" else read_jsonl(file)
+
+
+def _blank(value) -> bool:
+    return value is None or value == ""
+
+
+def _number(row: dict, name: str, kind: type):
+    value = row.get(name)
+    if _blank(value):
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{name} isn't a number: {value!r}")
+
+
+def _flag(row: dict, name: str, default: bool) -> bool:
+    value = row.get(name)
+    if _blank(value):
+        return default
+    if isinstance(value, bool):
+        return value
+    flag = FLAGS.get(str(value).strip().lower())
+    if flag is None:
+        raise InvalidRow(f"{name} isn't a boolean: {value!r}")
+    return flag
+
+
+def _object(row: dict, name: str) -> dict:
+    value = row.get(name)
+    if _blank(value):
+        return {}
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise InvalidRow(f"{name} isn't a JSON object: {value!r}")
+    if not isinstance(value, dict):
+        raise InvalidRow(f"{name} isn't a JSON object: {value!r}")
+    return value
+
+
+def parse_row(row: dict) -> commands.PublishAdvertisement:
+    """ Validates a row of either format. The uuid and dates of the row are ignored, a published ad gets new ones; published defaults to true. """
+    for name in ("owner", "title"):
+        if _blank(row.get(name)):
+            raise InvalidRow(f"{name} is missing")
+    location = None
+    if any(not _blank(row.get(name)) for name in LOCATION_FIELDS):
+        location = user.Location(row.get("street") or "", _number(row, "number", int), row.get("city") or "", _number(row, "zip_code", int),
+                                 row.get("state") or "", row.get("country") or "", _number(row, "latitude", float), _number(row, "longitude", float))
+    return commands.PublishAdvertisement(str(row["title"]), str(row.get("description") or ""), location,
+                                         _object(row, "service"), _object(row, "prices"), str(row["owner"]), _flag(row, "published", True))
+
+
+# Import
+
+def import_ads(rows: Iterable[Tuple[int, dict]], bus: messagebus.MessageBus, batch_size: int = 1000, max_errors: int = 100) -> ImportReport:
+    """
+        Publishes the rows through bus.handle_batch, batch_size rows per transaction.
+        Only one batch is in memory at a time, and it is sorted by owner: the identity map of the worker reads each provider once per batch.
+        Invalid rows and failing commands are counted and skipped, the rest of their batch is committed.
+    """
+    report = ImportReport()
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, batch_size))
+        if not chunk:
+            return report
+        batch = []  # Type List[Tuple[int, commands.PublishAdvertisement]]
+        for line, row in chunk:
+            try:
+                if isinstance(row, InvalidRow):
+                    raise row
+                batch.append((line, parse_row(row)))
+            except InvalidRow as e:
+                _failed(report, line, str(e), max_errors)
+        batch.sort(key=lambda item: item[1].owner)
+        for (line, _), result in zip(batch, bus.handle_batch([command for _, command in batch])):
+            if result.ok:
+                report.imported += 1
+            else:
+                _failed(report, line, f"{type(result.error).__name__}: {result.error}", max_errors)
+
+
+def _failed(report: ImportReport, line: int, message: str, max_errors: int):
+    report.failed += 1
+    if len(report.errors) < max_errors:
+        report.errors.append(RowError(line, message))
+
+
+# Export
+
+def _timestamp(date: Optional[datetime.datetime]) -> Optional[str]:
+    return date.isoformat() if date is not None else None
+
+
+def ad_row(ad: user.Advertisement) -> dict:
+    location = ad.localisation
+    row = {"uuid": ad.uuid, "owner": ad.owner, "title": ad.title, "description": ad.description, "published": ad.published,
+           "date_published": _timestamp(ad.date_published), "expiry_date": _timestamp(ad.expiry_date),
+           "service": ad.service or {}, "prices": ad.prices or {}}
+    for name in LOCATION_FIELDS:
+        row[name] = getattr(location, name) if location is not None else None
+    return row
+
+
+def export_ads(ads: Iterable[user.Advertisement], file: TextIO, format: str = "jsonl") -> int:
+    """ Writes the ads as they are read (e.g. from SqliteDatabase.scan), returns how many were written. """
+    count = 0
+    if format == "csv":
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        for ad in ads:
+            row = ad_row(ad)
+            row["service"], row["prices"] = json.dumps(row["service"]), json.dumps(row["prices"])
+            writer.writerow(row)
+            count += 1
+    else:
+        for ad in ads:
+            file.write(json.dumps(ad_row(ad), default=str))
+            file.write("\n")
+            count += 1
+    return count
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("file", help="- for stdin / stdout")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the extension of file, or jsonl")
+    parser.add_argument("--batch-size", type=int, default=1000)
+
+
+def run(args: argparse.Namespace, make_worker: Callable[[], worker.AbstractWorker]) -> int:
+    """ Runs the parsed arguments with the workers of make_worker, returns the exit status. """
+    format = args.format or ("csv" if args.file.endswith(".csv") else "jsonl")
+    w = make_worker()
+
+    if args.action == "export":
+        with (contextlib.nullcontext(sys.stdout) if args.file == "-" else open(args.file, "w", newline="")) as file:
+            count = export_ads(w.db.db.scan("advertisement"), file, format)
+        print(f"{count} ads exported", file=sys.stderr)
+        return 0
+
+    with (contextlib.nullcontext(sys.stdin) if args.file == "-" else open(args.file, newline="")) as file:
+        report = import_ads(read(file, format), messagebus.MessageBus(w), args.batch_size)
+    for error in report.errors:
+        print(f"line {error.line}: {error.message}", file=sys.stderr)
+    print(f"{report.imported} ads imported, {report.failed} failed", file=sys.stderr)
+    return 1 if report.failed else 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Imports or exports the advertisements of a database.")
+    add_arguments(parser)
+    parser.add_argument("--db", default=worker.DEFAULT_PATH)
+    args = parser.parse_args(argv)
+    return run(args, lambda: worker.SqliteWorker(args.db))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
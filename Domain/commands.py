@@ -18,6 +18,7 @@ class PublishAdvertisement(Command):
     service: dict
     prices: dict
     owner: str  # User uuid
+    published: bool = True  # False: the ad is stored unpublished, e.g. an unpublished ad imported back by bulk.py
 
 
 @dataclass
@@ -32,6 +33,41 @@ class UpdateAdvertisementPublishedDate(Command):
     uuid: str
 
 
+@dataclass
+class UpdateAdvertisementLocation(Command):
+    owner: str
+    uuid: str
+    localisation: user.Location
+
+
+@dataclass
+class UpdateAdvertisementServices(Command):
+    owner: str
+    uuid: str
+    service: dict
+
+
+@dataclass
+class UpdateAdvertisementPrices(Command):
+    owner: str
+    uuid: str
+    prices: dict
+
+
+@dataclass
+class ExpireAdvertisement(Command):
+    owner: str
+    uuid: str
+    now: datetime.datetime = None
+
+
+@dataclass
+class ExpirePremiumAdvertisement(Command):
+    owner: str
+    uuid: str  # Advertisement uuid
+    now: datetime.datetime = None
+
+
 @dataclass
 class PromoteAdvertisementToPremium(Command):
     owner: str
@@ -97,6 +133,17 @@ class CloseReport(Command):
     report_uuid: str
 
 
+@dataclass
+class ClaimReport(Command):
+    moderator_uuid: str
+
+
+@dataclass
+class CloseReports(Command):
+    moderator_uuid: str
+    report_uuids: list  # List[str]
+
+
 @dataclass
 class ActivateUser(Command):
     admin_uuid: str
@@ -111,8 +158,14 @@ class DisableUser(Command):
 
 @dataclass
 class SetPrivatePics(Command):
-    pictures: field(default_factory=list)  # List[bytes]
+    pictures: field(default_factory=list)  # List[bytes], or file objects / chunk iterables streamed to the blob store
+    user_uuid: str
+
+
+@dataclass
+class SetProfilePic(Command):
     user_uuid: str
+    picture: object  # bytes, or a file object / chunk iterable streamed to the blob store
 
 
 @dataclass
@@ -0,0 +1,62 @@
+"""
+    By Etienne Quenon
+"""
+
+import copy
+import itertools
+import threading
+from typing import Dict, Iterable, List
+import user
+
+
+class CommentIndex:
+    """
+        Comments grouped by the ad or profile they are about, with the number of comments of every target.
+        It is kept up to date by the comment handlers (see AbstractWorker.comment_index).
+    """
+
+    def __init__(self, comments: Iterable[user.Comment] = ()):
+        self._targets = {}  # Type Dict[str, user.UuidIndex], target uuid -> its comments, oldest first
+        self._lock = threading.RLock()
+        for comment in comments:
+            self.add(comment)
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def add(self, comment: user.Comment):
+        """ Indexes a new or modified comment, a modified comment keeps its place. """
+        with self._lock:
+            comment = copy.copy(comment)  # The caller's object may be mutated by a later unit of work
+            target = self._targets.get(comment.target_uuid)
+            if target is None:
+                target = self._targets[comment.target_uuid] = user.UuidIndex()
+            target.append(comment)
+
+    def remove(self, target_uuid: str, comment_uuid: str):
+        with self._lock:
+            target = self._targets.get(target_uuid)
+            if target is None:
+                return
+            target.pop(comment_uuid, None)
+            if not len(target):
+                del self._targets[target_uuid]
+
+    def count(self, target_uuid: str) -> int:
+        target = self._targets.get(target_uuid)
+        return len(target) if target is not None else 0
+
+    def counts(self, target_uuids: Iterable[str]) -> Dict[str, int]:
+        """ Comment totals of a whole listing at once, e.g. the ads of a search page. """
+        with self._lock:
+            return {target_uuid: self.count(target_uuid) for target_uuid in target_uuids}
+
+    def comments(self, target_uuid: str, page: int = 1, per_page: int = 20) -> List[user.Comment]:
+        """ The comments about target_uuid, newest first. """
+        with self._lock:
+            target = self._targets.get(target_uuid)
+            if target is None:
+                return []
+            start = (page - 1) * per_page
+            # One walk from the newest comment to the end of the page, rather than one per comment.
+            return list(itertools.islice(reversed(target), start, start + per_page))
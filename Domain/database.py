@@ -3,6 +3,41 @@
 """
 
 import abc
+import asyncio
+import copy
+import pickle
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+import readmodels
+import user
+
+
+class ConcurrentUpdate(Exception):
+    """ The object was updated by another unit of work since it was read ! """
+
+
+class PartialCommit(Exception):
+    """ The unit of work was committed on some shards only, running it again would apply it twice ! """
+
+
+SQLITE_BUSY = 5
+SQLITE_BUSY_SNAPSHOT = 517  # SQLITE_BUSY | (2 << 8)
+
+
+def is_conflict(error: Exception) -> bool:
+    """
+        Whether running the unit of work again may succeed: SQLite refused to write on a stale snapshot, or a version check failed.
+        In WAL mode a worker reads and writes in one deferred transaction, so a concurrent commit makes its first write fail with
+        SQLITE_BUSY_SNAPSHOT before any version is compared. The version column (ConcurrentUpdate) guards the objects read outside
+        the writing transaction: on an autocommit connection, or on another connection than the one writing.
+    """
+    if isinstance(error, ConcurrentUpdate):
+        return True
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, "sqlite_errorcode", None)  # Python 3.11+
+    return code in (SQLITE_BUSY, SQLITE_BUSY_SNAPSHOT) if code is not None else str(error).startswith("database is locked")
 
 
 class AbstractDatabase(abc.ABC):
@@ -20,5 +55,644 @@ class AbstractDatabase(abc.ABC):
 
     @abc.abstractmethod
     def update(self, obj: object):
+        """ Raises ConcurrentUpdate when obj was updated by someone else since this database read it. """
+        raise NotImplementedError
+
+    def discard(self):
+        """ Forgets what was read by the unit of work (e.g. the versions of the objects), called once it is over. """
+
+    def savepoint(self):
+        """ A nested unit of work starts, what it reads can be forgotten by rollback_to_savepoint(). """
+
+    def release_savepoint(self):
+        """ The nested unit of work was committed, what it read now belongs to the enclosing one. """
+
+    def rollback_to_savepoint(self):
+        """ The nested unit of work was rolled back, only what it read since the savepoint is forgotten. """
+
+
+class IdentityMap(AbstractDatabase):
+    """
+        Unit of work view of another database: every object read or written is kept in memory by uuid,
+        and writes are only recorded until flush() sends them to the underlying database in one go.
+    """
+
+    def __init__(self, db: AbstractDatabase):
+        self.db = db
+        self._objects = {}  # Type Dict[str, object]
+        self._pending = {}  # Type Dict[str, Tuple[str, object]], in write order
+        self._touched = []  # Type List[Set[str]], uuids read or written by every nested unit of work, innermost last
+
+    def create(self, obj: object):
+        key = self._key(obj)
+        previous = self._pending.get(key)
+        self._pending[key] = ("update" if previous and previous[0] == "delete" else "create", obj)
+        self._remember(obj)
+
+    def read(self, uuid: str):
+        hit, obj = self.lookup(uuid)
+        if hit:
+            return obj
+        return self.loaded(uuid, self.db.read(uuid))
+
+    def delete(self, uuid: str):
+        self._touch(uuid)
+        self._objects.pop(uuid, None)
+        previous = self._pending.pop(uuid, None)
+        if not previous or previous[0] != "create":
+            self._pending[uuid] = ("delete", None)
+
+    def update(self, obj: object):
+        key = self._key(obj)
+        previous = self._pending.get(key)
+        self._pending[key] = ("create" if previous and previous[0] == "create" else "update", obj)
+        self._remember(obj)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending)
+
+    def lookup(self, uuid: str):
+        """ Returns (True, obj) when the unit of work already knows the answer, without touching the database. """
+        if uuid in self._objects:
+            self._touch(uuid)
+            return True, self._objects[uuid]
+        pending = self._pending.get(uuid)
+        if pending and pending[0] == "delete":
+            return True, None
+        return False, None
+
+    def loaded(self, uuid: str, obj):
+        if obj is not None:
+            self._touch(uuid)
+            self._objects[uuid] = obj
+        return obj
+
+    def take_pending(self):
+        pending, self._pending = self._pending, {}
+        return pending.items()  # Type Iterable[Tuple[key, Tuple[operation, object]]]
+
+    def flush(self):
+        for key, (operation, obj) in self.take_pending():
+            if operation == "create":
+                self.db.create(obj)
+            elif operation == "update":
+                self.db.update(obj)
+            else:
+                self.db.delete(key)
+
+    def discard(self):
+        self._pending.clear()
+        self._objects.clear()
+        self._touched.clear()
+        if self.db is not None:
+            self.db.discard()
+
+    def savepoint(self):
+        """ Pending writes must be flushed first: rolling back drops every write still pending. """
+        self._touched.append(set())
+        if self.db is not None:
+            self.db.savepoint()
+
+    def release_savepoint(self):
+        touched = self._touched.pop()
+        if self._touched:
+            self._touched[-1].update(touched)
+        if self.db is not None:
+            self.db.release_savepoint()
+
+    def rollback_to_savepoint(self):
+        # The objects the nested unit touched may have been mutated in memory, they are read again from the database.
+        # The others, read by the enclosing unit only, are kept.
+        for uuid in self._touched.pop():
+            self._objects.pop(uuid, None)
+        self._pending.clear()
+        if self.db is not None:
+            self.db.rollback_to_savepoint()
+
+    @staticmethod
+    def _key(obj: object):
+        return obj.uuid
+
+    def _remember(self, obj: object):
+        self._touch(obj.uuid)
+        self._objects[obj.uuid] = obj
+
+    def _touch(self, uuid: str):
+        if self._touched:
+            self._touched[-1].add(uuid)
+
+
+class LazyUuidIndex(user.UuidIndex):
+    """
+        UuidIndex whose items stay in the database: get() and pop() fetch a single row,
+        only iterating (or len, or a position) loads the whole list.
+    """
+    __slots__ = ("_fetch_one", "_fetch_all", "_complete", "_added", "_removed")
+
+    def __init__(self, fetch_one: Callable, fetch_all: Callable, key: str = "uuid"):
+        super().__init__(key=key)
+        self._fetch_one = fetch_one  # Type Callable[[str], Optional[object]]
+        self._fetch_all = fetch_all  # Type Callable[[], Iterable[object]]
+        self._complete = False
+        self._added = {}  # Type Dict[str, object], appended since the index was loaded
+        self._removed = set()  # Type Set[str]
+
+    def get(self, uuid: str, default=None):
+        item = self._items.get(uuid)
+        if item is None and not self._complete and uuid not in self._removed:
+            item = self._fetch_one(uuid)
+            if item is not None:
+                self._items[uuid] = item
+        return default if item is None else item
+
+    def append(self, item):
+        key = getattr(item, self._key)
+        self._removed.discard(key)
+        self._added[key] = item
+        self._items[key] = item
+
+    def remove(self, item):
+        if self.pop(getattr(item, self._key), None) is None:
+            raise KeyError(getattr(item, self._key))
+
+    def pop(self, uuid: str, *default):
+        if self.get(uuid) is None:
+            if default:
+                return default[0]
+            raise KeyError(uuid)
+        self._added.pop(uuid, None)
+        self._removed.add(uuid)
+        return self._items.pop(uuid)
+
+    def unsaved(self) -> list:
+        """ Items appended since the index was read from the database. """
+        return list(self._added.values())
+
+    def __contains__(self, item) -> bool:
+        return self.get(getattr(item, self._key, item)) is not None
+
+    def __iter__(self):
+        self._load()
+        return super().__iter__()
+
+    def __reversed__(self):
+        self._load()
+        return super().__reversed__()
+
+    def __len__(self) -> int:
+        self._load()
+        return super().__len__()
+
+    def __getitem__(self, position: int):
+        self._load()
+        return super().__getitem__(position)
+
+    def __repr__(self):
+        return f"<LazyUuidIndex {len(self._items)} loaded>"
+
+    def _load(self):
+        if self._complete:
+            return
+        items = {}
+        for item in self._fetch_all():
+            key = getattr(item, self._key)
+            if key not in self._removed and key not in self._added:
+                items[key] = self._items.get(key, item)  # Keep the instances already handed out
+        items.update(self._added)
+        self._items = items
+        self._complete = True
+
+
+class AbstractAsyncDatabase(abc.ABC):
+    @abc.abstractmethod
+    async def create(self, obj: object):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def read(self, uuid: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, uuid: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def update(self, obj: object):
         raise NotImplementedError
 
+    def discard(self):
+        pass
+
+    def savepoint(self):
+        """ See AbstractDatabase.savepoint, the in-memory hooks aren't awaited. """
+
+    def release_savepoint(self):
+        pass
+
+    def rollback_to_savepoint(self):
+        pass
+
+
+class AsyncDatabase(AbstractAsyncDatabase):
+    """ Runs a blocking database in a thread, so the event loop keeps serving other requests meanwhile. """
+
+    def __init__(self, db: AbstractDatabase):
+        self.db = db
+
+    async def create(self, obj: object):
+        await asyncio.to_thread(self.db.create, obj)
+
+    async def read(self, uuid: str):
+        return await asyncio.to_thread(self.db.read, uuid)
+
+    async def delete(self, uuid: str):
+        await asyncio.to_thread(self.db.delete, uuid)
+
+    async def update(self, obj: object):
+        await asyncio.to_thread(self.db.update, obj)
+
+    def discard(self):
+        self.db.discard()
+
+    def savepoint(self):
+        self.db.savepoint()
+
+    def release_savepoint(self):
+        self.db.release_savepoint()
+
+    def rollback_to_savepoint(self):
+        self.db.rollback_to_savepoint()
+
+
+class AsyncIdentityMap(AbstractAsyncDatabase):
+    """ IdentityMap of an async database: only cache misses and flush() await the database. """
+
+    def __init__(self, db: AbstractAsyncDatabase):
+        self.db = db
+        self._map = IdentityMap(None)
+
+    async def create(self, obj: object):
+        self._map.create(obj)
+
+    async def read(self, uuid: str):
+        hit, obj = self._map.lookup(uuid)
+        if hit:
+            return obj
+        return self._map.loaded(uuid, await self.db.read(uuid))
+
+    async def delete(self, uuid: str):
+        self._map.delete(uuid)
+
+    async def update(self, obj: object):
+        self._map.update(obj)
+
+    @property
+    def dirty(self) -> bool:
+        return self._map.dirty
+
+    async def flush(self):
+        for key, (operation, obj) in self._map.take_pending():
+            if operation == "create":
+                await self.db.create(obj)
+            elif operation == "update":
+                await self.db.update(obj)
+            else:
+                await self.db.delete(key)
+
+    def discard(self):
+        self._map.discard()
+        self.db.discard()
+
+    def savepoint(self):
+        self._map.savepoint()
+        self.db.savepoint()
+
+    def release_savepoint(self):
+        self._map.release_savepoint()
+        self.db.release_savepoint()
+
+    def rollback_to_savepoint(self):
+        self._map.rollback_to_savepoint()
+        self.db.rollback_to_savepoint()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domain_object (
+    uuid TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS domain_user (
+    uuid TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS domain_advertisement (
+    uuid TEXT PRIMARY KEY,
+    owner_uuid TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS domain_advertisement_owner ON domain_advertisement (owner_uuid);
+
+CREATE TABLE IF NOT EXISTS domain_premium_advertisement (
+    uuid TEXT PRIMARY KEY,
+    provider_uuid TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS domain_premium_advertisement_provider ON domain_premium_advertisement (provider_uuid);
+
+CREATE TABLE IF NOT EXISTS domain_comment (
+    uuid TEXT PRIMARY KEY,
+    owner_uuid TEXT NOT NULL,
+    target_uuid TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS domain_comment_owner ON domain_comment (owner_uuid, timestamp, uuid);
+CREATE INDEX IF NOT EXISTS domain_comment_target ON domain_comment (target_uuid, timestamp, uuid);
+
+CREATE TABLE IF NOT EXISTS domain_report (
+    uuid TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS domain_report_status ON domain_report (status, timestamp, uuid);
+
+CREATE TABLE IF NOT EXISTS domain_report_comment (
+    uuid TEXT PRIMARY KEY,
+    report_uuid TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS domain_report_comment_report ON domain_report_comment (report_uuid, timestamp, uuid);
+
+CREATE TABLE IF NOT EXISTS domain_outbox (
+    uuid TEXT PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS domain_outbox_due ON domain_outbox (failed, next_attempt);
+
+CREATE TABLE IF NOT EXISTS domain_rate_limit (
+    key TEXT PRIMARY KEY,
+    window INTEGER NOT NULL,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS domain_page_version (
+    scope TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def connect(path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    # isolation_level=None: transactions are opened and closed explicitly by the worker.
+    connection = sqlite3.connect(path, isolation_level=None, cached_statements=256, check_same_thread=check_same_thread)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA + readmodels.SCHEMA)
+    return connection
+
+
+@dataclass
+class CommentPage:
+    comments: List[user.Comment]  # Newest first
+    cursor: Optional[Tuple[float, str]] = None  # Pass it as before= to get the next (older) page, None on the last page
+
+
+class SqliteDatabase(AbstractDatabase):
+    """ Every statement below is a constant string, so sqlite3 keeps it prepared in the connection statement cache. """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+        self.read_models = readmodels.SqliteReadModels(connection)
+        self._versions = {}  # Type Dict[str, int], version of the objects read by the current unit of work, checked by update()
+        self._savepoints = []  # Type List[Dict[str, Optional[int]]], versions replaced by every nested unit of work, innermost last
+
+    def create(self, obj: object):
+        kind = self._kind(obj)
+        self._connection.execute("INSERT OR IGNORE INTO domain_object (uuid, kind) VALUES (?, ?)", (obj.uuid, kind))
+        self._write(kind, obj)
+        # Children are upserted as well: the unit of work may also flush their own create.
+        if kind == "provider":
+            for ad in obj._ads:
+                self.create(ad)
+            for premium_ad in obj._premium_ads:
+                self.create(premium_ad)
+        elif kind == "visitor":
+            for comment in obj.comments:
+                self.create(comment)
+
+    def read(self, uuid: str):
+        row = self._connection.execute("SELECT kind, version FROM domain_object WHERE uuid = ?", (uuid,)).fetchone()
+        if row is None:
+            return None
+        kind, version = row
+        self._set_version(uuid, version)
+        if kind == "advertisement":
+            return self._load(self._connection.execute("SELECT data FROM domain_advertisement WHERE uuid = ?", (uuid,)))
+        if kind == "comment":
+            return self._load(self._connection.execute("SELECT data FROM domain_comment WHERE uuid = ?", (uuid,)))
+        if kind == "report":
+            report = self._load(self._connection.execute("SELECT data FROM domain_report WHERE uuid = ?", (uuid,)))
+            report.comment = LazyUuidIndex(
+                lambda comment_uuid: self._load(self._connection.execute("SELECT data FROM domain_report_comment WHERE uuid = ? AND report_uuid = ?", (comment_uuid, uuid))),
+                lambda: (pickle.loads(data) for data, in self._connection.execute("SELECT data FROM domain_report_comment WHERE report_uuid = ? ORDER BY timestamp, uuid", (uuid,))))
+            return report
+        if kind == "premium":
+            return self._load(self._connection.execute("SELECT data FROM domain_premium_advertisement WHERE uuid = ?", (uuid,)))
+        obj = self._load(self._connection.execute("SELECT data FROM domain_user WHERE uuid = ?", (uuid,)))
+        if kind == "provider":
+            # Lazy, publishing an ad only looks its uuid up: a bulk import doesn't read back every ad of the provider.
+            obj._ads = LazyUuidIndex(
+                lambda ad_uuid: next(self._versioned("SELECT a.data, o.version FROM domain_advertisement a JOIN domain_object o ON o.uuid = a.uuid "
+                                                     "WHERE a.uuid = ? AND a.owner_uuid = ?", (ad_uuid, uuid)), None),
+                lambda: self._versioned("SELECT a.data, o.version FROM domain_advertisement a JOIN domain_object o ON o.uuid = a.uuid "
+                                        "WHERE a.owner_uuid = ? ORDER BY a.rowid", (uuid,)))
+            obj._premium_ads = user.UuidIndex((pickle.loads(data) for data, in self._connection.execute("SELECT data FROM domain_premium_advertisement WHERE provider_uuid = ? ORDER BY rowid", (uuid,))), key="ad_uuid")
+        elif kind == "visitor":
+            obj.comments = LazyUuidIndex(
+                lambda comment_uuid: next(self._versioned("SELECT c.data, o.version FROM domain_comment c JOIN domain_object o ON o.uuid = c.uuid "
+                                                          "WHERE c.uuid = ? AND c.owner_uuid = ?", (comment_uuid, uuid)), None),
+                lambda: self._versioned("SELECT c.data, o.version FROM domain_comment c JOIN domain_object o ON o.uuid = c.uuid "
+                                        "WHERE c.owner_uuid = ? ORDER BY c.timestamp, c.uuid", (uuid,)))
+        return obj
+
+    def comments_page(self, owner_uuid: str, before: Tuple[float, str] = None, limit: int = 20) -> CommentPage:
+        """ The comments of a visitor, newest first, limit at a time. """
+        return self._comment_page("SELECT timestamp, uuid, data FROM domain_comment WHERE owner_uuid = ? "
+                                  "AND (timestamp, uuid) < (?, ?) ORDER BY timestamp DESC, uuid DESC LIMIT ?",
+                                  owner_uuid, before, limit)
+
+    def target_comments_page(self, target_uuid: str, before: Tuple[float, str] = None, limit: int = 20) -> CommentPage:
+        """ The comments about an ad or a profile, newest first, limit at a time. """
+        return self._comment_page("SELECT timestamp, uuid, data FROM domain_comment WHERE target_uuid = ? "
+                                  "AND (timestamp, uuid) < (?, ?) ORDER BY timestamp DESC, uuid DESC LIMIT ?",
+                                  target_uuid, before, limit)
+
+    def report_comments_page(self, report_uuid: str, before: Tuple[float, str] = None, limit: int = 20) -> CommentPage:
+        """ The comment thread of a report, newest first, limit at a time. """
+        return self._comment_page("SELECT timestamp, uuid, data FROM domain_report_comment WHERE report_uuid = ? "
+                                  "AND (timestamp, uuid) < (?, ?) ORDER BY timestamp DESC, uuid DESC LIMIT ?",
+                                  report_uuid, before, limit)
+
+    def _comment_page(self, query: str, parent_uuid: str, before: Optional[Tuple[float, str]], limit: int) -> CommentPage:
+        # Keyset pagination: the cursor is the (timestamp, uuid) of the last comment shown, so every page is an index range scan.
+        timestamp, comment_uuid = before if before is not None else (float("inf"), "")
+        rows = self._connection.execute(query, (parent_uuid, timestamp, comment_uuid, limit + 1)).fetchall()
+        cursor = (rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+        return CommentPage([pickle.loads(data) for _, _, data in rows[:limit]], cursor)
+
+    def delete(self, uuid: str):
+        row = self._connection.execute("SELECT kind FROM domain_object WHERE uuid = ?", (uuid,)).fetchone()
+        if row is None:
+            return
+        kind = row[0]
+        self._connection.execute("DELETE FROM domain_object WHERE uuid = ?", (uuid,))
+        if kind == "advertisement":
+            self.delete(user.PremiumAdvertisement.uuid_of(uuid))
+            owner, = self._connection.execute("DELETE FROM domain_advertisement WHERE uuid = ? RETURNING owner_uuid", (uuid,)).fetchone()
+            self.read_models.ad_deleted(uuid, owner)
+        elif kind == "premium":
+            for data, in self._connection.execute("DELETE FROM domain_premium_advertisement WHERE uuid = ? RETURNING data", (uuid,)).fetchall():
+                premium_ad = pickle.loads(data)
+                self.read_models.premium_deleted(premium_ad.ad_uuid, premium_ad.provider_uuid)
+        elif kind == "comment":
+            self._connection.execute("DELETE FROM domain_comment WHERE uuid = ?", (uuid,))
+        elif kind == "report":
+            self._connection.execute("DELETE FROM domain_report WHERE uuid = ?", (uuid,))
+            self._connection.execute("DELETE FROM domain_report_comment WHERE report_uuid = ?", (uuid,))
+        else:
+            self._connection.execute("DELETE FROM domain_user WHERE uuid = ?", (uuid,))
+            if kind == "provider":
+                self.read_models.provider_deleted(uuid)
+
+    def update(self, obj: object):
+        # Optimistic concurrency: the version must still be the one read, without any lock held between the read and the write.
+        kind = self._kind(obj)
+        expected = self._versions.get(obj.uuid)
+        if expected is None:  # Not read by this unit of work, nothing to check
+            version, = self._connection.execute("INSERT INTO domain_object (uuid, kind) VALUES (?, ?) "
+                                                "ON CONFLICT (uuid) DO UPDATE SET version = version + 1 RETURNING version", (obj.uuid, kind)).fetchone()
+        else:
+            row = self._connection.execute("UPDATE domain_object SET version = version + 1 WHERE uuid = ? AND version = ? RETURNING version",
+                                           (obj.uuid, expected)).fetchone()
+            if row is None:
+                raise ConcurrentUpdate(obj.uuid)
+            version, = row
+        self._set_version(obj.uuid, version)
+        self._write(kind, obj)
+
+    def discard(self):
+        self._versions.clear()
+        self._savepoints.clear()
+
+    def savepoint(self):
+        self._savepoints.append({})
+
+    def release_savepoint(self):
+        replaced = self._savepoints.pop()
+        if self._savepoints:
+            for uuid, version in replaced.items():
+                self._savepoints[-1].setdefault(uuid, version)
+
+    def rollback_to_savepoint(self):
+        for uuid, version in self._savepoints.pop().items():
+            if version is None:
+                self._versions.pop(uuid, None)
+            else:
+                self._versions[uuid] = version
+
+    def scan(self, kind: str) -> Iterator:
+        """ Streams every stored "advertisement", "premium", "comment" or "report", in insertion order. """
+        table = {"advertisement": "domain_advertisement", "premium": "domain_premium_advertisement",
+                 "comment": "domain_comment", "report": "domain_report"}[kind]
+        for data, in self._connection.execute(f"SELECT data FROM {table} ORDER BY rowid"):
+            yield pickle.loads(data)
+
+    @staticmethod
+    def _kind(obj: object) -> str:
+        if isinstance(obj, user.Provider):
+            return "provider"
+        if isinstance(obj, user.Visitor):
+            return "visitor"
+        if isinstance(obj, user.User):
+            return "user"
+        if isinstance(obj, user.Advertisement):
+            return "advertisement"
+        if isinstance(obj, user.Comment):
+            return "comment"
+        if isinstance(obj, user.Report):
+            return "report"
+        if isinstance(obj, user.PremiumAdvertisement):
+            return "premium"
+        raise TypeError(f"Can't store {type(obj).__name__} objects")
+
+    def _write(self, kind: str, obj):
+        # The upserts keep the rowid of existing rows, so per-owner listings stay in insertion order.
+        if kind == "advertisement":
+            self._connection.execute("INSERT INTO domain_advertisement (uuid, owner_uuid, data) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (uuid) DO UPDATE SET owner_uuid = excluded.owner_uuid, data = excluded.data",
+                                     (obj.uuid, obj.owner, self._dump(obj)))
+            self.read_models.ad_written(obj)
+        elif kind == "comment":
+            self._connection.execute("INSERT INTO domain_comment (uuid, owner_uuid, target_uuid, timestamp, data) VALUES (?, ?, ?, ?, ?) "
+                                     "ON CONFLICT (uuid) DO UPDATE SET target_uuid = excluded.target_uuid, data = excluded.data",
+                                     (obj.uuid, obj.owner_uuid, obj.target_uuid, obj.timestamp.timestamp(), self._dump(obj)))
+        elif kind == "report":
+            # A loaded thread only writes the comments added since, a new report writes all of them.
+            comments = obj.comment.unsaved() if isinstance(obj.comment, LazyUuidIndex) else obj.comment
+            self._connection.executemany("INSERT INTO domain_report_comment (uuid, report_uuid, timestamp, data) VALUES (?, ?, ?, ?) "
+                                         "ON CONFLICT (uuid) DO UPDATE SET data = excluded.data",
+                                         [(comment.uuid, obj.uuid, comment.timestamp.timestamp(), self._dump(comment)) for comment in comments])
+            state = copy.copy(obj)
+            state.comment = user.UuidIndex()
+            self._connection.execute("INSERT INTO domain_report (uuid, status, timestamp, data) VALUES (?, ?, ?, ?) "
+                                     "ON CONFLICT (uuid) DO UPDATE SET status = excluded.status, data = excluded.data",
+                                     (obj.uuid, obj.status, obj.timestamp.timestamp(), self._dump(state)))
+        elif kind == "premium":
+            self._connection.execute("INSERT INTO domain_premium_advertisement (uuid, provider_uuid, data) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (uuid) DO UPDATE SET data = excluded.data",
+                                     (obj.uuid, obj.provider_uuid, self._dump(obj)))
+            self.read_models.premium_written(obj)
+        else:
+            # Ads, premium ads and comments have their own tables, the user row only holds the user itself.
+            state = copy.copy(obj)
+            if kind == "provider":
+                state._ads = user.UuidIndex()
+                state._premium_ads = user.UuidIndex(key="ad_uuid")
+            elif kind == "visitor":
+                state.comments = user.UuidIndex()
+            self._connection.execute("INSERT INTO domain_user (uuid, data) VALUES (?, ?) "
+                                     "ON CONFLICT (uuid) DO UPDATE SET data = excluded.data",
+                                     (obj.uuid, self._dump(state)))
+            if kind == "provider":
+                self.read_models.provider_written(obj)
+
+    @staticmethod
+    def _dump(obj) -> bytes:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _versioned(self, query: str, parameters: tuple) -> Iterator:
+        """ Objects of (data, version) rows, their versions are recorded for update(). """
+        for data, version in self._connection.execute(query, parameters):
+            obj = pickle.loads(data)
+            self._set_version(obj.uuid, version)
+            yield obj
+
+    def _set_version(self, uuid: str, version: int):
+        if self._savepoints and uuid not in self._savepoints[-1]:
+            self._savepoints[-1][uuid] = self._versions.get(uuid)
+        self._versions[uuid] = version
+
+    @staticmethod
+    def _load(cursor: sqlite3.Cursor):
+        row = cursor.fetchone()
+        return pickle.loads(row[0]) if row is not None else None
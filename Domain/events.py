@@ -0,0 +1,201 @@
+"""
+    By Etienne Quenon
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Type
+import user
+
+
+logger = logging.getLogger(__name__)
+
+
+class Event:
+    """ Something that happened in a committed unit of work, see AbstractWorker.emit. """
+
+
+@dataclass(frozen=True)
+class AdPublished(Event):
+    ad: user.Advertisement
+
+
+@dataclass(frozen=True)
+class AdRepublished(AdPublished):
+    """ The published date (and so the expiry date) of the ad was bumped. """
+
+
+@dataclass(frozen=True)
+class AdUpdated(Event):
+    ad: user.Advertisement
+
+
+@dataclass(frozen=True)
+class AdUnpublished(Event):
+    ad: user.Advertisement
+
+
+@dataclass(frozen=True)
+class AdExpired(AdUnpublished):
+    pass
+
+
+@dataclass(frozen=True)
+class AdDeleted(Event):
+    owner: str
+    ad_uuid: str
+
+
+@dataclass(frozen=True)
+class AdPromoted(Event):
+    premium_ad: user.PremiumAdvertisement
+    ad: user.Advertisement
+
+
+@dataclass(frozen=True)
+class PremiumAdExpired(Event):
+    premium_ad: user.PremiumAdvertisement
+
+
+@dataclass(frozen=True)
+class CommentAdded(Event):
+    comment: user.Comment
+
+
+@dataclass(frozen=True)
+class CommentModified(Event):
+    comment: user.Comment
+
+
+@dataclass(frozen=True)
+class CommentDeleted(Event):
+    comment: user.Comment
+
+
+@dataclass(frozen=True)
+class ReportCreated(Event):
+    report: user.Report
+
+
+@dataclass(frozen=True)
+class ReportCommented(Event):
+    report: user.Report
+
+
+@dataclass(frozen=True)
+class ReportOpened(Event):
+    report: user.Report
+
+
+@dataclass(frozen=True)
+class ReportClosed(Event):
+    report: user.Report
+
+
+@dataclass(frozen=True)
+class UserActivated(Event):
+    user_uuid: str
+
+
+@dataclass(frozen=True)
+class UserDisabled(Event):
+    user_uuid: str
+
+
+@dataclass(frozen=True)
+class SmsSent(Event):
+    user_uuid: str
+
+
+@dataclass(frozen=True)
+class ProviderUpdated(Event):
+    """ Billing or private pictures changed. """
+    provider_uuid: str
+
+
+@dataclass(frozen=True)
+class ProfileUpdated(Event):
+    user_uuid: str
+
+
+@dataclass(frozen=True)
+class PicturesUploaded(Event):
+    owner_uuid: str
+    pictures: tuple  # Tuple[blobs.BlobRef]
+
+
+class EventBus:
+    """
+        In-process synchronous subscribers, called in subscription order once the unit of work is committed.
+        Subscribing to a base class (e.g. Event) receives its subclasses too.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)  # Type Dict[Type[Event], List[Callable[[Event], None]]]
+
+    def subscribe(self, event_type: Type[Event], subscriber: Callable):
+        self._subscribers[event_type].append(subscriber)
+
+    def unsubscribe(self, event_type: Type[Event], subscriber: Callable):
+        self._subscribers[event_type].remove(subscriber)
+
+    def publish(self, events: Iterable[Event]):
+        # The data is already committed: a failing subscriber is logged, it doesn't stop the others.
+        for event in events:
+            for event_type in type(event).__mro__:
+                for subscriber in self._subscribers.get(event_type, ()):
+                    try:
+                        subscriber(event)
+                    except Exception:
+                        logger.exception("Subscriber %r failed on %r", subscriber, event)
+
+
+class AsyncBatchConsumer:
+    """
+        Subscriber handing the events over to an event loop, where consume is awaited with up to batch_size events at a time.
+        Calling it is thread-safe, so it can be subscribed to the EventBus of a synchronous worker.
+    """
+
+    def __init__(self, consume: Callable[[List[Event]], Awaitable], batch_size: int = 100):
+        self.consume = consume
+        self.batch_size = batch_size
+        self._queue = None  # Type Optional[asyncio.Queue], created in the consumer loop by run()
+        self._loop = None  # Type Optional[asyncio.AbstractEventLoop]
+        self._started = asyncio.Event()
+
+    def __call__(self, event: Event):
+        if self._loop is None:
+            raise RuntimeError("AsyncBatchConsumer.run() isn't running")
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    async def run(self):
+        """ Consumes the events until cancelled, the events already queued are consumed first. """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._started.set()
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                await self._consume(batch)
+        except asyncio.CancelledError:
+            batch = []
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch:
+                await self._consume(batch)
+            raise
+        finally:
+            self._loop = None
+
+    async def started(self):
+        await self._started.wait()
+
+    async def _consume(self, batch: List[Event]):
+        try:
+            await self.consume(batch)
+        except Exception:
+            logger.exception("Consumer %r failed on %d events", self.consume, len(batch))
@@ -0,0 +1,137 @@
+"""
+    By Etienne Quenon
+"""
+
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+from typing import List, Optional
+import commands
+import database
+import user
+
+
+logger = logging.getLogger(__name__)
+
+AD = "ad"
+PREMIUM = "premium"
+
+
+class ExpiryScheduler:
+    """
+        Min-heap of the upcoming expiries of ads and premium promotions, kept up to date by the handlers
+        (see AbstractWorker.expiry). Rescheduling or cancelling marks the old heap entry as stale instead of
+        searching for it, so both are O(log n); stale entries are skipped when popped.
+    """
+
+    def __init__(self):
+        self._heap = []  # Type List[list], [expiry_date, sequence, kind, owner, ad_uuid, valid]
+        self._entries = {}  # Type Dict[Tuple[str, str], list], (kind, ad_uuid) -> live heap entry
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def schedule(self, kind: str, owner: str, ad_uuid: str, expiry_date: datetime.datetime):
+        with self._lock:
+            self._invalidate(kind, ad_uuid)
+            if expiry_date is None:
+                return
+            entry = [expiry_date, next(self._sequence), kind, owner, ad_uuid, True]
+            self._entries[kind, ad_uuid] = entry
+            heapq.heappush(self._heap, entry)
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._compact()
+
+    def cancel(self, kind: str, ad_uuid: str):
+        with self._lock:
+            self._invalidate(kind, ad_uuid)
+
+    def schedule_provider(self, provider: user.Provider):
+        """ (Re)schedules every published ad and promotion of a Provider, e.g. when the scheduler is rebuilt at start-up. """
+        for ad in provider._ads:
+            if ad.published:
+                self.schedule(AD, provider.uuid, ad.uuid, ad.expiry_date)
+        for premium_ad in provider._premium_ads:
+            self.schedule(PREMIUM, provider.uuid, premium_ad.ad_uuid, premium_ad.expiry_date)
+
+    def schedule_stored(self, db):
+        """ Schedules every published ad and promotion stored in a database.AbstractDatabase, in one scan of each kind. """
+        for ad in db.scan("advertisement"):
+            if ad.published:
+                self.schedule(AD, ad.owner, ad.uuid, ad.expiry_date)
+        for premium_ad in db.scan("premium"):
+            self.schedule(PREMIUM, premium_ad.provider_uuid, premium_ad.ad_uuid, premium_ad.expiry_date)
+
+    def next_expiry(self) -> datetime.datetime:
+        with self._lock:
+            while self._heap and not self._heap[0][5]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime.datetime, limit: int = None) -> List[commands.Command]:
+        """ Removes the entries expired at now, and returns the commands that expire them. """
+        entries = self._take_due(now, limit)
+        with self._lock:
+            for entry in entries:
+                self._forget(entry)
+        return [self._command(entry, now) for entry in entries]
+
+    def run_due(self, bus, now: datetime.datetime = None, limit: int = 1000) -> list:
+        """
+            Expires everything due through a messagebus.MessageBus, in a single batch (one transaction) of at most limit entries.
+            An entry is removed once its command succeeded, or failed for good (AdNotFound, AdNotExpired, its owner deleted, ...):
+            only the entries of a batch that raised, or of a command that failed on a conflict, are due again at the next run.
+        """
+        now = now or datetime.datetime.now()
+        entries = self._take_due(now, limit)
+        if not entries:
+            return []
+        results = []
+        try:
+            results = bus.handle_batch([self._command(entry, now) for entry in entries])
+        finally:
+            with self._lock:
+                for entry, result in itertools.zip_longest(entries, results):
+                    if result is not None and (result.ok or not database.is_conflict(result.error)):
+                        if not result.ok:
+                            logger.warning("Expiry of %s %s dropped: %r", entry[2], entry[4], result.error)
+                        self._forget(entry)
+                    elif entry[5]:  # Neither cancelled nor rescheduled meanwhile
+                        heapq.heappush(self._heap, entry)
+        return results
+
+    def _take_due(self, now: datetime.datetime, limit: Optional[int]) -> List[list]:
+        """ Pops the live entries expired at now off the heap, they stay in _entries until forgotten or pushed back. """
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                entry = heapq.heappop(self._heap)
+                if entry[5]:
+                    due.append(entry)
+        return due
+
+    def _forget(self, entry: list):
+        _, _, kind, _, ad_uuid, _ = entry
+        if self._entries.get((kind, ad_uuid)) is entry:
+            del self._entries[kind, ad_uuid]
+        entry[5] = False
+
+    @staticmethod
+    def _command(entry: list, now: datetime.datetime) -> commands.Command:
+        _, _, kind, owner, ad_uuid, _ = entry
+        if kind == AD:
+            return commands.ExpireAdvertisement(owner, ad_uuid, now)
+        return commands.ExpirePremiumAdvertisement(owner, ad_uuid, now)
+
+    def _invalidate(self, kind: str, ad_uuid: str):
+        entry = self._entries.pop((kind, ad_uuid), None)
+        if entry is not None:
+            entry[5] = False
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[5]]
+        heapq.heapify(self._heap)
@@ -0,0 +1,107 @@
+"""
+    By Etienne Quenon
+"""
+
+import bisect
+import copy
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Tuple
+import user
+
+
+@dataclass(frozen=True)
+class FeedItem:
+    premium_ad: user.PremiumAdvertisement
+    ad: user.Advertisement
+
+
+@dataclass(frozen=True)
+class FeedPage:
+    version: int  # Changes whenever the feed does, usable as an ETag
+    total: int
+    page: int
+    per_page: int
+    items: Tuple[FeedItem, ...]
+
+    @property
+    def has_next(self) -> bool:
+        return self.page * self.per_page < self.total
+
+    @property
+    def has_previous(self) -> bool:
+        return self.page > 1
+
+
+class PremiumFeed:
+    """
+        Site-wide list of the premium ads of every Provider, newest promotion first (or soonest to expire first).
+        It is kept sorted as promotions come and go (see AbstractWorker.premium_feed), pages are cached until the next change.
+    """
+
+    def __init__(self, order_by: str = "date_published", items: Iterable[Tuple[user.PremiumAdvertisement, user.Advertisement]] = ()):
+        self.order_by = order_by
+        self.version = 0
+        self._keys = []  # Type List[tuple], sorted
+        self._items = {}  # Type Dict[str, Tuple[tuple, FeedItem]], ad uuid -> (sort key, item)
+        self._pages = {}  # Type Dict[Tuple[int, int], FeedPage]
+        self._lock = threading.Lock()
+        for premium_ad, ad in items:
+            self.add(premium_ad, ad)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, ad_uuid: str) -> bool:
+        return ad_uuid in self._items
+
+    def add(self, premium_ad: user.PremiumAdvertisement, ad: user.Advertisement):
+        with self._lock:
+            self._remove(premium_ad.ad_uuid)
+            item = FeedItem(copy.copy(premium_ad), copy.copy(ad))
+            key = self._key(premium_ad)
+            bisect.insort(self._keys, key)
+            self._items[premium_ad.ad_uuid] = (key, item)
+            self._changed()
+
+    def refresh(self, ad: user.Advertisement):
+        """ Updates the displayed Ad of a promotion already in the feed, its position doesn't change. """
+        with self._lock:
+            entry = self._items.get(ad.uuid)
+            if entry is not None:
+                key, item = entry
+                self._items[ad.uuid] = (key, FeedItem(item.premium_ad, copy.copy(ad)))
+                self._changed()
+
+    def remove(self, ad_uuid: str):
+        with self._lock:
+            if self._remove(ad_uuid):
+                self._changed()
+
+    def page(self, page: int = 1, per_page: int = 10) -> FeedPage:
+        """ A page after the last one is the last one, so that only existing pages are cached. """
+        with self._lock:
+            page = min(max(page, 1), max(-(-len(self._keys) // per_page), 1))
+            cached = self._pages.get((page, per_page))
+            if cached is None:
+                keys = self._keys[(page - 1) * per_page:page * per_page]
+                cached = FeedPage(self.version, len(self._keys), page, per_page, tuple(self._items[key[-1]][1] for key in keys))
+                self._pages[page, per_page] = cached
+            return cached
+
+    def _key(self, premium_ad: user.PremiumAdvertisement) -> tuple:
+        if self.order_by == "expiry_date":
+            moment = premium_ad.expiry_date
+            return (moment.timestamp() if moment else float("inf"), premium_ad.ad_uuid)
+        return (-premium_ad.date_published.timestamp(), premium_ad.ad_uuid)
+
+    def _remove(self, ad_uuid: str) -> bool:
+        entry = self._items.pop(ad_uuid, None)
+        if entry is None:
+            return False
+        del self._keys[bisect.bisect_left(self._keys, entry[0])]
+        return True
+
+    def _changed(self):
+        self.version += 1
+        self._pages.clear()
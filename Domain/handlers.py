@@ -3,158 +3,321 @@
 """
 
 
+import blobs
 import commands
+import datetime
+import events
+import functools
 import worker
 import user
 import uuid
-import notifications
+from typing import Callable, Generator
 
 
+# Every handler is written once, as steps: a generator yielding each call it makes to the worker (w.db.read(...), w.commit(), ...)
+# and given back its result. On an AbstractWorker the call already returned it, async_handlers awaits it on an AbstractAsyncWorker.
+
+def run_steps(steps: Generator):
+    """ Runs steps on a sync worker, returns what they return. """
+    try:
+        result = next(steps)
+        while True:
+            result = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def handler(steps: Callable) -> Callable:
+    """ Decorator: runs steps(command, w) in a unit of work of the sync worker w, the steps stay reachable as handler.steps. """
+    @functools.wraps(steps)
+    def handle(command, w: worker.AbstractWorker):
+        with w:
+            return run_steps(steps(command, w))
+    handle.steps = steps
+    return handle
+
+
+def _store_blob(w: worker.AbstractWorker, data):
+    """ Without a blob store, the bytes stay inline in the aggregate. """
+    if w.blob_store is None or isinstance(data, blobs.BlobRef):
+        return data
+    return (yield w.call(w.blob_store.put, data))
+
+
+def _private_picture(w: worker.AbstractWorker, picture):
+    if isinstance(picture, user.PrivatePicture):
+        return user.PrivatePicture((yield from _store_blob(w, picture.picture)), picture.date_published)
+    return user.PrivatePicture((yield from _store_blob(w, picture)), datetime.datetime.now())
+
+
+@handler
 def publish_advertisement(command: commands.PublishAdvertisement, w: worker.AbstractWorker):
-    with w:
-        publisher: user.Provider = w.db.read(command.owner)
-        advertisement = publisher.publish_ad(command.title, command.description, command.prices, command.localisation, command.service, str(uuid.uuid4()))
-        w.db.create(advertisement)
-        w.commit()
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.publish_ad(command.title, command.description, command.prices, command.localisation, command.service, str(uuid.uuid4()))
+    if command.published:
+        w.emit(events.AdPublished(advertisement))
+    else:
+        advertisement = publisher.un_publish_ad(advertisement.uuid)
+        w.emit(events.AdUnpublished(advertisement))
+    yield w.db.create(advertisement)
+    yield w.commit()
     return advertisement
 
 
+@handler
 def un_publish_advertisement(command: commands.UnPublishAdvertisement, w: worker.AbstractWorker):
-    with w:
-        publisher: user.Provider = w.db.read(command.owner)
-        advertisement = publisher.un_publish_ad(command.uuid)
-        w.db.update(advertisement)
-        w.commit()
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.un_publish_ad(command.uuid)
+    yield w.db.update(advertisement)
+    w.emit(events.AdUnpublished(advertisement))
+    yield w.commit()
     return advertisement
 
 
+@handler
 def update_ad_published_date(command: commands.UpdateAdvertisementPublishedDate, w: worker.AbstractWorker):
-    with w:
-        publisher: user.Provider = w.db.read(command.owner)
-        advertisement = publisher.update_ad_published_date(command.uuid)
-        w.db.update(advertisement)
-        w.commit()
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.update_ad_published_date(command.uuid)
+    yield w.db.update(advertisement)
+    w.emit(events.AdRepublished(advertisement))
+    yield w.commit()
     return advertisement
 
 
+@handler
+def update_ad_location(command: commands.UpdateAdvertisementLocation, w: worker.AbstractWorker):
+    publisher: user.Provider = yield w.db.read(command.owner)
+    location = command.localisation
+    advertisement = publisher.update_ad_location(command.uuid, location.street, location.number, location.city, location.zip_code, location.state, location.country, location.latitude, location.longitude)
+    yield w.db.update(advertisement)
+    w.emit(events.AdUpdated(advertisement))
+    yield w.commit()
+    return advertisement
+
+
+@handler
+def update_ad_services(command: commands.UpdateAdvertisementServices, w: worker.AbstractWorker):
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.update_ad_services(command.uuid, command.service)
+    yield w.db.update(advertisement)
+    w.emit(events.AdUpdated(advertisement))
+    yield w.commit()
+    return advertisement
+
+
+@handler
+def update_ad_prices(command: commands.UpdateAdvertisementPrices, w: worker.AbstractWorker):
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.update_ad_prices(command.uuid, command.prices)
+    yield w.db.update(advertisement)
+    w.emit(events.AdUpdated(advertisement))
+    yield w.commit()
+    return advertisement
+
+
+@handler
 def promote_ad_to_premium(command: commands.PromoteAdvertisementToPremium, w: worker.AbstractWorker):
-    with w:
-        publisher: user.Provider = w.db.read(command.owner)
-        advertisement = publisher.promote_ad_to_premium(command.uuid)
-        w.db.update(advertisement)
-        w.commit()
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.promote_ad_to_premium(command.uuid)
+    yield w.db.update(advertisement)
+    w.emit(events.AdPromoted(advertisement, publisher.get_ad(advertisement.ad_uuid)))
+    yield w.commit()
     return advertisement
 
 
+@handler
 def delete_ad(command: commands.DeleteAdvertisement, w: worker.AbstractWorker):
-    with w:
-        publisher: user.Provider = w.db.read(command.owner)
-        publisher.delete_ad(command.uuid)
-        w.db.delete(command.uuid)
-        w.commit()
+    publisher: user.Provider = yield w.db.read(command.owner)
+    publisher.delete_ad(command.uuid)
+    yield w.db.delete(command.uuid)
+    w.emit(events.AdDeleted(publisher.uuid, command.uuid))
+    yield w.commit()
+
+
+@handler
+def expire_ad(command: commands.ExpireAdvertisement, w: worker.AbstractWorker):
+    publisher: user.Provider = yield w.db.read(command.owner)
+    advertisement = publisher.expire_ad(command.uuid, command.now or datetime.datetime.now())
+    yield w.db.update(advertisement)
+    w.emit(events.AdExpired(advertisement))
+    yield w.commit()
+    return advertisement
+
+
+@handler
+def expire_premium_ad(command: commands.ExpirePremiumAdvertisement, w: worker.AbstractWorker):
+    publisher: user.Provider = yield w.db.read(command.owner)
+    premium_ad = publisher.expire_premium_ad(command.uuid, command.now or datetime.datetime.now())
+    yield w.db.delete(premium_ad.uuid)
+    w.emit(events.PremiumAdExpired(premium_ad))
+    yield w.commit()
+    return premium_ad
 
 
+@handler
 def add_comment(command: commands.AddComment, w: worker.AbstractWorker):
-    with w:
-        visitor: user.Visitor = w.db.read(command.owner)
-        comment = visitor.add_comment(command.target_uuid, command.content, str(uuid.uuid4()))
-        w.db.create(comment)
-        w.commit()
+    visitor: user.Visitor = yield w.db.read(command.owner)
+    comment = visitor.add_comment(command.target_uuid, command.content, str(uuid.uuid4()))
+    yield w.db.create(comment)
+    w.emit(events.CommentAdded(comment))
+    yield w.commit()
     return comment
 
 
+@handler
 def modify_comment(command: commands.ModifyComment, w: worker.AbstractWorker):
-    with w:
-        visitor: user.Visitor = w.db.read(command.owner)
-        comment = visitor.modify_comment(command.uuid, command.content)
-        w.db.update(comment)
-        w.commit()
+    visitor: user.Visitor = yield w.db.read(command.owner)
+    comment = visitor.modify_comment(command.uuid, command.content)
+    yield w.db.update(comment)
+    w.emit(events.CommentModified(comment))
+    yield w.commit()
     return comment
 
 
+@handler
 def delete_comment(command: commands.DeleteComment, w: worker.AbstractWorker):
-    with w:
-        visitor: user.Visitor = w.db.read(command.owner)
-        visitor.delete_comment(command.uuid)
-        w.db.delete(command.uuid)
-        w.commit()
+    visitor: user.Visitor = yield w.db.read(command.owner)
+    comment = visitor.delete_comment(command.uuid)
+    yield w.db.delete(command.uuid)
+    w.emit(events.CommentDeleted(comment))
+    yield w.commit()
 
 
-def send_sms_visitor(command: commands.SendSms, w: worker.AbstractWorker, notification: notifications.AbstractNotifications):
-    with w:
-        visitor: user.Visitor = w.db.read(command.user_uuid)
-        notification.send(command.to, command.message)
-        visitor.send_sms()
-        w.db.update(visitor)
-        w.commit()
+@handler
+def send_sms_visitor(command: commands.SendSms, w: worker.AbstractWorker):
+    visitor: user.Visitor = yield w.db.read(command.user_uuid)
+    yield w.call(visitor.send_sms, w.sms_limiter)
+    if w.sms_limiter is None:
+        yield w.db.update(visitor)  # The visitor counts its own SMS
+    w.notify(command.to, command.message)
+    w.emit(events.SmsSent(visitor.uuid))
+    yield w.commit()
 
 
+@handler
 def report(command: commands.Report, w: worker.AbstractWorker):
-    with w:
-        reporting_user: user.User = w.db.read(command.owner)
-        reports = reporting_user.report(command.target_uuid, command.content, str(uuid.uuid4()))
-        w.db.create(reports)
-        w.commit()
+    reporting_user: user.User = yield w.db.read(command.owner)
+    reports = reporting_user.report(command.target_uuid, command.content, str(uuid.uuid4()))
+    yield w.db.create(reports)
+    w.emit(events.ReportCreated(reports))
+    yield w.commit()
     return reports
 
 
+@handler
 def comment_report(command: commands.CommentReport, w: worker.AbstractWorker):
-    with w:
-        commenting_user: user.User = w.db.read(command.owner)
-        target_report: user.Report = w.db.read(command.target_uuid)
-        commenting_user.comment_report(target_report, command.content, str(uuid.uuid4()))
-        w.db.update(target_report)
-        w.commit()
+    commenting_user: user.User = yield w.db.read(command.owner)
+    target_report: user.Report = yield w.db.read(command.target_uuid)
+    commenting_user.comment_report(target_report, command.content, str(uuid.uuid4()))
+    yield w.db.update(target_report)
+    w.emit(events.ReportCommented(target_report))
+    yield w.commit()
     return target_report
 
 
+@handler
 def open_report(command: commands.OpenReport, w: worker.AbstractWorker):
-    with w:
-        moderator: user.Moderator = w.db.read(command.moderator_uuid)
-        target_report: user.Report = w.db.read(command.report_uuid)
-        moderator.open_report(target_report, str(uuid.uuid4()))
-        w.db.update(target_report)
-        w.commit()
+    moderator: user.Moderator = yield w.db.read(command.moderator_uuid)
+    target_report: user.Report = yield w.db.read(command.report_uuid)
+    moderator.open_report(target_report, str(uuid.uuid4()))
+    yield w.db.update(target_report)
+    w.emit(events.ReportOpened(target_report))
+    yield w.commit()
+    return target_report
+
+
+def _close_report(moderator_uuid: str, report_uuid: str, w: worker.AbstractWorker):
+    moderator: user.Moderator = yield w.db.read(moderator_uuid)
+    target_report: user.Report = yield w.db.read(report_uuid)
+    moderator.close_report(target_report, str(uuid.uuid4()))
+    yield w.db.update(target_report)
+    w.emit(events.ReportClosed(target_report))
+    return target_report
 
 
+@handler
 def close_report(command: commands.CloseReport, w: worker.AbstractWorker):
-    with w:
-        moderator: user.Moderator = w.db.read(command.moderator_uuid)
-        target_report: user.Report = w.db.read(command.report_uuid)
-        moderator.close_report(target_report, str(uuid.uuid4()))
-        w.db.update(target_report)
-        w.commit()
+    target_report = yield from _close_report(command.moderator_uuid, command.report_uuid, w)
+    yield w.commit()
+    return target_report
 
 
-def activate_user(command: commands.ActivateUser, w: worker.AbstractWorker):
-    with w:
-        admin: user.Admin = w.db.read(command.admin_uuid)
-        target_user = w.db.read(command.user_uuid)
-        admin.activate_user(target_user)
-        w.db.update(target_user)
-        w.commit()
+@handler
+def claim_report(command: commands.ClaimReport, w: worker.AbstractWorker):
+    moderator: user.Moderator = yield w.db.read(command.moderator_uuid)
+    yield w.db.flush()  # Reports created by this unit of work are claimable too
+    report_uuid = yield w.call(w.report_queue.claim)
+    if report_uuid is None:
+        return None
+    target_report: user.Report = yield w.db.read(report_uuid)
+    moderator.open_report(target_report, str(uuid.uuid4()))
+    yield w.db.update(target_report)
+    w.emit(events.ReportOpened(target_report))
+    yield w.commit()
+    return target_report
 
 
-def disable_user(command: commands.ActivateUser, w: worker.AbstractWorker):
-    with w:
-        admin: user.Admin = w.db.read(command.admin_uuid)
-        target_user = w.db.read(command.user_uuid)
-        admin.disable_user(target_user)
-        w.db.update(target_user)
-        w.commit()
+@handler
+def close_reports(command: commands.CloseReports, w: worker.AbstractWorker):
+    # One unit of work committed once, the reports are all closed or none is.
+    closed = []
+    for report_uuid in command.report_uuids:
+        closed.append((yield from _close_report(command.moderator_uuid, report_uuid, w)))
+    yield w.commit()
+    return closed
 
 
-def set_private_pics(command: commands.SetPrivatePics, w: worker.AbstractWorker):
-    with w:
-        provider: user.Provider = w.db.read(command.user_uuid)
-        provider.private_pics(command.pictures)
-        w.db.update(provider)
-        w.commit()
+@handler
+def activate_user(command: commands.ActivateUser, w: worker.AbstractWorker):
+    admin: user.Admin = yield w.db.read(command.admin_uuid)
+    target_user = yield w.db.read(command.user_uuid)
+    admin.activate_user(target_user)
+    yield w.db.update(target_user)
+    w.emit(events.UserActivated(target_user.uuid))
+    yield w.commit()
+
 
+@handler
+def disable_user(command: commands.DisableUser, w: worker.AbstractWorker):
+    admin: user.Admin = yield w.db.read(command.admin_uuid)
+    target_user = yield w.db.read(command.user_uuid)
+    admin.disable_user(target_user)
+    yield w.db.update(target_user)
+    w.emit(events.UserDisabled(target_user.uuid))
+    yield w.commit()
 
+
+@handler
+def set_private_pics(command: commands.SetPrivatePics, w: worker.AbstractWorker):
+    provider: user.Provider = yield w.db.read(command.user_uuid)
+    pictures = []
+    for picture in command.pictures:
+        pictures.append((yield from _private_picture(w, picture)))
+    provider.private_pics = pictures
+    yield w.db.update(provider)
+    w.emit(events.ProviderUpdated(provider.uuid))
+    stored = tuple(picture.picture for picture in provider.private_pics if isinstance(picture.picture, blobs.BlobRef))
+    w.emit(events.PicturesUploaded(provider.uuid, stored))
+    yield w.commit()
+
+
+@handler
+def set_profile_pic(command: commands.SetProfilePic, w: worker.AbstractWorker):
+    # The picture is stored before anything is read, a rollback only leaves an unreferenced file behind.
+    picture = yield from _store_blob(w, command.picture)
+    visitor: user.Visitor = yield w.db.read(command.user_uuid)
+    visitor.profile_pic = picture
+    yield w.db.update(visitor)
+    w.emit(events.ProfileUpdated(visitor.uuid))
+    if isinstance(picture, blobs.BlobRef):
+        w.emit(events.PicturesUploaded(visitor.uuid, (picture,)))
+    yield w.commit()
+
+
+@handler
 def update_billing(command: commands.UpdateBilling, w: worker.AbstractWorker):
-    with w:
-        provider: user.Provider = w.db.read(command.user_uuid)
-        provider.update_billing(command.card_number, command.expiry_date, command.secret_code, command.fullname)
-        w.db.update(provider)
-        w.commit()
+    provider: user.Provider = yield w.db.read(command.user_uuid)
+    provider.update_billing(command.card_number, command.expiry_date, command.secret_code, command.fullname)
+    yield w.db.update(provider)
+    w.emit(events.ProviderUpdated(provider.uuid))
+    yield w.commit()
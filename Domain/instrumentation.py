@@ -0,0 +1,199 @@
+"""
+    By Etienne Quenon
+"""
+
+import bisect
+import contextlib
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+import database
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the histogram buckets: 4 per power of two from 1µs to ~2min, so a quantile is within 19%.
+# The last bucket (index len(BOUNDS)) counts everything slower.
+BOUNDS = tuple(1e-6 * 2 ** (i / 4) for i in range(108))
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """ Latency distribution, counted per bucket of BOUNDS. """
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0  # Seconds
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other: "Histogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q-th sample (0 < q <= 1), 0 when empty. """
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return BOUNDS[i] if i < len(BOUNDS) else float("inf")
+        return 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics:
+    """
+        Named latency histograms of a process.
+        Every thread records into its own histograms, so the hot path takes no lock; snapshot() merges them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # Type List[Dict[str, Histogram]], one per thread that recorded something
+        self._lock = threading.Lock()  # Only taken by a thread's first record, and by snapshot and reset
+
+    def observe(self, name: str, seconds: float):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        histogram = shard.get(name)
+        if histogram is None:
+            histogram = shard[name] = Histogram()
+        histogram.record(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """ Records how long the block took, whether it raised or not. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name: str) -> Callable:
+        """ Decorator timing every call of the function under name. """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, Histogram]:
+        """ Merged copy of the histograms, a sample recorded while it is taken may or may not be in it. """
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for name, histogram in list(shard.items()):
+                merged.setdefault(name, Histogram()).merge(histogram)
+        return merged
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+def timer(metrics: Optional[Metrics], name: str):
+    """ metrics.timer(name), or nothing when the worker isn't instrumented. """
+    return metrics.timer(name) if metrics is not None else contextlib.nullcontext()
+
+
+class TimedDatabase(database.AbstractDatabase):
+    """ Times the calls to the database it wraps, as "db.read", "db.update", ... The other methods are passed through untimed. """
+
+    def __init__(self, db: database.AbstractDatabase, metrics: Metrics):
+        self.db = db
+        self.metrics = metrics
+
+    def create(self, obj: object):
+        with self.metrics.timer("db.create"):
+            self.db.create(obj)
+
+    def read(self, uuid: str):
+        with self.metrics.timer("db.read"):
+            return self.db.read(uuid)
+
+    def delete(self, uuid: str):
+        with self.metrics.timer("db.delete"):
+            self.db.delete(uuid)
+
+    def update(self, obj: object):
+        with self.metrics.timer("db.update"):
+            self.db.update(obj)
+
+    def discard(self):
+        self.db.discard()
+
+    def savepoint(self):
+        self.db.savepoint()
+
+    def release_savepoint(self):
+        self.db.release_savepoint()
+
+    def rollback_to_savepoint(self):
+        self.db.rollback_to_savepoint()
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+
+def render_text(snapshot: Dict[str, Histogram], prefix: str = "hub") -> str:
+    """ Prometheus text format, one summary per histogram name. """
+    lines = [f"# TYPE {prefix}_latency_seconds summary"]
+    for name, histogram in sorted(snapshot.items()):
+        for q in QUANTILES:
+            lines.append(f'{prefix}_latency_seconds{{name="{name}",quantile="{q}"}} {histogram.quantile(q):.6g}')
+        lines.append(f'{prefix}_latency_seconds_sum{{name="{name}"}} {histogram.total:.6g}')
+        lines.append(f'{prefix}_latency_seconds_count{{name="{name}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def summary_lines(snapshot: Dict[str, Histogram]) -> List[str]:
+    return [f"{name}: n={histogram.count} mean={histogram.mean * 1000:.3f}ms "
+            f"p50={histogram.quantile(0.5) * 1000:.3f}ms p99={histogram.quantile(0.99) * 1000:.3f}ms"
+            for name, histogram in sorted(snapshot.items())]
+
+
+class LogExporter:
+    """ Logs the latency summary of metrics periodically, only what was recorded since the previous dump when reset is True. """
+
+    def __init__(self, metrics: Metrics, reset: bool = False, log: logging.Logger = logger):
+        self.metrics = metrics
+        self.reset = reset
+        self.log = log
+
+    def dump(self):
+        snapshot = self.metrics.snapshot()
+        if self.reset:
+            self.metrics.reset()
+        for line in summary_lines(snapshot):
+            self.log.info(line)
+
+    def run(self, stop: threading.Event, interval: float = 60.0):
+        while not stop.wait(interval):
+            self.dump()
+
+    def start(self, interval: float = 60.0) -> threading.Event:
+        """ Runs the exporter in a daemon thread, set the returned event to stop it. """
+        stop = threading.Event()
+        threading.Thread(target=self.run, args=(stop, interval), daemon=True, name="metrics-exporter").start()
+        return stop
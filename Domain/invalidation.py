@@ -0,0 +1,76 @@
+"""
+    By Etienne Quenon
+"""
+
+import abc
+import sqlite3
+import threading
+from typing import Iterable, List
+
+
+ADS = "ads"  # Every page listing ads (home page vitrine, search results, ...)
+
+
+def ad_scope(ad_uuid: str) -> str:
+    """ The page of an ad: the ad itself and its comments. """
+    return f"ad:{ad_uuid}"
+
+
+def provider_scope(provider_uuid: str) -> str:
+    """ Every page showing a provider: its profile, its ads and their pages. """
+    return f"provider:{provider_uuid}"
+
+
+class AbstractPageVersions(abc.ABC):
+    """
+        Version counter of every scope a cached page can depend on.
+        Pages are cached under the versions of their scopes, so invalidating a scope makes its old pages unreachable.
+    """
+
+    @abc.abstractmethod
+    def versions(self, scopes: Iterable[str]) -> List[int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def invalidate(self, scopes: Iterable[str]):
+        raise NotImplementedError
+
+
+class MemoryPageVersions(AbstractPageVersions):
+    def __init__(self):
+        self._versions = {}  # Type Dict[str, int]
+        self._lock = threading.Lock()
+
+    def versions(self, scopes: Iterable[str]) -> List[int]:
+        return [self._versions.get(scope, 1) for scope in scopes]
+
+    def invalidate(self, scopes: Iterable[str]):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 1) + 1
+
+
+class SqlitePageVersions(AbstractPageVersions):
+    """
+        Versions shared by every process using the database, one row per scope invalidated at least once.
+        A scope is bumped by a single upsert, so concurrent invalidations are never lost.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def versions(self, scopes: Iterable[str]) -> List[int]:
+        scopes = list(scopes)
+        found = dict(self._connection.execute(f"SELECT scope, version FROM domain_page_version WHERE scope IN ({', '.join('?' * len(scopes))})", scopes))
+        return [found.get(scope, 1) for scope in scopes]
+
+    def invalidate(self, scopes: Iterable[str]):
+        # Pages are cached under version 1 until their scope is first invalidated.
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany("INSERT INTO domain_page_version (scope, version) VALUES (?, 2) "
+                                         "ON CONFLICT (scope) DO UPDATE SET version = version + 1", ((scope,) for scope in scopes))
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
@@ -0,0 +1,149 @@
+"""
+    By Etienne Quenon
+"""
+
+import itertools
+import math
+import threading
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+import user
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _normalize(value):
+    return value.casefold().strip() if isinstance(value, str) else value
+
+
+def _wrap(longitude: float) -> float:
+    """ The same longitude in [-180, 180). """
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def distance_km(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    """ Great-circle (haversine) distance. """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class LocalityIndex:
+    """
+        Ad uuids bucketed by country -> state -> city -> zip code, every level of the hierarchy has its own bucket,
+        plus a latitude/longitude grid for the locations that have coordinates.
+    """
+
+    def __init__(self, cell_size: float = 0.1):
+        self.cell_size = cell_size  # Degrees, about 11 km of latitude
+        self._columns = math.ceil(360.0 / cell_size)  # Longitude cells around the globe, the last one may be narrower
+        self._buckets = defaultdict(set)  # Type Dict[tuple, Set[str]], (country, state, city, zip_code) prefixes -> ad uuids
+        self._states = defaultdict(set)  # Type Dict[str, Set[str]], for queries that don't start at the country
+        self._cities = defaultdict(set)  # Type Dict[str, Set[str]]
+        self._zip_codes = defaultdict(set)  # Type Dict[int, Set[str]]
+        self._grid = defaultdict(set)  # Type Dict[Tuple[int, int], Set[str]]
+        self._locations = {}  # Type Dict[str, user.Location]
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def location(self, ad_uuid: str) -> Optional[user.Location]:
+        return self._locations.get(ad_uuid)
+
+    def add(self, ad_uuid: str, location: user.Location):
+        """ Indexes the ad at location, moving it if it was already indexed somewhere else. """
+        with self._lock:
+            self.remove(ad_uuid)
+            if location is None:
+                return
+            self._locations[ad_uuid] = location
+            levels = self._levels(location)
+            for depth in range(1, len(levels) + 1):
+                self._buckets[levels[:depth]].add(ad_uuid)
+            for flat, value in zip((self._states, self._cities, self._zip_codes), levels[1:]):
+                flat[value].add(ad_uuid)
+            if location.latitude is not None and location.longitude is not None:
+                self._grid[self._cell(location.latitude, location.longitude)].add(ad_uuid)
+
+    def remove(self, ad_uuid: str):
+        with self._lock:
+            location = self._locations.pop(ad_uuid, None)
+            if location is None:
+                return
+            levels = self._levels(location)
+            for depth in range(1, len(levels) + 1):
+                self._discard(self._buckets, levels[:depth], ad_uuid)
+            for flat, value in zip((self._states, self._cities, self._zip_codes), levels[1:]):
+                self._discard(flat, value, ad_uuid)
+            if location.latitude is not None and location.longitude is not None:
+                self._discard(self._grid, self._cell(location.latitude, location.longitude), ad_uuid)
+
+    def within(self, country: str = None, state: str = None, city: str = None, zip_code: int = None):
+        """ Uuids of the ads matching every given level. The returned set is shared, don't mutate it. """
+        with self._lock:
+            levels = (_normalize(country), _normalize(state), _normalize(city), zip_code)
+            depth = 0
+            while depth < len(levels) and levels[depth] is not None:
+                depth += 1
+            # The leading levels (e.g. country + state) select a single bucket, the others are intersected with it.
+            candidates = [self._buckets.get(levels[:depth], set())] if depth else []
+            flats = (None, self._states, self._cities, self._zip_codes)
+            for level in range(max(depth, 1), len(levels)):
+                if levels[level] is not None:
+                    candidates.append(flats[level].get(levels[level], set()))
+            if not candidates:
+                return self._locations.keys()
+            if len(candidates) == 1:
+                return candidates[0]
+            candidates.sort(key=len)
+            return candidates[0].intersection(*candidates[1:])
+
+    def near(self, latitude: float, longitude: float, radius_km: float) -> List[Tuple[float, str]]:
+        """ (distance, ad uuid) of the geolocated ads within radius_km, closest first. Only the grid cells around the point are visited. """
+        with self._lock:
+            lat_span = radius_km / 111.0
+            if abs(latitude) + lat_span >= 90.0:  # The circle covers a pole, so every longitude
+                columns = range(self._columns)
+            else:
+                lon_span = radius_km / (111.0 * math.cos(math.radians(abs(latitude) + lat_span)))
+                columns = self._columns_between(longitude - lon_span, longitude + lon_span)
+            found = []
+            for row in range(math.floor((latitude - lat_span) / self.cell_size), math.floor((latitude + lat_span) / self.cell_size) + 1):
+                for column in columns:
+                    for ad_uuid in self._grid.get((row, column), ()):
+                        location = self._locations[ad_uuid]
+                        distance = distance_km(latitude, longitude, location.latitude, location.longitude)
+                        if distance <= radius_km:
+                            found.append((distance, ad_uuid))
+            found.sort()
+            return found
+
+    @staticmethod
+    def _levels(location: user.Location) -> tuple:
+        return _normalize(location.country), _normalize(location.state), _normalize(location.city), location.zip_code
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_size), self._column(_wrap(longitude))
+
+    def _column(self, longitude: float) -> int:
+        return min(math.floor((longitude + 180.0) / self.cell_size), self._columns - 1)
+
+    def _columns_between(self, west: float, east: float) -> Iterable[int]:
+        """ The columns from west to east, across the antimeridian if need be. """
+        if east - west >= 360.0:
+            return range(self._columns)
+        first, last = self._column(_wrap(west)), self._column(_wrap(east))
+        if first <= last:
+            return range(first, last + 1)
+        return list(itertools.chain(range(first, self._columns), range(last + 1)))
+
+    @staticmethod
+    def _discard(index: dict, key, ad_uuid: str):
+        uuids = index.get(key)
+        if uuids is not None:
+            uuids.discard(ad_uuid)
+            if not uuids:
+                del index[key]
@@ -0,0 +1,114 @@
+"""
+    By Etienne Quenon
+"""
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import commands
+import database
+import handlers
+import instrumentation
+import worker
+
+
+HANDLERS = {
+    commands.PublishAdvertisement: handlers.publish_advertisement,
+    commands.UnPublishAdvertisement: handlers.un_publish_advertisement,
+    commands.UpdateAdvertisementPublishedDate: handlers.update_ad_published_date,
+    commands.UpdateAdvertisementLocation: handlers.update_ad_location,
+    commands.UpdateAdvertisementServices: handlers.update_ad_services,
+    commands.UpdateAdvertisementPrices: handlers.update_ad_prices,
+    commands.PromoteAdvertisementToPremium: handlers.promote_ad_to_premium,
+    commands.DeleteAdvertisement: handlers.delete_ad,
+    commands.ExpireAdvertisement: handlers.expire_ad,
+    commands.ExpirePremiumAdvertisement: handlers.expire_premium_ad,
+    commands.AddComment: handlers.add_comment,
+    commands.ModifyComment: handlers.modify_comment,
+    commands.DeleteComment: handlers.delete_comment,
+    commands.SendSms: handlers.send_sms_visitor,
+    commands.Report: handlers.report,
+    commands.CommentReport: handlers.comment_report,
+    commands.OpenReport: handlers.open_report,
+    commands.CloseReport: handlers.close_report,
+    commands.ClaimReport: handlers.claim_report,
+    commands.CloseReports: handlers.close_reports,
+    commands.ActivateUser: handlers.activate_user,
+    commands.DisableUser: handlers.disable_user,
+    commands.SetPrivatePics: handlers.set_private_pics,
+    commands.SetProfilePic: handlers.set_profile_pic,
+    commands.UpdateBilling: handlers.update_billing,
+}  # Type Dict[Type[commands.Command], Callable]
+
+
+class UnknownCommand(Exception):
+    """ No handler is registered for this Command ! """
+
+
+@dataclass
+class CommandResult:
+    command: commands.Command
+    result: object = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class MessageBus:
+    """
+        Runs the commands through their handler. A unit of work failing on a concurrent update (see database.is_conflict)
+        is run again, up to max_attempts times, after a random backoff: the handler reads the objects again and redoes its changes.
+    """
+
+    def __init__(self, w: worker.AbstractWorker, max_attempts: int = 3, backoff: float = 0.01):
+        self.worker = w
+        self.handlers = dict(HANDLERS)  # Type Dict[Type[commands.Command], Callable]
+        self.max_attempts = max_attempts
+        self.backoff = backoff  # Seconds, doubled at every attempt
+
+    def handle(self, command: commands.Command):
+        handler = self.handlers.get(type(command))
+        if handler is None:
+            raise UnknownCommand(type(command).__name__)
+        return self._retry(lambda: self._handle(handler, command))
+
+    def _handle(self, handler: Callable, command: commands.Command):
+        with instrumentation.timer(self.worker.metrics, f"handler.{type(command).__name__}"):
+            return handler(command, self.worker)
+
+    def handle_batch(self, batch: List[commands.Command]) -> List[CommandResult]:
+        """
+            Runs every command in a single unit of work, committed once at the end.
+            Aggregates are read once thanks to the worker identity map.
+            A failing command is rolled back to its own savepoint and reported, the others still go through.
+            A concurrent update runs the whole batch again, the transaction of the batch read the objects too.
+        """
+        return self._retry(lambda: self._handle_batch(batch))
+
+    def _handle_batch(self, batch: List[commands.Command]) -> List[CommandResult]:
+        results = []
+        with self.worker:
+            for command in batch:
+                try:
+                    results.append(CommandResult(command, self.handle(command)))
+                except Exception as e:
+                    if database.is_conflict(e):
+                        raise
+                    results.append(CommandResult(command, error=e))
+            self.worker.commit()
+        return results
+
+    def _retry(self, unit: Callable):
+        attempt = 1
+        while True:
+            try:
+                return unit()
+            except Exception as e:
+                # Nested in a unit of work (e.g. a batch), only the outer unit can be run again.
+                if attempt >= self.max_attempts or self.worker.in_unit_of_work or not database.is_conflict(e):
+                    raise
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
@@ -0,0 +1,40 @@
+"""
+    By Etienne Quenon
+"""
+
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+
+STATUSES = ("NEW", "PENDING", "CLOSED")
+
+
+class ReportQueue:
+    """
+        Moderation queue over the reports stored by database.SqliteDatabase, oldest report first.
+        Every query is a range scan of the (status, timestamp, uuid) index, reports are never loaded to be sorted.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self._connection.execute("SELECT status, COUNT(*) FROM domain_report GROUP BY status"))
+        return counts
+
+    def oldest(self, status: str = "NEW", after: Tuple[float, str] = None, limit: int = 20) -> List[Tuple[float, str]]:
+        """ (timestamp, uuid) of the oldest reports in status, pass the last one as after= to get the next ones. """
+        timestamp, report_uuid = after if after is not None else (float("-inf"), "")
+        return self._connection.execute("SELECT timestamp, uuid FROM domain_report WHERE status = ? AND (timestamp, uuid) > (?, ?) "
+                                        "ORDER BY timestamp, uuid LIMIT ?", (status, timestamp, report_uuid, limit)).fetchall()
+
+    def claim(self) -> Optional[str]:
+        """
+            Moves the oldest NEW report to PENDING and returns its uuid, None when the queue is empty.
+            It's a single statement, so two moderators never claim the same report.
+        """
+        row = self._connection.execute("UPDATE domain_report SET status = 'PENDING' WHERE uuid = ("
+                                       "SELECT uuid FROM domain_report WHERE status = 'NEW' ORDER BY timestamp, uuid LIMIT 1"
+                                       ") RETURNING uuid").fetchall()
+        return row[0][0] if row else None
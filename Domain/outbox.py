@@ -0,0 +1,178 @@
+"""
+    By Etienne Quenon
+"""
+
+import abc
+import datetime
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import List
+import instrumentation
+import notifications
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutboxMessage:
+    to: str
+    message: str
+    uuid: str
+    attempts: int = 0
+    next_attempt: datetime.datetime = None
+
+
+class AbstractOutbox(abc.ABC):
+    @abc.abstractmethod
+    def add(self, messages: List[OutboxMessage]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch(self, now: datetime.datetime, limit: int) -> List[OutboxMessage]:
+        """ Oldest messages due for (re)sending. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def ack(self, uuids: List[str]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def retry(self, messages: List[OutboxMessage]):
+        """ Stores the new attempts / next_attempt of messages that failed to send. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fail(self, messages: List[OutboxMessage]):
+        """ Gives up on messages, they are kept aside for inspection and never fetched again. """
+        raise NotImplementedError
+
+
+class MemoryOutbox(AbstractOutbox):
+    """ In-process outbox, messages don't survive a restart. """
+
+    def __init__(self):
+        self._messages = {}  # Type Dict[str, OutboxMessage], in insertion order
+        self.failed = []  # Type List[OutboxMessage]
+        self._lock = threading.Lock()
+
+    def add(self, messages: List[OutboxMessage]):
+        with self._lock:
+            for message in messages:
+                self._messages[message.uuid] = message
+
+    def fetch(self, now: datetime.datetime, limit: int) -> List[OutboxMessage]:
+        with self._lock:
+            due = []
+            for message in self._messages.values():
+                if message.next_attempt is None or message.next_attempt <= now:
+                    due.append(message)
+                    if len(due) == limit:
+                        break
+            return due
+
+    def ack(self, uuids: List[str]):
+        with self._lock:
+            for uuid in uuids:
+                self._messages.pop(uuid, None)
+
+    def retry(self, messages: List[OutboxMessage]):
+        with self._lock:
+            for message in messages:
+                self._messages[message.uuid] = message
+
+    def fail(self, messages: List[OutboxMessage]):
+        with self._lock:
+            for message in messages:
+                self._messages.pop(message.uuid, None)
+                self.failed.append(message)
+
+
+class SqliteOutbox(AbstractOutbox):
+    """ Shares the connection of the SqliteWorker, so messages are written in the same transaction as the aggregates. """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def add(self, messages: List[OutboxMessage]):
+        self._connection.executemany("INSERT INTO domain_outbox (uuid, recipient, message, attempts, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                                     [(m.uuid, m.to, m.message, m.attempts, self._timestamp(m.next_attempt)) for m in messages])
+
+    def fetch(self, now: datetime.datetime, limit: int) -> List[OutboxMessage]:
+        rows = self._connection.execute("SELECT recipient, message, uuid, attempts, next_attempt FROM domain_outbox "
+                                        "WHERE failed = 0 AND next_attempt <= ? ORDER BY next_attempt, rowid LIMIT ?",
+                                        (now.timestamp(), limit))
+        return [OutboxMessage(to, message, uuid, attempts, datetime.datetime.fromtimestamp(next_attempt)) for to, message, uuid, attempts, next_attempt in rows]
+
+    def ack(self, uuids: List[str]):
+        self._connection.executemany("DELETE FROM domain_outbox WHERE uuid = ?", [(uuid,) for uuid in uuids])
+
+    def retry(self, messages: List[OutboxMessage]):
+        self._connection.executemany("UPDATE domain_outbox SET attempts = ?, next_attempt = ? WHERE uuid = ?",
+                                     [(m.attempts, self._timestamp(m.next_attempt), m.uuid) for m in messages])
+
+    def fail(self, messages: List[OutboxMessage]):
+        self._connection.executemany("UPDATE domain_outbox SET attempts = ?, failed = 1 WHERE uuid = ?",
+                                     [(m.attempts, m.uuid) for m in messages])
+
+    @staticmethod
+    def _timestamp(moment: datetime.datetime) -> float:
+        return moment.timestamp() if moment is not None else 0.0
+
+
+class Dispatcher:
+    """ Drains an outbox into a notification gateway, in batches, with exponential backoff between attempts. """
+
+    def __init__(self, outbox: AbstractOutbox, notification: notifications.AbstractNotifications, batch_size: int = 100, max_attempts: int = 5, backoff: datetime.timedelta = datetime.timedelta(seconds=1),
+                 metrics: instrumentation.Metrics = None):
+        self.outbox = outbox
+        self.notification = notification
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.metrics = metrics  # Times every notification.send when set
+
+    def dispatch_once(self, now: datetime.datetime = None) -> int:
+        """ Sends one batch of due messages, returns how many were processed. """
+        now = now or datetime.datetime.now()
+        batch = self.outbox.fetch(now, self.batch_size)
+        sent, retries, failures = [], [], []
+        for message in batch:
+            try:
+                with instrumentation.timer(self.metrics, "notification.send"):
+                    self.notification.send(message.to, message.message)
+                sent.append(message.uuid)
+            except Exception:
+                logger.exception("Couldn't send notification %s", message.uuid)
+                message.attempts += 1
+                if message.attempts >= self.max_attempts:
+                    failures.append(message)
+                else:
+                    message.next_attempt = now + self.backoff * 2 ** (message.attempts - 1)
+                    retries.append(message)
+        self.outbox.ack(sent)
+        self.outbox.retry(retries)
+        self.outbox.fail(failures)
+        return len(batch)
+
+    def drain(self, now: datetime.datetime = None):
+        """ Dispatches batches until nothing is due anymore. """
+        now = now or datetime.datetime.now()
+        while self.dispatch_once(now):
+            pass
+
+    def run(self, stop: threading.Event, interval: float = 1.0):
+        while not stop.is_set():
+            if not self.dispatch_once():
+                stop.wait(interval)
+
+    def start(self, interval: float = 1.0) -> threading.Event:
+        """
+            Runs the dispatcher in a daemon thread, set the returned event to stop it.
+            A SqliteOutbox used here needs its own connection, opened with check_same_thread=False.
+        """
+        stop = threading.Event()
+        threading.Thread(target=self.run, args=(stop, interval), daemon=True, name="outbox-dispatcher").start()
+        return stop
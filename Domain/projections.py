@@ -0,0 +1,133 @@
+"""
+    By Etienne Quenon
+"""
+
+import logging
+import events
+import expiry
+import invalidation
+
+
+logger = logging.getLogger(__name__)
+
+
+def _invalidate_ad(w, owner: str, ad_uuid: str):
+    if w.page_versions is not None:
+        w.page_versions.invalidate((invalidation.ADS, invalidation.ad_scope(ad_uuid), invalidation.provider_scope(owner)))
+
+
+def _ad_published(w, event: events.AdPublished):
+    ad = event.ad
+    if w.search_index is not None:
+        w.search_index.add(ad)
+    if w.premium_feed is not None:
+        w.premium_feed.refresh(ad)
+    if w.expiry is not None:
+        w.expiry.schedule(expiry.AD, ad.owner, ad.uuid, ad.expiry_date)
+    _invalidate_ad(w, ad.owner, ad.uuid)
+
+
+def _ad_updated(w, event: events.AdUpdated):
+    if w.search_index is not None:
+        w.search_index.add(event.ad)
+    if w.premium_feed is not None:
+        w.premium_feed.refresh(event.ad)
+    _invalidate_ad(w, event.ad.owner, event.ad.uuid)
+
+
+def _ad_removed(w, owner: str, ad_uuid: str):
+    if w.search_index is not None:
+        w.search_index.remove(ad_uuid)
+    if w.expiry is not None:
+        w.expiry.cancel(expiry.AD, ad_uuid)
+    if w.premium_feed is not None:
+        w.premium_feed.remove(ad_uuid)
+    _invalidate_ad(w, owner, ad_uuid)
+
+
+def _ad_unpublished(w, event: events.AdUnpublished):
+    _ad_removed(w, event.ad.owner, event.ad.uuid)
+
+
+def _ad_deleted(w, event: events.AdDeleted):
+    _ad_removed(w, event.owner, event.ad_uuid)
+    if w.expiry is not None:
+        w.expiry.cancel(expiry.PREMIUM, event.ad_uuid)
+
+
+def _ad_promoted(w, event: events.AdPromoted):
+    premium_ad = event.premium_ad
+    if w.expiry is not None:
+        w.expiry.schedule(expiry.PREMIUM, premium_ad.provider_uuid, premium_ad.ad_uuid, premium_ad.expiry_date)
+    if w.premium_feed is not None:
+        w.premium_feed.add(premium_ad, event.ad)
+    _invalidate_ad(w, premium_ad.provider_uuid, premium_ad.ad_uuid)
+
+
+def _premium_ad_expired(w, event: events.PremiumAdExpired):
+    premium_ad = event.premium_ad
+    if w.expiry is not None:
+        w.expiry.cancel(expiry.PREMIUM, premium_ad.ad_uuid)
+    if w.premium_feed is not None:
+        w.premium_feed.remove(premium_ad.ad_uuid)
+    _invalidate_ad(w, premium_ad.provider_uuid, premium_ad.ad_uuid)
+
+
+def _comment_changed(w, event):
+    if w.comment_index is not None:
+        w.comment_index.add(event.comment)
+    if w.page_versions is not None:
+        w.page_versions.invalidate((invalidation.ad_scope(event.comment.target_uuid),))
+
+
+def _comment_deleted(w, event: events.CommentDeleted):
+    if w.comment_index is not None:
+        w.comment_index.remove(event.comment.target_uuid, event.comment.uuid)
+    if w.page_versions is not None:
+        w.page_versions.invalidate((invalidation.ad_scope(event.comment.target_uuid),))
+
+
+def _invalidate_provider(w, provider_uuid: str):
+    if w.page_versions is not None:
+        w.page_versions.invalidate((invalidation.provider_scope(provider_uuid),))
+
+
+def _provider_updated(w, event: events.ProviderUpdated):
+    _invalidate_provider(w, event.provider_uuid)
+
+
+def _user_status_changed(w, event):
+    # UserActivated or UserDisabled, the pages of a visitor aren't cached: a no-op unless the user is a provider.
+    _invalidate_provider(w, event.user_uuid)
+
+
+UPDATES = {
+    events.AdPublished: _ad_published,
+    events.AdUpdated: _ad_updated,
+    events.AdUnpublished: _ad_unpublished,
+    events.AdDeleted: _ad_deleted,
+    events.AdPromoted: _ad_promoted,
+    events.PremiumAdExpired: _premium_ad_expired,
+    events.CommentAdded: _comment_changed,
+    events.CommentModified: _comment_changed,
+    events.CommentDeleted: _comment_deleted,
+    events.ProviderUpdated: _provider_updated,
+    events.UserActivated: _user_status_changed,
+    events.UserDisabled: _user_status_changed,
+}  # Type Dict[Type[events.Event], Callable], subclasses (AdRepublished, AdExpired) use the update of their base class
+
+
+def update(w, committed_events):
+    """
+        Applies committed events to the projections attached to the worker w (search_index, expiry, premium_feed, ...).
+        The events are already committed: a failing update is logged and the next events are still applied.
+    """
+    for event in committed_events:
+        for event_type in type(event).__mro__:
+            apply = UPDATES.get(event_type)
+            if apply is not None:
+                try:
+                    apply(w, event)
+                except Exception:
+                    logger.exception("Projection %r failed on %r", apply, event)
+                break
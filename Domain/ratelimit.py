@@ -0,0 +1,83 @@
+"""
+    By Etienne Quenon
+"""
+
+import abc
+import datetime
+import sqlite3
+import threading
+
+
+class AbstractRateLimiter(abc.ABC):
+    """ At most limit hits per key and per window, the count starts again at 0 with every new window (midnight UTC for a day). """
+
+    def __init__(self, limit: int, window: datetime.timedelta = datetime.timedelta(days=1)):
+        self.limit = limit
+        self.window = window
+
+    def acquire(self, key: str, now: datetime.datetime = None) -> bool:
+        """ Counts a hit and returns True, or returns False without counting it when the limit is reached. """
+        return self._acquire(key, self._window_of(now))
+
+    def count(self, key: str, now: datetime.datetime = None) -> int:
+        """ Hits counted for key in the current window. """
+        return self._count(key, self._window_of(now))
+
+    def remaining(self, key: str, now: datetime.datetime = None) -> int:
+        return max(self.limit - self.count(key, now), 0)
+
+    def _window_of(self, now: datetime.datetime) -> int:
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return int(now.timestamp() // self.window.total_seconds())
+
+    @abc.abstractmethod
+    def _acquire(self, key: str, window: int) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _count(self, key: str, window: int) -> int:
+        raise NotImplementedError
+
+
+class MemoryRateLimiter(AbstractRateLimiter):
+    """ Only correct when a single process serves every key. """
+
+    def __init__(self, limit: int, window: datetime.timedelta = datetime.timedelta(days=1)):
+        super().__init__(limit, window)
+        self._counters = {}  # Type Dict[str, Tuple[int, int]], key -> (window, count)
+        self._lock = threading.Lock()
+
+    def _acquire(self, key: str, window: int) -> bool:
+        with self._lock:
+            count = self._count(key, window)
+            if count >= self.limit:
+                return False
+            self._counters[key] = (window, count + 1)
+            return True
+
+    def _count(self, key: str, window: int) -> int:
+        counter_window, count = self._counters.get(key, (window, 0))
+        return count if counter_window == window else 0
+
+
+class SqliteRateLimiter(AbstractRateLimiter):
+    """
+        Counters shared by every process using the database, one row per key.
+        The check and the increment are a single statement, so two processes can't both take the last hit.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, limit: int, window: datetime.timedelta = datetime.timedelta(days=1)):
+        super().__init__(limit, window)
+        self._connection = connection
+
+    def _acquire(self, key: str, window: int) -> bool:
+        # The update is skipped by its WHERE clause when the current window is full, then nothing is returned.
+        rows = self._connection.execute("INSERT INTO domain_rate_limit (key, window, count) VALUES (?, ?, 1) "
+                                        "ON CONFLICT (key) DO UPDATE SET count = CASE WHEN window = excluded.window THEN count + 1 ELSE 1 END, "
+                                        "window = excluded.window WHERE window != excluded.window OR count < ? RETURNING count",
+                                        (key, window, self.limit)).fetchall()
+        return bool(rows) and rows[0][0] <= self.limit
+
+    def _count(self, key: str, window: int) -> int:
+        row = self._connection.execute("SELECT count FROM domain_rate_limit WHERE key = ? AND window = ?", (key, window)).fetchone()
+        return row[0] if row is not None else 0
@@ -0,0 +1,171 @@
+"""
+    By Etienne Quenon
+"""
+
+import datetime
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+import search
+import user
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS read_published_ad (
+    uuid TEXT PRIMARY KEY,
+    owner_uuid TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    city TEXT,
+    zip_code INTEGER,
+    country TEXT,
+    date_published REAL,
+    expiry_date REAL,
+    min_price REAL,
+    premium INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS read_published_ad_date ON read_published_ad (date_published DESC, uuid);
+CREATE INDEX IF NOT EXISTS read_published_ad_owner ON read_published_ad (owner_uuid, date_published DESC);
+
+CREATE TABLE IF NOT EXISTS read_provider (
+    uuid TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    verified INTEGER NOT NULL,
+    vip INTEGER NOT NULL,
+    active INTEGER NOT NULL,
+    published_ads INTEGER NOT NULL DEFAULT 0,
+    premium_ads INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+@dataclass
+class AdSummary:
+    uuid: str
+    owner_uuid: str
+    title: str
+    description: str
+    city: Optional[str]
+    zip_code: Optional[int]
+    country: Optional[str]
+    date_published: Optional[datetime.datetime]
+    expiry_date: Optional[datetime.datetime]
+    min_price: Optional[float]
+    premium: bool
+
+
+@dataclass
+class ProviderSummary:
+    uuid: str
+    username: str
+    verified: bool
+    vip: bool
+    active: bool
+    published_ads: int
+    premium_ads: int
+
+
+def _timestamp(date: Optional[datetime.datetime]) -> Optional[float]:
+    return date.timestamp() if date is not None else None
+
+
+def _datetime(timestamp: Optional[float]) -> Optional[datetime.datetime]:
+    return datetime.datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+
+class SqliteReadModels:
+    """
+        Flat tables for the read path: the published ads and a summary of every provider.
+        They are written by database.SqliteDatabase in the same transaction as the aggregates, so they are never stale,
+        and read without unpickling a single aggregate.
+    """
+
+    AD_COLUMNS = "uuid, owner_uuid, title, description, city, zip_code, country, date_published, expiry_date, min_price, premium"
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    # Writes, called by SqliteDatabase
+
+    def ad_written(self, ad: user.Advertisement):
+        if not ad.published:
+            self.ad_deleted(ad.uuid, ad.owner)
+            return
+        location = ad.localisation
+        values = (ad.title, ad.description, location.city if location else None, location.zip_code if location else None, location.country if location else None,
+                  _timestamp(ad.date_published), _timestamp(ad.expiry_date), search.min_price(ad))
+        inserted = self._connection.execute(f"INSERT INTO read_published_ad ({self.AD_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                                            "EXISTS (SELECT 1 FROM domain_premium_advertisement WHERE uuid = ?)) "
+                                            "ON CONFLICT (uuid) DO NOTHING RETURNING premium",
+                                            (ad.uuid, ad.owner, *values, user.PremiumAdvertisement.uuid_of(ad.uuid))).fetchone()
+        if inserted is not None:
+            self._add(ad.owner, 1, inserted[0])
+        else:
+            self._connection.execute("UPDATE read_published_ad SET title = ?, description = ?, city = ?, zip_code = ?, country = ?, "
+                                     "date_published = ?, expiry_date = ?, min_price = ? WHERE uuid = ?", (*values, ad.uuid))
+
+    def ad_deleted(self, ad_uuid: str, owner_uuid: str):
+        deleted = self._connection.execute("DELETE FROM read_published_ad WHERE uuid = ? RETURNING premium", (ad_uuid,)).fetchone()
+        if deleted is not None:
+            self._add(owner_uuid, -1, -deleted[0])
+
+    def premium_written(self, premium_ad: user.PremiumAdvertisement):
+        if self._connection.execute("UPDATE read_published_ad SET premium = 1 WHERE uuid = ? AND NOT premium", (premium_ad.ad_uuid,)).rowcount:
+            self._add(premium_ad.provider_uuid, 0, 1)
+
+    def premium_deleted(self, ad_uuid: str, provider_uuid: str):
+        if self._connection.execute("UPDATE read_published_ad SET premium = 0 WHERE uuid = ? AND premium", (ad_uuid,)).rowcount:
+            self._add(provider_uuid, 0, -1)
+
+    def provider_written(self, provider: user.Provider):
+        self._connection.execute("INSERT INTO read_provider (uuid, username, verified, vip, active) VALUES (?, ?, ?, ?, ?) "
+                                 "ON CONFLICT (uuid) DO UPDATE SET username = excluded.username, verified = excluded.verified, "
+                                 "vip = excluded.vip, active = excluded.active",
+                                 (provider.uuid, provider.username, bool(provider.verified), bool(provider.vip), provider._active is not False))
+        self._count(provider.uuid)  # Its ads may have been written first, they weren't counted
+
+    def provider_deleted(self, provider_uuid: str):
+        self._connection.execute("DELETE FROM read_provider WHERE uuid = ?", (provider_uuid,))
+        self._connection.execute("DELETE FROM read_published_ad WHERE owner_uuid = ?", (provider_uuid,))
+
+    def _count(self, provider_uuid: str):
+        # Counted on the owner index, a few rows per provider, instead of reading the provider aggregate.
+        self._connection.execute("UPDATE read_provider SET "
+                                 "published_ads = (SELECT COUNT(*) FROM read_published_ad WHERE owner_uuid = ?1), "
+                                 "premium_ads = (SELECT COUNT(*) FROM read_published_ad WHERE owner_uuid = ?1 AND premium) "
+                                 "WHERE uuid = ?1", (provider_uuid,))
+
+    def _add(self, provider_uuid: str, published_ads: int, premium_ads: int):
+        # The ads are written one at a time: the counts move by the difference, recounting would read every ad of the provider each time.
+        self._connection.execute("UPDATE read_provider SET published_ads = published_ads + ?, premium_ads = premium_ads + ? WHERE uuid = ?",
+                                 (published_ads, premium_ads, provider_uuid))
+
+    # Queries, for the views
+
+    def ad(self, ad_uuid: str) -> Optional[AdSummary]:
+        row = self._connection.execute(f"SELECT {self.AD_COLUMNS} FROM read_published_ad WHERE uuid = ?", (ad_uuid,)).fetchone()
+        return self._ad_summary(row) if row is not None else None
+
+    def published_ads(self, page: int = 1, per_page: int = 20, owner_uuid: str = None) -> List[AdSummary]:
+        """ Most recently published first. """
+        if owner_uuid is None:
+            rows = self._connection.execute(f"SELECT {self.AD_COLUMNS} FROM read_published_ad "
+                                            "ORDER BY date_published DESC, uuid LIMIT ? OFFSET ?", (per_page, (page - 1) * per_page))
+        else:
+            rows = self._connection.execute(f"SELECT {self.AD_COLUMNS} FROM read_published_ad WHERE owner_uuid = ? "
+                                            "ORDER BY date_published DESC, uuid LIMIT ? OFFSET ?", (owner_uuid, per_page, (page - 1) * per_page))
+        return [self._ad_summary(row) for row in rows]
+
+    def provider(self, provider_uuid: str) -> Optional[ProviderSummary]:
+        row = self._connection.execute("SELECT uuid, username, verified, vip, active, published_ads, premium_ads FROM read_provider WHERE uuid = ?",
+                                       (provider_uuid,)).fetchone()
+        if row is None:
+            return None
+        uuid, username, verified, vip, active, published_ads, premium_ads = row
+        return ProviderSummary(uuid, username, bool(verified), bool(vip), bool(active), published_ads, premium_ads)
+
+    @staticmethod
+    def _ad_summary(row) -> AdSummary:
+        uuid, owner_uuid, title, description, city, zip_code, country, date_published, expiry_date, min_price, premium = row
+        return AdSummary(uuid, owner_uuid, title, description, city, zip_code, country,
+                         _datetime(date_published), _datetime(expiry_date), min_price, bool(premium))
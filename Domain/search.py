@@ -0,0 +1,145 @@
+"""
+    By Etienne Quenon
+"""
+
+import copy
+import heapq
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Set, Tuple
+import locality
+import user
+
+
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text) -> Set[str]:
+    """ Lower-cased words without accents, "Épilation" and "epilation" give the same token. """
+    if not text:
+        return set()
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return set(WORD.findall("".join(c for c in text if not unicodedata.combining(c))))
+
+
+def ad_tokens(ad: user.Advertisement) -> Set[str]:
+    tokens = tokenize(ad.title) | tokenize(ad.description)
+    for services in (ad.service, ad.prices):
+        for key, value in (services or {}).items():
+            tokens |= tokenize(key)
+            if isinstance(value, str):
+                tokens |= tokenize(value)
+    return tokens
+
+
+def min_price(ad: user.Advertisement) -> Optional[float]:
+    prices = [p for p in (ad.prices or {}).values() if isinstance(p, (int, float))]
+    return min(prices) if prices else None
+
+
+@dataclass
+class _Document:
+    ad: user.Advertisement
+    tokens: Set[str]
+    services: Set[str]
+    min_price: Optional[float]
+
+
+@dataclass
+class SearchResult:
+    total: int
+    page: int
+    per_page: int
+    ads: List[user.Advertisement] = field(default_factory=list)
+
+
+class AdSearchIndex:
+    """
+        In-memory inverted index over the published advertisements.
+        It is kept up to date incrementally by the ad handlers (see AbstractWorker.search_index).
+    """
+
+    def __init__(self, ads: Iterable[user.Advertisement] = ()):
+        self._documents = {}  # Type Dict[str, _Document]
+        self._terms = defaultdict(set)  # Type Dict[str, Set[str]], token -> ad uuids
+        self._services = defaultdict(set)  # Type Dict[str, Set[str]], service name -> ad uuids
+        self.locality = locality.LocalityIndex()
+        self._lock = threading.RLock()
+        for ad in ads:
+            self.add(ad)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, ad_uuid: str) -> bool:
+        return ad_uuid in self._documents
+
+    def add(self, ad: user.Advertisement):
+        """ Indexes a new or modified ad, an unpublished ad is removed from the index. """
+        with self._lock:
+            self.remove(ad.uuid)
+            if not ad.published:
+                return
+            ad = copy.copy(ad)  # The caller's object may be mutated by a later unit of work
+            document = _Document(ad, ad_tokens(ad), set(ad.service or {}), min_price(ad))
+            self._documents[ad.uuid] = document
+            for token in document.tokens:
+                self._terms[token].add(ad.uuid)
+            for service in document.services:
+                self._services[service].add(ad.uuid)
+            self.locality.add(ad.uuid, ad.localisation)
+
+    def remove(self, ad_uuid: str):
+        with self._lock:
+            document = self._documents.pop(ad_uuid, None)
+            if document is None:
+                return
+            for token in document.tokens:
+                self._discard(self._terms, token, ad_uuid)
+            for service in document.services:
+                self._discard(self._services, service, ad_uuid)
+            self.locality.remove(ad_uuid)
+
+    def search(self, text: str = None, city: str = None, zip_code: int = None, country: str = None, service: str = None,
+               max_price: float = None, state: str = None, near: Tuple[float, float, float] = None,
+               page: int = 1, per_page: int = 20) -> SearchResult:
+        """
+            Every given criterion must match, results are sorted from the most recently published.
+            near is a (latitude, longitude, radius_km) tuple, it only matches ads with coordinates.
+        """
+        with self._lock:
+            candidates = []  # Type List[Set[str]]
+            for token in tokenize(text):
+                candidates.append(self._terms.get(token, set()))
+            if country is not None or state is not None or city is not None or zip_code is not None:
+                candidates.append(self.locality.within(country, state, city, zip_code))
+            if near is not None:
+                candidates.append({ad_uuid for _, ad_uuid in self.locality.near(*near)})
+            if service is not None:
+                candidates.append(self._services.get(service, set()))
+
+            if candidates:
+                candidates.sort(key=len)
+                matches = candidates[0].intersection(*candidates[1:])
+            else:
+                matches = self._documents.keys()
+            documents = (self._documents[uuid] for uuid in matches)
+            if max_price is not None:
+                documents = [d for d in documents if d.min_price is not None and d.min_price <= max_price]
+            else:
+                documents = list(documents)
+
+            # Only the documents up to the requested page are sorted.
+            top = heapq.nlargest(page * per_page, documents, key=lambda d: (d.ad.date_published, d.ad.uuid))
+            return SearchResult(len(documents), page, per_page, [d.ad for d in top[(page - 1) * per_page:]])
+
+    @staticmethod
+    def _discard(index: dict, key, ad_uuid: str):
+        uuids = index.get(key)
+        if uuids is not None:
+            uuids.discard(ad_uuid)
+            if not uuids:
+                del index[key]
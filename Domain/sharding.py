@@ -0,0 +1,187 @@
+"""
+    By Etienne Quenon
+"""
+
+import hashlib
+import heapq
+import itertools
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+import database
+import moderation
+import readmodels
+import user
+
+
+def shard_index(key: str, count: int) -> int:
+    """ Stable across processes and runs, unlike hash(). """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big") % count
+
+
+def owner_key(obj: object) -> str:
+    """ The uuid an object is partitioned by: its owner, so that a provider and its ads (or a visitor and its comments) share a shard. """
+    if isinstance(obj, user.Advertisement):
+        return obj.owner
+    if isinstance(obj, user.PremiumAdvertisement):
+        return obj.provider_uuid
+    if isinstance(obj, (user.Comment, user.Report)):
+        return obj.owner_uuid
+    return obj.uuid
+
+
+class ShardedDatabase(database.AbstractDatabase):
+    """
+        Objects partitioned across shards by the hash of their owner_key.
+        An object is found by uuid on the shard of its own uuid first (the users), then on the others;
+        where it was found is remembered for the next max_locations reads.
+        The listing queries that span owners are scattered to every shard and their results merged.
+    """
+
+    def __init__(self, shards: List[database.AbstractDatabase], max_locations: int = 100_000):
+        self.shards = shards
+        self.max_locations = max_locations
+        self._locations = OrderedDict()  # Type OrderedDict[str, int], uuid -> shard index, least recently used first
+
+    def shard_for(self, key: str) -> database.AbstractDatabase:
+        return self.shards[shard_index(key, len(self.shards))]
+
+    def create(self, obj: object):
+        self._shard_of(obj).create(obj)
+
+    def update(self, obj: object):
+        self._shard_of(obj).update(obj)
+
+    def read(self, uuid: str):
+        index = self._locations.get(uuid)
+        if index is not None:
+            obj = self.shards[index].read(uuid)
+            if obj is not None:
+                self._locations.move_to_end(uuid)
+                return obj
+        home = shard_index(uuid, len(self.shards))
+        for index in itertools.chain((home,), (i for i in range(len(self.shards)) if i != home)):
+            obj = self.shards[index].read(uuid)
+            if obj is not None:
+                self._remember(uuid, index)
+                return obj
+        return None
+
+    def delete(self, uuid: str):
+        index = self._locations.pop(uuid, None)
+        shards = [self.shards[index]] if index is not None else self.shards  # Deleting a missing uuid is a no-op on a shard
+        for shard in shards:
+            shard.delete(uuid)
+
+    def discard(self):
+        for shard in self.shards:
+            shard.discard()
+
+    def savepoint(self):
+        for shard in self.shards:
+            shard.savepoint()
+
+    def release_savepoint(self):
+        for shard in self.shards:
+            shard.release_savepoint()
+
+    def rollback_to_savepoint(self):
+        for shard in self.shards:
+            shard.rollback_to_savepoint()
+
+    def scan(self, kind: str) -> Iterator:
+        """ Every object of kind, shard after shard. """
+        for shard in self.shards:
+            yield from shard.scan(kind)
+
+    def comments_page(self, owner_uuid: str, before: Tuple[float, str] = None, limit: int = 20) -> database.CommentPage:
+        return self.shard_for(owner_uuid).comments_page(owner_uuid, before, limit)
+
+    def target_comments_page(self, target_uuid: str, before: Tuple[float, str] = None, limit: int = 20) -> database.CommentPage:
+        """ The comments about target_uuid are written on the shards of their owners, a page is gathered from all of them. """
+        return _merge_pages([shard.target_comments_page(target_uuid, before, limit) for shard in self.shards], limit)
+
+    def report_comments_page(self, report_uuid: str, before: Tuple[float, str] = None, limit: int = 20) -> database.CommentPage:
+        index = self._locate(report_uuid)
+        if index is None:
+            return database.CommentPage([])
+        return self.shards[index].report_comments_page(report_uuid, before, limit)
+
+    @property
+    def read_models(self) -> "ShardedReadModels":
+        return ShardedReadModels([shard.read_models for shard in self.shards])
+
+    def _shard_of(self, obj: object) -> database.AbstractDatabase:
+        index = shard_index(owner_key(obj), len(self.shards))
+        self._remember(obj.uuid, index)
+        return self.shards[index]
+
+    def _locate(self, uuid: str) -> Optional[int]:
+        if uuid not in self._locations:
+            self.read(uuid)
+        return self._locations.get(uuid)
+
+    def _remember(self, uuid: str, index: int):
+        self._locations[uuid] = index
+        self._locations.move_to_end(uuid)
+        if len(self._locations) > self.max_locations:
+            self._locations.popitem(last=False)
+
+
+def _comment_key(comment: user.Comment) -> Tuple[float, str]:
+    return comment.timestamp.timestamp(), comment.uuid
+
+
+def _merge_pages(pages: List[database.CommentPage], limit: int) -> database.CommentPage:
+    # Every page is newest first, so is the merge; the next page starts after the last comment kept.
+    merged = list(itertools.islice(heapq.merge(*(page.comments for page in pages), key=_comment_key, reverse=True), limit + 1))
+    more = len(merged) > limit or any(page.cursor is not None for page in pages)
+    comments = merged[:limit]
+    return database.CommentPage(comments, _comment_key(comments[-1]) if more and comments else None)
+
+
+class ShardedReadModels:
+    """ The read models of every shard, queried like a single readmodels.SqliteReadModels. """
+
+    def __init__(self, shards: List[readmodels.SqliteReadModels]):
+        self.shards = shards
+
+    def ad(self, ad_uuid: str) -> Optional[readmodels.AdSummary]:
+        return next((ad for ad in (shard.ad(ad_uuid) for shard in self.shards) if ad is not None), None)
+
+    def published_ads(self, page: int = 1, per_page: int = 20, owner_uuid: str = None) -> List[readmodels.AdSummary]:
+        """ Most recently published first. Without an owner, every shard returns its first page * per_page ads to be merged. """
+        if owner_uuid is not None:
+            return self.shards[shard_index(owner_uuid, len(self.shards))].published_ads(page, per_page, owner_uuid)
+        heads = [shard.published_ads(1, page * per_page) for shard in self.shards]
+        merged = heapq.merge(*heads, key=lambda ad: (-ad.date_published.timestamp(), ad.uuid))
+        return list(itertools.islice(merged, (page - 1) * per_page, page * per_page))
+
+    def provider(self, provider_uuid: str) -> Optional[readmodels.ProviderSummary]:
+        return self.shards[shard_index(provider_uuid, len(self.shards))].provider(provider_uuid)
+
+
+class ShardedReportQueue:
+    """ The moderation queue of every shard: the reports are stored on the shards of the users who wrote them. """
+
+    def __init__(self, queues: List[moderation.ReportQueue]):
+        self.queues = queues
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(moderation.STATUSES, 0)
+        for queue in self.queues:
+            for status, count in queue.counts().items():
+                counts[status] = counts.get(status, 0) + count
+        return counts
+
+    def oldest(self, status: str = "NEW", after: Tuple[float, str] = None, limit: int = 20) -> List[Tuple[float, str]]:
+        return list(itertools.islice(heapq.merge(*(queue.oldest(status, after, limit) for queue in self.queues)), limit))
+
+    def claim(self) -> Optional[str]:
+        """ Claims on the shard holding the oldest NEW report, then on the next ones if another moderator was faster. """
+        heads = sorted((head[0], index) for index, head in
+                       ((index, queue.oldest("NEW", limit=1)) for index, queue in enumerate(self.queues)) if head)
+        for _, index in heads:
+            report_uuid = self.queues[index].claim()
+            if report_uuid is not None:
+                return report_uuid
+        return None
@@ -261,3 +261,48 @@ def test_protection_disabled_user():
         exception_occurred += 1
 
     assert exception_occurred == 3
+
+
+def test_ads_index():
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    for i in range(10):
+        provider.publish_ad("TestAd", "This is a test Ad", {}, None, {}, f"00000-0000-0000-0000000{i}")
+
+    assert provider.get_ad("00000-0000-0000-00000004").uuid == "00000-0000-0000-00000004"
+    assert provider._ads[-1].uuid == "00000-0000-0000-00000009"
+    assert provider._ads[2].uuid == "00000-0000-0000-00000002"
+
+    provider.delete_ad("00000-0000-0000-00000004")
+
+    assert provider.get_ad("00000-0000-0000-00000004") is None
+    assert len(provider._ads) == 9
+    assert [ad.uuid for ad in provider._ads][4] == "00000-0000-0000-00000005"
+
+    exception_occurred = 0
+
+    try:
+        provider.delete_ad("00000-0000-0000-00000004")
+    except user.AdNotFound:
+        exception_occurred += 1
+
+    try:
+        provider.update_ad_prices("00000-0000-0000-00000004", {})
+    except user.AdNotFound:
+        exception_occurred += 1
+
+    assert exception_occurred == 2
+
+
+def test_slotted_objects():
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    same_provider = user.Provider("otherdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    location = user.Location("Avenue Paul Des Fleurs", 42, "Mont-Marchienne", 6000, "Brabant", "Belgique")
+    ad = provider.publish_ad("TestAd", "This is a test Ad", None, location, None, "00000-0000-0000-00000001")
+
+    for obj in (provider, location, ad, user.Billing("7987846548498", "29-04-2027", "999", "VC AC")):
+        assert not hasattr(obj, "__dict__")
+
+    assert provider == same_provider and hash(provider) == hash(same_provider)
+    assert location == user.Location("Avenue Paul Des Fleurs", 42, "Mont-Marchienne", 6000, "Brabant", "Belgique")
+    assert hash(location) == hash(user.Location("Avenue Paul Des Fleurs", 42, "Mont-Marchienne", 6000, "Brabant", "Belgique"))
+    assert len({ad, ad}) == 1
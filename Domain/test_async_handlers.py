@@ -0,0 +1,145 @@
+import asyncio
+import datetime
+
+import pytest
+
+import async_handlers
+import commands
+import database
+import handlers
+import messagebus
+import outbox
+import user
+import worker
+from test_handlers import FakeDatabase
+from test_outbox import FlakyNotifications
+
+
+class FakeAsyncWorker(worker.AbstractAsyncWorker):
+    def __init__(self, db: FakeDatabase, box: outbox.AbstractOutbox = None):
+        self.db = database.AsyncDatabase(db)
+        self.outbox = box or outbox.MemoryOutbox()
+        self.commited = False
+
+    async def _commit(self):
+        self.commited = True
+
+    async def rollback(self):
+        pass
+
+
+def test_publish_advertisement():
+    db = FakeDatabase([])
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    db.create(provider)
+    w = FakeAsyncWorker(db)
+    command = commands.PublishAdvertisement("TestAd", "This is a test Ad", None, None, None, provider.uuid)
+
+    ad = asyncio.run(async_handlers.publish_advertisement(command, w))
+
+    assert db.read(ad.uuid) is ad
+    assert w.commited
+
+
+def test_send_sms_through_the_outbox():
+    db = FakeDatabase([])
+    visitors = [user.Visitor("testdude", f"00000-0000-0000-{i:08}", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, []) for i in range(100)]
+    for visitor in visitors:
+        db.create(visitor)
+    box = outbox.MemoryOutbox()
+
+    async def send_all():
+        await asyncio.gather(*(async_handlers.send_sms_visitor(commands.SendSms(visitor.uuid, "+320000000", "This is a test SMS"), FakeAsyncWorker(db, box)) for visitor in visitors))
+
+    asyncio.run(send_all())
+    notification = FlakyNotifications(failures=1)
+    outbox.Dispatcher(box, notification, backoff=datetime.timedelta(0)).drain()
+
+    assert len(notification.sent) == 100  # The one failed attempt was retried
+    assert all(visitor.sms_sent == 1 for visitor in visitors)
+
+
+def test_sqlite_worker(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    with w:
+        w.db.create(provider)
+        w.commit()
+
+    async def publish():
+        return await async_handlers.publish_advertisement(commands.PublishAdvertisement("TestAd", "This is a test Ad", None, None, None, provider.uuid), worker.AsyncSqliteWorker(path))
+
+    ad = asyncio.run(publish())
+
+    assert worker.SqliteWorker(path).db.read(ad.uuid).title == "TestAd"
+
+
+def test_sqlite_worker_outbox_is_transactional(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000000", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    with w:
+        w.db.create(visitor)
+        w.commit()
+
+    async def send(async_worker: worker.AsyncSqliteWorker):
+        await async_handlers.send_sms_visitor(commands.SendSms(visitor.uuid, "+320000000", "Sent"), async_worker)
+        async with async_worker:
+            async_worker.notify("+320000000", "Rolled back")
+
+    asyncio.run(send(worker.AsyncSqliteWorker(path)))
+    notification = FlakyNotifications(failures=0)
+    outbox.Dispatcher(outbox.SqliteOutbox(w.connection), notification).drain()
+
+    assert notification.sent == [("+320000000", "Sent")]
+
+
+def test_async_handlers_share_the_sync_steps():
+    for command_type, sync_handler in messagebus.HANDLERS.items():
+        async_handler = getattr(async_handlers, sync_handler.__name__)
+        assert asyncio.iscoroutinefunction(async_handler), command_type
+        assert async_handler.steps is sync_handler.steps, command_type
+
+
+def test_close_reports_on_sqlite(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    moderator = user.Moderator("moddude", "00000-0000-0000-00000000", "abcd1234", "test@test.com")
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000001", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    with w:
+        w.db.create(moderator)
+        w.db.create(visitor)
+        w.commit()
+    reports = [handlers.report(commands.Report(visitor.uuid, f"ad{i}", "Spam"), w) for i in range(4)]
+    for report in reports[:3]:
+        handlers.open_report(commands.OpenReport(moderator.uuid, report.uuid), w)
+
+    async def close(report_uuids):
+        return await async_handlers.close_reports(commands.CloseReports(moderator.uuid, report_uuids), worker.AsyncSqliteWorker(path))
+
+    closed = asyncio.run(close([report.uuid for report in reports[:2]]))
+    with pytest.raises(user.ReportNotOpened):  # The last report isn't opened, the first one isn't closed either
+        asyncio.run(close([reports[2].uuid, reports[3].uuid]))
+
+    assert [report.status for report in closed] == ["CLOSED"] * 2
+    assert w.report_queue.counts() == {"NEW": 1, "PENDING": 1, "CLOSED": 2}
+
+
+def test_nested_async_units_are_savepoints(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    providers = [user.Provider("testdude", f"00000-0000-0000-{i:08}", None, None, list(), False, False, None) for i in range(2)]
+
+    async def create_both():
+        w = worker.AsyncSqliteWorker(path)
+        async with w:
+            await w.db.create(providers[0])
+            async with w:
+                await w.db.create(providers[1])  # Rolled back alone, never committed
+            await w.commit()
+
+    asyncio.run(create_both())
+
+    db = worker.SqliteWorker(path).db
+    assert db.read(providers[0].uuid) is not None
+    assert db.read(providers[1].uuid) is None
@@ -0,0 +1,27 @@
+import json
+
+import bench
+
+
+def test_run_and_compare(tmp_path):
+    results = bench.run([20], count=10, ads_per_provider=10, comments_per_visitor=10, report_length=5, memory_count=10)
+
+    scale = results["scales"]["20"]
+    assert results["meta"]["count"] == 10
+    assert set(scale["domain"]) == set(bench.DOMAIN_BENCHMARKS)
+    assert set(scale["sqlite"]) == set(bench.HANDLER_BENCHMARKS)
+    assert scale["memory"]["publish_advertisement"]["count"] == 10
+    json.dumps(results)  # Saved as is by --output
+
+    slower = json.loads(json.dumps(results))
+    slower["scales"]["20"]["sqlite"]["send_sms"]["mean_us"] *= 2
+    assert bench.compare(results, results) == []
+    assert [regression.split(":")[0] for regression in bench.compare(results, slower)] == ["20 sqlite send_sms"]
+
+
+def test_dataset_sizes():
+    dataset = bench.make_dataset(25, ads_per_provider=10, comments_per_visitor=3, report_length=4)
+
+    assert [len(provider._ads) for provider in dataset.providers] == [10, 10, 5]
+    assert len(dataset.visitors[0].comments) == 3
+    assert len(dataset.reports[0].comment) == 5  # The moderator's opening comment, then the thread
@@ -0,0 +1,47 @@
+import io
+
+import blobs
+import commands
+import handlers
+import user
+import worker
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 1000
+
+
+def test_content_addressed(tmp_path):
+    store = blobs.BlobStore(str(tmp_path))
+    assert not (tmp_path / "tmp").exists()  # Created by the first put
+
+    ref = store.put(PNG)
+    streamed = store.put(io.BytesIO(PNG))
+    chunked = store.put(PNG[i:i + 1000] for i in range(0, len(PNG), 1000))
+
+    assert ref == streamed == chunked
+    assert ref.extension == ".png" and ref.size == len(PNG)
+    assert len(list((tmp_path / ref.digest[:2] / ref.digest[2:4]).iterdir())) == 1
+    assert store.read(ref) == PNG
+    assert store.map(ref)[:8] == PNG[:8]
+    assert store.map(store.put(b"")) == b""
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+def test_pictures_are_stored_as_references(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    w.blob_store = blobs.BlobStore(str(tmp_path / "blobs"))
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    visitor = user.Visitor("visitor", "00000-0000-0000-00000001", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    with w:
+        w.db.create(provider)
+        w.db.create(visitor)
+        w.commit()
+
+    handlers.set_private_pics(commands.SetPrivatePics([PNG, io.BytesIO(PNG), b"other"], provider.uuid), w)
+    handlers.set_profile_pic(commands.SetProfilePic(visitor.uuid, PNG), w)
+
+    loaded = worker.SqliteWorker(str(tmp_path / "db.sqlite3")).db.read(provider.uuid)
+    pictures = loaded.private_pics
+    assert all(isinstance(picture.picture, blobs.BlobRef) for picture in pictures)
+    assert pictures[0].picture == pictures[1].picture
+    assert w.blob_store.read(pictures[2].picture) == b"other"
+    assert w.db.read(visitor.uuid).profile_pic == pictures[0].picture
@@ -0,0 +1,94 @@
+import io
+import json
+
+import bulk
+import database
+import messagebus
+import user
+import worker
+
+
+def _worker(tmp_path) -> worker.SqliteWorker:
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    with w:
+        for owner in ("provider-a", "provider-b"):
+            w.db.create(user.Provider(owner, owner, None, None, [], False, False, None))
+        w.commit()
+    return w
+
+
+def test_import_jsonl(tmp_path):
+    w = _worker(tmp_path)
+    lines = [json.dumps({"owner": f"provider-{'ab'[i % 2]}", "title": f"Ad {i}", "city": "Bruxelles", "zip_code": 1000, "prices": {"hour": 100 + i}})
+             for i in range(25)]
+    lines[3] = json.dumps({"owner": "provider-a"})  # No title
+    lines[7] = "{not json"
+    lines[11] = json.dumps({"owner": "nobody", "title": "Orphan"})
+    lines[15] = "[1, 2]"
+    lines[19] = '"x"'
+    feed = io.StringIO("\n".join(lines) + "\n")
+
+    report = bulk.import_ads(bulk.read_jsonl(feed), messagebus.MessageBus(w), batch_size=10)
+
+    assert (report.imported, report.failed) == (20, 5)
+    assert [error.line for error in report.errors] == [4, 8, 16, 20, 12]  # Invalid rows first, failing commands once their batch ran
+    assert report.errors[0].message == "title is missing"
+    assert report.errors[2].message == report.errors[3].message == "not a JSON object"
+    provider = w.db.read("provider-b")
+    assert len(provider._ads) == 7  # The failing rows replaced 5 of its 12 ads
+    assert all(ad.localisation.city == "Bruxelles" for ad in provider._ads)
+    assert w.db.db.read_models.provider("provider-a").published_ads == 13
+
+
+def test_export_import_round_trip(tmp_path):
+    w = _worker(tmp_path)
+    with w:
+        provider = w.db.read("provider-a")
+        w.db.create(provider.publish_ad("Title, with comma", "Multi\nline", {"hour": 120}, user.Location("Rue", 1, "Liège", 4000, "Liège", "Belgium"), {"massage": True}, "ad-1"))
+        w.db.create(provider.publish_ad("Second", "", {}, None, {}, "ad-2"))
+        w.commit()
+    db = database.SqliteDatabase(w.connection)
+
+    for format in bulk.FORMATS:
+        exported = io.StringIO()
+        assert bulk.export_ads(db.scan("advertisement"), exported, format) == 2
+        exported.seek(0)
+        rows = [row for _, row in bulk.read(exported, format)]
+
+        assert [row["uuid"] for row in rows] == ["ad-1", "ad-2"]
+        command = bulk.parse_row(rows[0])
+        assert (command.title, command.description, command.owner) == ("Title, with comma", "Multi\nline", "provider-a")
+        assert command.localisation == user.Location("Rue", 1, "Liège", 4000, "Liège", "Belgium")
+        assert (command.prices, command.service) == ({"hour": 120}, {"massage": True})
+        assert bulk.parse_row(rows[1]).localisation is None
+
+
+def test_export_import_keeps_the_ads(tmp_path):
+    w = _worker(tmp_path)
+    with w:
+        provider = w.db.read("provider-a")
+        w.db.create(provider.publish_ad("Published", "Massage", {"hour": 120}, user.Location("Rue", 1, "Liège", 4000, "Liège", "Belgium"), {"massage": True}, "ad-1"))
+        w.db.create(provider.publish_ad("Draft", "", {}, None, {}, "ad-2"))
+        w.db.update(provider.un_publish_ad("ad-2"))
+        w.commit()
+
+    def ads(path, format):
+        # The uuid and dates are new ones once imported
+        with open(path, newline="") as file:
+            rows = [row for _, row in bulk.read(file, format)]
+        return sorted(({name: value for name, value in row.items() if name not in ("uuid", "date_published", "expiry_date")} for row in rows),
+                      key=lambda row: row["title"])
+
+    for format in bulk.FORMATS:
+        copy = str(tmp_path / f"copy-{format}.sqlite3")
+        with worker.SqliteWorker(copy) as other:
+            other.db.create(user.Provider("provider-a", "provider-a", None, None, [], False, False, None))
+            other.commit()
+        exported, reexported = str(tmp_path / f"ads.{format}"), str(tmp_path / f"copy.{format}")
+
+        assert bulk.main(["export", exported, "--db", str(tmp_path / "db.sqlite3"), "--format", format]) == 0
+        assert bulk.main(["import", exported, "--db", copy, "--format", format]) == 0
+        assert bulk.main(["export", reexported, "--db", copy, "--format", format]) == 0
+
+        assert ads(reexported, format) == ads(exported, format)
+        assert [row["published"] for row in ads(exported, format)] in (["False", "True"], [False, True])  # CSV or JSON
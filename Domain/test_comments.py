@@ -0,0 +1,43 @@
+import comments
+import commands
+import handlers
+import user
+import worker
+from test_handlers import FakeWorker
+
+
+def make_visitor(w):
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000000", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    w.db.create(visitor)
+    return visitor
+
+
+def test_comments_by_target():
+    w = FakeWorker()
+    w.comment_index = comments.CommentIndex()
+    visitor = make_visitor(w)
+    first = handlers.add_comment(commands.AddComment("ad1", visitor.uuid, "First"), w)
+    handlers.add_comment(commands.AddComment("ad1", visitor.uuid, "Second"), w)
+    handlers.add_comment(commands.AddComment("ad2", visitor.uuid, "Other ad"), w)
+    handlers.modify_comment(commands.ModifyComment(visitor.uuid, first.uuid, "First, edited"), w)
+
+    assert w.comment_index.counts(["ad1", "ad2", "ad3"]) == {"ad1": 2, "ad2": 1, "ad3": 0}
+    assert [c.content for c in w.comment_index.comments("ad1")] == ["Second", "First, edited"]
+    assert [c.content for c in w.comment_index.comments("ad1", page=2, per_page=1)] == ["First, edited"]
+
+    handlers.delete_comment(commands.DeleteComment(visitor.uuid, first.uuid), w)
+
+    assert w.comment_index.count("ad1") == 1
+
+
+def test_target_comments_page(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    visitor = make_visitor(w)
+    for i in range(3):
+        handlers.add_comment(commands.AddComment("ad1", visitor.uuid, f"Comment {i}"), w)
+    handlers.add_comment(commands.AddComment("ad2", visitor.uuid, "Other ad"), w)
+
+    page = w.db.db.target_comments_page("ad1", limit=2)
+
+    assert [c.content for c in page.comments] == ["Comment 2", "Comment 1"]
+    assert [c.content for c in w.db.db.target_comments_page("ad1", before=page.cursor).comments] == ["Comment 0"]
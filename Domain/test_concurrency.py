@@ -0,0 +1,118 @@
+import sqlite3
+
+import pytest
+
+import commands
+import database
+import handlers
+import messagebus
+import user
+import worker
+
+
+def make_workers(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w, other = worker.SqliteWorker(path), worker.SqliteWorker(path)
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    with w:
+        w.db.create(provider)
+        w.commit()
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("TestAd", "This is a test Ad", None, None, {"hour": 100}, provider.uuid), w)
+    return w, other, provider, ad
+
+
+def test_update_checks_the_version_read(tmp_path):
+    w, other, provider, ad = make_workers(tmp_path)
+    # Outside any transaction, nothing but the version stops the second write
+    first, second = database.SqliteDatabase(w.connection), database.SqliteDatabase(other.connection)
+    mine, theirs = first.read(ad.uuid), second.read(ad.uuid)
+
+    theirs.prices = {"hour": 80}
+    second.update(theirs)
+    mine.prices = {"hour": 120}
+    with pytest.raises(database.ConcurrentUpdate):
+        first.update(mine)
+
+    assert database.SqliteDatabase(w.connection).read(ad.uuid).prices == {"hour": 80}
+    first.discard()
+    first.update(mine)  # Forgotten versions aren't checked
+    assert w.connection.execute("SELECT version FROM domain_object WHERE uuid = ?", (ad.uuid,)).fetchone() == (2,)
+
+
+def test_stale_snapshot_is_a_conflict(tmp_path):
+    w, other, provider, ad = make_workers(tmp_path)
+    # In a worker transaction, SQLite refuses the write before the version is compared
+    with w:
+        mine = w.db.read(ad.uuid)
+        handlers.update_ad_prices(commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {"hour": 80}), other)
+        mine.prices = {"hour": 120}
+        w.db.update(mine)
+        with pytest.raises(sqlite3.OperationalError) as error:
+            w.db.flush()
+
+    assert error.value.sqlite_errorcode == database.SQLITE_BUSY_SNAPSHOT
+    assert database.is_conflict(error.value)
+    assert not database.is_conflict(sqlite3.OperationalError("no such table: nothing"))
+
+
+def test_conflicting_handler_is_run_again(tmp_path):
+    w, other, provider, ad = make_workers(tmp_path)
+    calls = []
+
+    def add_prices(command: commands.UpdateAdvertisementPrices, w: worker.AbstractWorker):
+        with w:
+            publisher: user.Provider = w.db.read(command.owner)
+            current = publisher.get_ad(command.uuid).prices
+            calls.append(dict(current))
+            if len(calls) == 1:  # Someone else updates the ad between our read and our write
+                handlers.update_ad_prices(commands.UpdateAdvertisementPrices(command.owner, command.uuid, {**current, "day": 500}), other)
+            advertisement = publisher.update_ad_prices(command.uuid, {**current, **command.prices})
+            w.db.update(advertisement)
+            w.commit()
+        return advertisement
+
+    bus = messagebus.MessageBus(w, backoff=0)
+    bus.handlers[commands.UpdateAdvertisementPrices] = add_prices
+    bus.handle(commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {"night": 900}))
+
+    assert calls == [{"hour": 100}, {"hour": 100, "day": 500}]
+    assert worker.SqliteWorker(str(tmp_path / "db.sqlite3")).db.read(ad.uuid).prices == {"hour": 100, "day": 500, "night": 900}
+
+
+def test_retries_are_bounded(tmp_path):
+    w, other, provider, ad = make_workers(tmp_path)
+    calls = []
+
+    def always_late(command, w):
+        calls.append(command)
+        raise database.ConcurrentUpdate(command.uuid)
+
+    bus = messagebus.MessageBus(w, max_attempts=4, backoff=0)
+    bus.handlers[commands.UpdateAdvertisementPrices] = always_late
+    with pytest.raises(database.ConcurrentUpdate):
+        bus.handle(commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {}))
+    assert len(calls) == 4
+
+    calls.clear()
+    with pytest.raises(database.ConcurrentUpdate):
+        bus.handle_batch([commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {}), commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {})])
+    assert len(calls) == 4  # The whole batch, not the failing command alone: it stops at its first conflict
+
+
+def test_nested_rollback_keeps_the_outer_reads(tmp_path):
+    w, other, provider, ad = make_workers(tmp_path)
+    with w:
+        publisher = w.db.read(provider.uuid)
+        mine = publisher.get_ad(ad.uuid)
+        with w:
+            touched = w.db.read(ad.uuid)
+            touched.prices = {"hour": 1}
+            w.db.update(touched)
+            w.db.flush()  # Left without commit: rolled back to the savepoint
+        assert w.db.read(provider.uuid) is publisher  # Read by the outer unit only
+        assert w.db.read(ad.uuid) is not touched and w.db.read(ad.uuid).prices == {"hour": 100}
+        mine.prices = {"hour": 120}
+        w.db.update(mine)  # Checked against the version read before the savepoint
+        w.commit()
+
+    assert worker.SqliteWorker(str(tmp_path / "db.sqlite3")).db.read(ad.uuid).prices == {"hour": 120}
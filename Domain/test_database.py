@@ -0,0 +1,122 @@
+import user
+import commands
+import worker
+import handlers
+
+
+def test_create_read_provider_with_ads(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    provider.publish_ad("TestAd", "This is a test Ad", {"service1": 123}, None, {}, "00000-0000-0000-00000001")
+    provider.promote_ad_to_premium("00000-0000-0000-00000001")
+    with w:
+        w.db.create(provider)
+        w.commit()
+
+    w = worker.SqliteWorker(path)
+    loaded: user.Provider = w.db.read(provider.uuid)
+
+    assert loaded == provider
+    assert loaded.get_ad("00000-0000-0000-00000001").prices["service1"] == 123
+    assert loaded._premium_ads[0].ad_uuid == "00000-0000-0000-00000001"
+    assert w.db.read("00000-0000-0000-00000001").title == "TestAd"
+    assert w.db.read("unknown") is None
+
+
+def test_handlers_persist(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    w.db.create(provider)
+
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("TestAd", "This is a test Ad", None, None, None, provider.uuid), w)
+    handlers.un_publish_advertisement(commands.UnPublishAdvertisement(provider.uuid, ad.uuid), w)
+
+    w = worker.SqliteWorker(path)  # A fresh connection only sees what was committed.
+    assert w.db.read(ad.uuid).published is False
+    assert w.db.read(provider.uuid).get_ad(ad.uuid).published is False
+
+    handlers.delete_ad(commands.DeleteAdvertisement(provider.uuid, ad.uuid), w)
+
+    assert w.db.read(ad.uuid) is None
+    assert w.db.read(provider.uuid).get_ad(ad.uuid) is None
+
+
+def test_visitor_comments_persist(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000000", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    w.db.create(visitor)
+
+    comment = handlers.add_comment(commands.AddComment("00000-0000-0000-00000001", visitor.uuid, "Hello"), w)
+    handlers.modify_comment(commands.ModifyComment(visitor.uuid, comment.uuid, "Hello again"), w)
+
+    assert w.db.read(visitor.uuid).comments[0].content == "Hello again"
+
+
+def test_rollback_discards_writes(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+
+    with w:
+        w.db.create(provider)
+
+    assert w.db.read(provider.uuid) is None
+
+
+def test_identity_map(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    with w:
+        w.db.create(provider)
+        w.commit()
+
+    with w:
+        first = w.db.read(provider.uuid)
+        assert w.db.read(provider.uuid) is first
+        first.vip = True
+        w.db.update(first)
+        assert w.db.dirty
+        w.commit()
+
+    assert not w.db.dirty
+    assert w.db.read(provider.uuid) is not first
+    assert w.db.read(provider.uuid).vip is True
+
+
+def test_comment_pages(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000000", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    w.db.create(visitor)
+    comments = [handlers.add_comment(commands.AddComment("00000-0000-0000-00000001", visitor.uuid, f"Hello {i}"), w) for i in range(45)]
+
+    first = w.db.db.comments_page(visitor.uuid)
+    second = w.db.db.comments_page(visitor.uuid, before=first.cursor)
+    last = w.db.db.comments_page(visitor.uuid, before=second.cursor)
+
+    assert [c.content for c in first.comments][:2] == ["Hello 44", "Hello 43"]
+    assert len(second.comments) == 20 and second.comments[0].content == "Hello 24"
+    assert len(last.comments) == 5 and last.cursor is None
+
+    handlers.delete_comment(commands.DeleteComment(visitor.uuid, comments[0].uuid), w)
+    loaded = worker.SqliteWorker(path).db.read(visitor.uuid)
+
+    assert loaded.comments.get(comments[1].uuid).content == "Hello 1"
+    assert comments[0].uuid not in loaded.comments
+    assert len(loaded.comments) == 44
+
+
+def test_report_thread_persist(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    moderator = user.Moderator("moddude", "00000-0000-0000-00000000", "abcd1234", "test@test.com")
+    w.db.create(moderator)
+    report = handlers.report(commands.Report(moderator.uuid, "00000-0000-0000-00000001", "Spam"), w)
+    handlers.open_report(commands.OpenReport(moderator.uuid, report.uuid), w)
+    for i in range(3):
+        handlers.comment_report(commands.CommentReport(moderator.uuid, report.uuid, f"Comment {i}"), w)
+
+    loaded = w.db.read(report.uuid)
+
+    assert [c.content for c in loaded.comment][1:] == ["Comment 0", "Comment 1", "Comment 2"]
+    assert [c.content for c in w.db.db.report_comments_page(report.uuid, limit=2).comments] == ["Comment 2", "Comment 1"]
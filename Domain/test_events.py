@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import commands
+import events
+import messagebus
+from test_helpers import make_worker
+
+
+def test_events_after_commit():
+    w, provider = make_worker(event_bus=events.EventBus())
+    received = []
+    w.event_bus.subscribe(events.AdPublished, received.append)
+    w.event_bus.subscribe(events.AdUnpublished, lambda event: received.append(w.commited))
+    bus = messagebus.MessageBus(w)
+
+    ad = bus.handle(commands.PublishAdvertisement("Massage", "Massage relaxant", None, {}, {}, provider.uuid))
+    bus.handle(commands.UpdateAdvertisementPublishedDate(provider.uuid, ad.uuid))  # AdRepublished is an AdPublished
+    bus.handle(commands.UnPublishAdvertisement(provider.uuid, ad.uuid))
+
+    assert [type(event) for event in received[:2]] == [events.AdPublished, events.AdRepublished]
+    assert received[2] is True
+
+
+def test_failed_command_emits_nothing():
+    w, provider = make_worker(event_bus=events.EventBus())
+    received = []
+    w.event_bus.subscribe(events.Event, received.append)
+
+    results = messagebus.MessageBus(w).handle_batch([
+        commands.PublishAdvertisement("Massage", "Massage relaxant", None, {}, {}, provider.uuid),
+        commands.UnPublishAdvertisement(provider.uuid, "unknown"),
+    ])
+
+    assert [result.ok for result in results] == [True, False]
+    assert [type(event) for event in received] == [events.AdPublished]
+
+
+def test_failing_subscriber_does_not_stop_the_others():
+    bus = events.EventBus()
+    received = []
+    bus.subscribe(events.UserDisabled, lambda event: 1 / 0)
+    bus.subscribe(events.UserDisabled, received.append)
+
+    bus.publish([events.UserDisabled("someone")])
+
+    assert received == [events.UserDisabled("someone")]
+
+
+class BrokenSearchIndex:
+    def add(self, ad):
+        raise RuntimeError("index unavailable")
+
+
+def test_failing_projection_does_not_stop_the_event_bus():
+    w, provider = make_worker(event_bus=events.EventBus())
+    w.search_index = BrokenSearchIndex()
+    received = []
+    w.event_bus.subscribe(events.AdPublished, received.append)
+
+    ad = messagebus.MessageBus(w).handle(commands.PublishAdvertisement("Massage", "Massage relaxant", None, {}, {}, provider.uuid))
+
+    assert w.db.read(ad.uuid) is not None
+    assert [event.ad.uuid for event in received] == [ad.uuid]
+
+
+def test_async_batch_consumer():
+    batches = []
+
+    async def consume(batch):
+        batches.append(batch)
+
+    consumer = events.AsyncBatchConsumer(consume, batch_size=10)
+    bus = events.EventBus()
+    bus.subscribe(events.Event, consumer)
+
+    async def main():
+        task = asyncio.create_task(consumer.run())
+        await consumer.started()
+        # Published from another thread, like a synchronous worker would
+        thread = threading.Thread(target=bus.publish, args=([events.UserActivated(str(i)) for i in range(25)],))
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+
+    assert sum(len(batch) for batch in batches) == 25
+    assert all(len(batch) <= 10 for batch in batches)
+    assert [event.user_uuid for batch in batches for event in batch] == [str(i) for i in range(25)]
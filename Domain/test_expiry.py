@@ -0,0 +1,119 @@
+import datetime
+
+import commands
+import database
+import expiry
+import handlers
+import messagebus
+import search
+import user
+from test_helpers import make_worker, sqlite_worker
+
+
+def test_scheduler_reschedule_and_cancel():
+    scheduler = expiry.ExpiryScheduler()
+    now = datetime.datetime(2024, 1, 1)
+    for i in range(10):
+        scheduler.schedule(expiry.AD, "owner", f"ad{i}", now + datetime.timedelta(days=i))
+    scheduler.schedule(expiry.AD, "owner", "ad0", now + datetime.timedelta(days=30))  # VIP bump
+    scheduler.cancel(expiry.AD, "ad1")
+
+    due = scheduler.pop_due(now + datetime.timedelta(days=3))
+
+    assert [command.uuid for command in due] == ["ad2", "ad3"]
+    assert scheduler.next_expiry() == now + datetime.timedelta(days=4)
+    assert len(scheduler) == 7
+
+
+def test_expired_ads_are_unpublished_in_one_batch():
+    w, provider = make_worker(expiry=expiry.ExpiryScheduler(), search_index=search.AdSearchIndex())
+    ads = [handlers.publish_advertisement(commands.PublishAdvertisement(f"Ad {i}", "Massage", None, {}, {}, provider.uuid), w) for i in range(5)]
+    handlers.promote_ad_to_premium(commands.PromoteAdvertisementToPremium(provider.uuid, ads[0].uuid), w)
+    bumped = handlers.update_ad_published_date(commands.UpdateAdvertisementPublishedDate(provider.uuid, ads[1].uuid), w)
+    bumped.expiry_date += datetime.timedelta(days=7)
+    w.expiry.schedule(expiry.AD, provider.uuid, bumped.uuid, bumped.expiry_date)
+
+    results = w.expiry.run_due(messagebus.MessageBus(w), datetime.datetime.now() + datetime.timedelta(days=8))
+
+    assert len(results) == 5  # 4 ads and 1 promotion
+    assert all(result.ok for result in results)
+    assert [ad.uuid for ad in provider._ads if ad.published] == [bumped.uuid]
+    assert len(provider._premium_ads) == 0
+    assert [ad.uuid for ad in w.search_index.search("massage").ads] == [bumped.uuid]
+    assert len(w.expiry) == 1
+
+
+def test_failed_expiries_are_dropped_unless_conflicting():
+    w, provider = make_worker(expiry=expiry.ExpiryScheduler(), search_index=search.AdSearchIndex())
+    ads = [handlers.publish_advertisement(commands.PublishAdvertisement(f"Ad {i}", "Massage", None, {}, {}, provider.uuid), w) for i in range(3)]
+    later = datetime.datetime.now() + datetime.timedelta(days=8)
+    w.expiry.schedule(expiry.AD, provider.uuid, "deleted-ad", datetime.datetime.now())  # Fails for good, before the real ones
+
+    results = w.expiry.run_due(messagebus.MessageBus(w), later, limit=1)
+
+    assert [type(result.error) for result in results] == [user.AdNotFound]
+    assert len(w.expiry) == 3
+
+    class BrokenBus:
+        def handle_batch(self, batch):
+            raise ConnectionError("database unavailable")
+
+    class ConflictingBus:
+        def handle_batch(self, batch):
+            return [messagebus.CommandResult(command, error=database.ConcurrentUpdate()) for command in batch]
+
+    try:
+        w.expiry.run_due(BrokenBus(), later)
+        assert False
+    except ConnectionError:
+        pass
+    w.expiry.run_due(ConflictingBus(), later)
+    assert len(w.expiry) == 3
+
+    results = w.expiry.run_due(messagebus.MessageBus(w), later, limit=1)
+
+    assert len(results) == 1 and results[0].ok
+    results = w.expiry.run_due(messagebus.MessageBus(w), later)
+    assert len(results) == 2 and all(result.ok for result in results)
+    assert not any(ad.published for ad in ads)
+    assert len(w.expiry) == 0 and w.expiry.next_expiry() is None
+
+
+def test_schedule_stored(tmp_path):
+    w, provider = make_worker(sqlite_worker(tmp_path), expiry=expiry.ExpiryScheduler(), search_index=search.AdSearchIndex())
+    ads = [handlers.publish_advertisement(commands.PublishAdvertisement(f"Ad {i}", "Massage", None, {}, {}, provider.uuid), w) for i in range(3)]
+    handlers.un_publish_advertisement(commands.UnPublishAdvertisement(provider.uuid, ads[2].uuid), w)
+    handlers.promote_ad_to_premium(commands.PromoteAdvertisementToPremium(provider.uuid, ads[0].uuid), w)
+
+    scheduler = expiry.ExpiryScheduler()
+    scheduler.schedule_stored(w.db.db)
+
+    assert len(scheduler) == 3  # 2 published ads and 1 promotion
+    assert sorted(command.uuid for command in scheduler.pop_due(datetime.datetime.now() + datetime.timedelta(days=60))) == \
+        sorted([ads[0].uuid, ads[0].uuid, ads[1].uuid])
+
+
+def test_expire_ad_not_expired():
+    w, provider = make_worker(expiry=expiry.ExpiryScheduler(), search_index=search.AdSearchIndex())
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Ad", "Massage", None, {}, {}, provider.uuid), w)
+
+    try:
+        handlers.expire_ad(commands.ExpireAdvertisement(provider.uuid, ad.uuid), w)
+        assert False
+    except user.AdNotExpired:
+        pass
+
+    assert ad.published
+
+
+def test_expire_premium_ad_sqlite(tmp_path):
+    w, provider = make_worker(sqlite_worker(tmp_path), expiry=expiry.ExpiryScheduler(), search_index=search.AdSearchIndex())
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Ad", "Massage", None, {}, {}, provider.uuid), w)
+    handlers.promote_ad_to_premium(commands.PromoteAdvertisementToPremium(provider.uuid, ad.uuid), w)
+    later = datetime.datetime.now() + datetime.timedelta(days=8)
+
+    handlers.expire_premium_ad(commands.ExpirePremiumAdvertisement(provider.uuid, ad.uuid, later), w)
+
+    assert w.db.read(user.PremiumAdvertisement.uuid_of(ad.uuid)) is None
+    assert len(w.db.read(provider.uuid)._premium_ads) == 0
+    assert w.db.read(ad.uuid).published
@@ -0,0 +1,53 @@
+import datetime
+
+import commands
+import feed
+import handlers
+import user
+from test_handlers import FakeWorker
+
+
+def test_feed_order_and_pages():
+    premium_feed = feed.PremiumFeed()
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(25):
+        ad = user.Advertisement(f"Ad {i}", "", start, start + datetime.timedelta(days=7), None, {}, {}, "owner", True, f"ad{i}")
+        premium_feed.add(user.PremiumAdvertisement("owner", ad.uuid, start + datetime.timedelta(hours=i), ad.expiry_date), ad)
+
+    first = premium_feed.page(1)
+    last = premium_feed.page(3)
+
+    assert [item.ad.uuid for item in first.items][:3] == ["ad24", "ad23", "ad22"]
+    assert first.total == 25 and first.has_next and not first.has_previous
+    assert len(last.items) == 5 and not last.has_next
+    assert premium_feed.page(1) is first  # Cached until the feed changes
+    assert premium_feed.page(50_000) is last and premium_feed.page(-1) is first
+    assert len(premium_feed._pages) == 2
+    assert feed.PremiumFeed().page(7).page == 1
+
+    premium_feed.remove("ad24")
+
+    assert premium_feed.page(1) is not first
+    assert premium_feed.page(1).version > first.version
+    assert premium_feed.page(1).items[0].ad.uuid == "ad23"
+
+
+def test_feed_follows_handlers():
+    w = FakeWorker()
+    w.premium_feed = feed.PremiumFeed()
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    w.db.create(provider)
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Massage", "Massage relaxant", None, {}, {}, provider.uuid), w)
+    other = handlers.publish_advertisement(commands.PublishAdvertisement("Coiffure", "Coupe", None, {}, {}, provider.uuid), w)
+
+    handlers.promote_ad_to_premium(commands.PromoteAdvertisementToPremium(provider.uuid, ad.uuid), w)
+    handlers.promote_ad_to_premium(commands.PromoteAdvertisementToPremium(provider.uuid, other.uuid), w)
+    handlers.update_ad_prices(commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {"massage": 50}), w)
+
+    assert [item.ad.uuid for item in w.premium_feed.page().items] == [other.uuid, ad.uuid]
+    assert w.premium_feed.page().items[1].ad.prices == {"massage": 50}
+
+    handlers.un_publish_advertisement(commands.UnPublishAdvertisement(provider.uuid, other.uuid), w)
+    handlers.delete_ad(commands.DeleteAdvertisement(provider.uuid, ad.uuid), w)
+
+    assert len(w.premium_feed) == 0
@@ -2,6 +2,7 @@ from collections import defaultdict
 
 import database
 import notifications
+import outbox
 import user
 import commands
 import worker
@@ -13,25 +14,25 @@ from typing import Dict, List
 class FakeDatabase(database.AbstractDatabase):
     def __init__(self, obj):
         super().__init__()
-        self._collection = set(obj)  # Type Set(object)
+        self._collection = {o.uuid: o for o in obj}  # Type Dict[str, object]
 
     def create(self, obj: object):
-        self._collection.add(obj)
+        self._collection[obj.uuid] = obj
 
     def read(self, uuid: str) -> object:
-        return next((a for a in self._collection if a.uuid == uuid), None)
+        return self._collection.get(uuid)
 
     def delete(self, uuid: str):
-        ad = next((a for a in self._collection if a.uuid == uuid), None)
-        self._collection.remove(ad)
+        del self._collection[uuid]
 
     def update(self, obj: object):
-        self._collection.add(obj)
+        self._collection[obj.uuid] = obj
 
 
 class FakeWorker(worker.AbstractWorker):
     def __init__(self):
         self.db = FakeDatabase([])
+        self.outbox = outbox.MemoryOutbox()
         self.commited = False
 
     def _commit(self):
@@ -165,12 +166,20 @@ def test_send_sms_visitor():
     w.db.create(visitor)
 
     for i in range(50):
-        handlers.send_sms_visitor(command, w, notification)
+        handlers.send_sms_visitor(command, w)
 
     assert visitor.sms_sent == 50
+    assert len(notification.sent["+320000000"]) == 0  # Nothing is sent before the dispatcher runs
+
+    outbox.Dispatcher(w.outbox, notification).drain()
+
     assert len(notification.sent["+320000000"]) == 50
 
     try:
-        handlers.send_sms_visitor(command, w, notification)
+        handlers.send_sms_visitor(command, w)
     except user.SmsLimitWasReached:
         pass
+
+    outbox.Dispatcher(w.outbox, notification).drain()
+
+    assert len(notification.sent["+320000000"]) == 50
@@ -0,0 +1,26 @@
+import user
+import worker
+from test_handlers import FakeWorker
+
+
+def create(w: worker.AbstractWorker, *objects) -> worker.AbstractWorker:
+    """ Stores objects in a committed unit of work of w. """
+    with w:
+        for obj in objects:
+            w.db.create(obj)
+        w.commit()
+    return w
+
+
+def sqlite_worker(tmp_path) -> worker.SqliteWorker:
+    return worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+
+
+def make_worker(w: worker.AbstractWorker = None, **attributes):
+    """ w (a FakeWorker by default) with attributes set on it (search_index=..., event_bus=..., ...), and the Provider stored in it. """
+    w = w if w is not None else FakeWorker()
+    for name, value in attributes.items():
+        setattr(w, name, value)
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    create(w, provider)
+    return w, provider
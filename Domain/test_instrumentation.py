@@ -0,0 +1,57 @@
+import threading
+
+import commands
+import instrumentation
+import messagebus
+import user
+import worker
+
+
+def test_histogram_quantiles():
+    histogram = instrumentation.Histogram()
+    for i in range(1, 101):
+        histogram.record(i / 1000)
+
+    assert histogram.count == 100
+    assert 0.050 <= histogram.quantile(0.5) < 0.050 * 1.2
+    assert 0.099 <= histogram.quantile(0.99) < 0.099 * 1.2
+    assert histogram.quantile(1) >= 0.1
+    assert instrumentation.Histogram().quantile(0.5) == 0.0
+
+
+def test_threads_are_merged():
+    metrics = instrumentation.Metrics()
+
+    def record():
+        for _ in range(1000):
+            metrics.observe("work", 0.001)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.snapshot()["work"].count == 4000
+    metrics.reset()
+    assert "work" not in metrics.snapshot()
+
+
+def test_worker_and_bus_timings(tmp_path):
+    metrics = instrumentation.Metrics()
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"), metrics)
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    with w:
+        w.db.create(provider)
+        w.commit()
+
+    messagebus.MessageBus(w).handle(commands.PublishAdvertisement("TestAd", "This is a test Ad", None, None, None, provider.uuid))
+
+    snapshot = metrics.snapshot()
+    assert snapshot["handler.PublishAdvertisement"].count == 1
+    assert snapshot["worker.commit"].count == 2
+    assert snapshot["db.read"].count == 1
+    assert snapshot["db.create"].count == 2
+    text = instrumentation.render_text(snapshot)
+    assert 'hub_latency_seconds_count{name="handler.PublishAdvertisement"} 1' in text
+    assert 'hub_latency_seconds{name="db.read",quantile="0.99"}' in text
@@ -0,0 +1,66 @@
+import datetime
+
+import commands
+import database
+import handlers
+import invalidation
+import user
+import worker
+from test_handlers import FakeWorker
+
+
+def test_handlers_invalidate_pages():
+    w = FakeWorker()
+    w.page_versions = invalidation.MemoryPageVersions()
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    w.db.create(provider)
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000001", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    w.db.create(visitor)
+    other = handlers.publish_advertisement(commands.PublishAdvertisement("Coiffure", "Coupe", None, {}, {}, provider.uuid), w)
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Massage", "Massage relaxant", None, {}, {}, provider.uuid), w)
+    scopes = (invalidation.ADS, invalidation.ad_scope(ad.uuid), invalidation.ad_scope(other.uuid), invalidation.provider_scope(provider.uuid))
+
+    assert w.page_versions.versions(scopes) == [3, 2, 2, 3]
+
+    handlers.update_ad_prices(commands.UpdateAdvertisementPrices(provider.uuid, ad.uuid, {"massage": 50}), w)
+    handlers.add_comment(commands.AddComment(ad.uuid, visitor.uuid, "Hello"), w)
+
+    assert w.page_versions.versions(scopes) == [4, 4, 2, 4]
+
+    admin = user.Admin("testdudeadmin", "00000-0000-0000-00000002", "abcd1234", "test@test.com")
+    w.db.create(admin)
+    handlers.update_billing(commands.UpdateBilling(provider.uuid, "4000 0000 0000 0000", datetime.date(2030, 1, 1), "123", "Test Dude"), w)
+    handlers.disable_user(commands.DisableUser(admin.uuid, provider.uuid), w)
+
+    assert w.page_versions.versions(scopes) == [4, 4, 2, 6]  # The provider pages only, not every listing
+
+
+def test_rollback_keeps_pages():
+    w = FakeWorker()
+    w.page_versions = invalidation.MemoryPageVersions()
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    w.db.create(provider)
+
+    try:
+        handlers.un_publish_advertisement(commands.UnPublishAdvertisement(provider.uuid, "unknown"), w)
+    except user.AdNotFound:
+        pass
+
+    assert w.page_versions.versions([invalidation.ADS]) == [1]
+
+
+def test_sqlite_versions_are_shared(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    w = worker.SqliteWorker(path)
+    w.page_versions = invalidation.SqlitePageVersions(w.connection)
+    other_process = invalidation.SqlitePageVersions(database.connect(path))
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    with w:
+        w.db.create(provider)
+        w.commit()
+
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Massage", "Massage relaxant", None, {}, {}, provider.uuid), w)
+    other_process.invalidate([invalidation.ADS, "unused"])
+
+    assert other_process.versions([invalidation.ADS, invalidation.ad_scope(ad.uuid), "never invalidated"]) == [3, 2, 1]
+    assert w.page_versions.versions(["unused"]) == [2]
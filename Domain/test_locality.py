@@ -0,0 +1,70 @@
+import commands
+import handlers
+import locality
+import search
+import user
+from test_handlers import FakeWorker
+
+
+BRUSSELS = user.Location("Rue Neuve", 1, "Bruxelles", 1000, "Brabant", "Belgium", 50.8503, 4.3517)
+LIEGE = user.Location("Place Saint-Lambert", 1, "Liège", 4000, "Liège", "Belgium", 50.6326, 5.5797)
+CHARLEROI = user.Location("Boulevard Tirou", 1, "Charleroi", 6000, "Hainaut", "Belgium", 50.4108, 4.4446)
+PARIS = user.Location("Rue de Rivoli", 2, "Paris", 75001, "Ile-de-France", "France", 48.8566, 2.3522)
+
+
+def test_hierarchical_buckets():
+    index = locality.LocalityIndex()
+    index.add("brussels", BRUSSELS)
+    index.add("liege", LIEGE)
+    index.add("paris", PARIS)
+
+    assert index.within(country="belgium") == {"brussels", "liege"}
+    assert index.within(country="Belgium", state="Liège") == {"liege"}
+    assert index.within(city="Paris") == {"paris"}
+    assert index.within(zip_code=1000) == {"brussels"}
+    assert index.within(country="France", zip_code=1000) == set()
+    assert index.within(state="brabant", zip_code=1000) == {"brussels"}
+
+    index.add("liege", CHARLEROI)  # Moving an ad is a remove and an add
+
+    assert index.within(state="Liège") == set()
+    assert index.within(country="Belgium", state="Hainaut", city="Charleroi", zip_code=6000) == {"liege"}
+    assert len(index) == 3
+
+
+def test_near():
+    index = locality.LocalityIndex()
+    for name, location in (("brussels", BRUSSELS), ("liege", LIEGE), ("charleroi", CHARLEROI), ("paris", PARIS)):
+        index.add(name, location)
+    index.add("nowhere", user.Location("Rue", 1, "Nowhere", 1, "None", "Belgium"))
+
+    assert [uuid for _, uuid in index.near(50.85, 4.35, 60)] == ["brussels", "charleroi"]
+    assert [uuid for _, uuid in index.near(50.85, 4.35, 300)] == ["brussels", "charleroi", "liege", "paris"]
+    assert index.near(0, 0, 100) == []
+
+
+def test_near_wraps_around_the_globe():
+    index = locality.LocalityIndex()
+    index.add("east", user.Location("Rue", 1, "East", 1, "", "Fiji", -17.0, 179.95))
+    index.add("west", user.Location("Rue", 1, "West", 1, "", "Fiji", -17.0, -179.95))
+    index.add("pole", user.Location("Rue", 1, "Pole", 1, "", "", 89.99, 180.0))
+
+    assert [uuid for _, uuid in index.near(-17.0, 179.95, 20)] == ["east", "west"]
+    assert [uuid for _, uuid in index.near(-17.0, -179.99, 20)] == ["west", "east"]
+    assert [uuid for _, uuid in index.near(89.99, 0.0, 5)] == ["pole"]
+    assert len(index._columns_between(-10.0, 400.0)) == index._columns
+
+
+def test_search_near_me():
+    w = FakeWorker()
+    w.search_index = search.AdSearchIndex()
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, True, None)
+    w.db.create(provider)
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Massage", "Massage relaxant", BRUSSELS, {}, {}, provider.uuid), w)
+
+    assert w.search_index.search("massage", near=(50.85, 4.35, 10)).total == 1
+
+    handlers.update_ad_location(commands.UpdateAdvertisementLocation(provider.uuid, ad.uuid, LIEGE), w)
+
+    assert w.search_index.search("massage", near=(50.85, 4.35, 10)).total == 0
+    assert w.search_index.search(country="belgium", state="liège").total == 1
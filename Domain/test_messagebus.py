@@ -0,0 +1,65 @@
+import user
+import commands
+import messagebus
+import worker
+from test_handlers import FakeWorker
+
+
+class CountingWorker(FakeWorker):
+    def __init__(self):
+        super().__init__()
+        self.commits = 0
+        self.reads = 0
+        read = self.db.db.read
+
+        def counting_read(uuid):
+            self.reads += 1
+            return read(uuid)
+
+        self.db.db.read = counting_read
+
+    def _commit(self):
+        super()._commit()
+        self.commits += 1
+
+
+def test_handle_batch_commits_once():
+    w = CountingWorker()
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    w.db.db.create(provider)
+    bus = messagebus.MessageBus(w)
+
+    batch = [commands.PublishAdvertisement(f"TestAd{i}", "This is a test Ad", None, None, None, provider.uuid) for i in range(100)]
+    results = bus.handle_batch(batch)
+
+    assert all(result.ok for result in results)
+    assert len(provider._ads) == 100
+    assert w.commits == 1
+    assert w.reads == 1
+
+
+def test_handle_batch_reports_errors(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    provider = user.Provider("testdude", "00000-0000-0000-00000000", None, None, list(), False, False, None)
+    w.db.create(provider)
+    bus = messagebus.MessageBus(w)
+
+    results = bus.handle_batch([
+        commands.PublishAdvertisement("TestAd", "This is a test Ad", None, None, None, provider.uuid),
+        commands.UpdateAdvertisementPublishedDate(provider.uuid, "00000-0000-0000-00000001"),  # Not VIP
+        commands.PublishAdvertisement("TestAd2", "This is a test Ad", None, None, None, provider.uuid),
+    ])
+
+    assert [result.ok for result in results] == [True, False, True]
+    assert isinstance(results[1].error, user.NotVip)
+    assert len(w.db.read(provider.uuid)._ads) == 2
+
+
+def test_unknown_command():
+    bus = messagebus.MessageBus(FakeWorker())
+
+    try:
+        bus.handle(commands.Command())
+        assert False
+    except messagebus.UnknownCommand:
+        pass
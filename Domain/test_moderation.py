@@ -0,0 +1,55 @@
+import commands
+import handlers
+import messagebus
+import user
+import worker
+from test_helpers import create, sqlite_worker
+
+
+def make_worker(tmp_path):
+    moderator = user.Moderator("moddude", "00000-0000-0000-00000000", "abcd1234", "test@test.com")
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000001", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    w = create(sqlite_worker(tmp_path), moderator, visitor)
+    reports = [handlers.report(commands.Report(visitor.uuid, f"ad{i}", "Spam"), w) for i in range(5)]
+    return w, moderator, reports
+
+
+def test_claim_oldest_first(tmp_path):
+    w, moderator, reports = make_worker(tmp_path)
+    other_moderator = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+
+    first = handlers.claim_report(commands.ClaimReport(moderator.uuid), w)
+    second = handlers.claim_report(commands.ClaimReport(moderator.uuid), other_moderator)
+
+    assert [first.uuid, second.uuid] == [reports[0].uuid, reports[1].uuid]
+    assert w.db.read(first.uuid).status == "PENDING"
+    assert w.report_queue.counts() == {"NEW": 3, "PENDING": 2, "CLOSED": 0}
+    assert [uuid for _, uuid in w.report_queue.oldest("NEW", limit=2)] == [reports[2].uuid, reports[3].uuid]
+    page = w.report_queue.oldest("NEW", limit=2)
+    assert [uuid for _, uuid in w.report_queue.oldest("NEW", after=page[-1])] == [reports[4].uuid]
+
+
+def test_claim_empty_queue(tmp_path):
+    w, moderator, reports = make_worker(tmp_path)
+    for _ in reports:
+        handlers.claim_report(commands.ClaimReport(moderator.uuid), w)
+
+    assert handlers.claim_report(commands.ClaimReport(moderator.uuid), w) is None
+
+
+def test_bulk_close(tmp_path):
+    w, moderator, reports = make_worker(tmp_path)
+    claimed = [handlers.claim_report(commands.ClaimReport(moderator.uuid), w) for _ in range(3)]
+
+    closed = messagebus.MessageBus(w).handle(commands.CloseReports(moderator.uuid, [report.uuid for report in claimed]))
+
+    assert [report.status for report in closed] == ["CLOSED"] * 3
+    assert w.report_queue.counts() == {"NEW": 2, "PENDING": 0, "CLOSED": 3}
+
+    try:
+        handlers.close_reports(commands.CloseReports(moderator.uuid, [reports[3].uuid, reports[4].uuid]), w)
+        assert False
+    except user.ReportNotOpened:
+        pass
+
+    assert w.report_queue.counts()["NEW"] == 2
@@ -0,0 +1,67 @@
+import datetime
+
+import commands
+import handlers
+import notifications
+import outbox
+import user
+import worker
+
+
+class FlakyNotifications(notifications.AbstractNotifications):
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.sent = []
+
+    def send(self, to: str, message: str):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Gateway timeout")
+        self.sent.append((to, message))
+
+
+def test_dispatcher_retries_with_backoff():
+    box = outbox.MemoryOutbox()
+    box.add([outbox.OutboxMessage("+320000000", "Hello", "00000-0000-0000-00000000")])
+    notification = FlakyNotifications(failures=2)
+    dispatcher = outbox.Dispatcher(box, notification, backoff=datetime.timedelta(seconds=10))
+    now = datetime.datetime(2024, 1, 1)
+
+    dispatcher.dispatch_once(now)
+    assert dispatcher.dispatch_once(now) == 0  # Not due before the backoff
+    dispatcher.dispatch_once(now + datetime.timedelta(seconds=10))
+    dispatcher.dispatch_once(now + datetime.timedelta(seconds=29))
+    assert notification.sent == []
+    dispatcher.dispatch_once(now + datetime.timedelta(seconds=30))
+
+    assert notification.sent == [("+320000000", "Hello")]
+    assert box.fetch(now + datetime.timedelta(days=1), 10) == []
+
+
+def test_dispatcher_gives_up():
+    box = outbox.MemoryOutbox()
+    box.add([outbox.OutboxMessage("+320000000", "Hello", "00000-0000-0000-00000000")])
+    dispatcher = outbox.Dispatcher(box, FlakyNotifications(failures=10), max_attempts=3, backoff=datetime.timedelta(0))
+
+    dispatcher.drain()
+
+    assert len(box.failed) == 1
+    assert box.failed[0].attempts == 3
+
+
+def test_sqlite_outbox_is_transactional(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000000", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    with w:
+        w.db.create(visitor)
+        w.commit()
+
+    handlers.send_sms_visitor(commands.SendSms(visitor.uuid, "+320000000", "Sent"), w)
+    with w:
+        w.notify("+320000000", "Rolled back")
+
+    notification = FlakyNotifications(failures=0)
+    outbox.Dispatcher(w.outbox, notification).drain()
+
+    assert notification.sent == [("+320000000", "Sent")]
+    assert w.sms_limiter.remaining(visitor.uuid) == 49
@@ -0,0 +1,53 @@
+import datetime
+
+import commands
+import handlers
+import ratelimit
+import user
+import worker
+
+
+def test_daily_window():
+    limiter = ratelimit.MemoryRateLimiter(2)
+    day = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+
+    assert limiter.acquire("visitor", day) and limiter.acquire("visitor", day)
+    assert not limiter.acquire("visitor", day)
+    assert limiter.acquire("other", day)
+    assert limiter.remaining("visitor", day + datetime.timedelta(days=1)) == 2
+
+
+def test_sqlite_limiter_is_shared(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    first, second = worker.SqliteWorker(path), worker.SqliteWorker(path)
+    day = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    limiter = ratelimit.SqliteRateLimiter(first.connection, 3)
+    other_process = ratelimit.SqliteRateLimiter(second.connection, 3)
+
+    assert [limiter.acquire("visitor", day), other_process.acquire("visitor", day), limiter.acquire("visitor", day)] == [True] * 3
+    assert not other_process.acquire("visitor", day)
+    assert limiter.remaining("visitor", day) == 0
+    assert other_process.acquire("visitor", day + datetime.timedelta(days=1))
+    assert limiter.remaining("visitor", day + datetime.timedelta(days=1)) == 2
+
+
+def test_send_sms_uses_the_limiter(tmp_path):
+    w = worker.SqliteWorker(str(tmp_path / "db.sqlite3"))
+    w.sms_limiter = ratelimit.SqliteRateLimiter(w.connection, 2)
+    visitor = user.Visitor("testdude", "00000-0000-0000-00000000", "abcd1234", "test@test.com", "29-03-1998", "Rue des fleurs 27", bytes(), {}, True, [])
+    with w:
+        w.db.create(visitor)
+        w.commit()
+    command = commands.SendSms(visitor.uuid, "+320000000", "This is a test SMS")
+
+    handlers.send_sms_visitor(command, w)
+    handlers.send_sms_visitor(command, w)
+    try:
+        handlers.send_sms_visitor(command, w)
+        assert False
+    except user.SmsLimitWasReached:
+        pass
+
+    assert len(w.outbox.fetch(datetime.datetime.now(), 10)) == 2
+    assert w.db.read(visitor.uuid).sms_sent_today(w.sms_limiter) == 2
+    assert visitor.sms_sent_today() == visitor.sms_sent == 0  # Counted by the limiter, not by the visitor
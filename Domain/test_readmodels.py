@@ -0,0 +1,40 @@
+import commands
+import handlers
+import readmodels
+import user
+from test_helpers import make_worker, sqlite_worker
+
+
+LOCATION = user.Location("Rue Neuve", 1, "Bruxelles", 1000, "Brabant", "Belgium")
+
+
+def test_published_ads_follow_the_handlers(tmp_path):
+    w, provider = make_worker(sqlite_worker(tmp_path))
+    ads = [handlers.publish_advertisement(commands.PublishAdvertisement(f"Ad {i}", "Massage", LOCATION, {}, {"massage": 40 + i}, provider.uuid), w) for i in range(3)]
+    handlers.update_ad_prices(commands.UpdateAdvertisementPrices(provider.uuid, ads[0].uuid, {"massage": 25}), w)
+    handlers.promote_ad_to_premium(commands.PromoteAdvertisementToPremium(provider.uuid, ads[1].uuid), w)
+    handlers.un_publish_advertisement(commands.UnPublishAdvertisement(provider.uuid, ads[2].uuid), w)
+    models = w.db.db.read_models
+
+    assert [ad.title for ad in models.published_ads()] == ["Ad 1", "Ad 0"]
+    assert models.ad(ads[0].uuid).min_price == 25
+    assert models.ad(ads[0].uuid).city == "Bruxelles"
+    assert models.ad(ads[1].uuid).premium
+    assert models.ad(ads[2].uuid) is None
+    assert models.provider(provider.uuid) == readmodels.ProviderSummary(provider.uuid, "testdude", False, True, True, 2, 1)
+
+    handlers.delete_ad(commands.DeleteAdvertisement(provider.uuid, ads[1].uuid), w)
+
+    assert (models.provider(provider.uuid).published_ads, models.provider(provider.uuid).premium_ads) == (1, 0)
+    assert [ad.title for ad in models.published_ads(owner_uuid=provider.uuid)] == ["Ad 0"]
+
+
+def test_rollback_keeps_read_models(tmp_path):
+    w, provider = make_worker(sqlite_worker(tmp_path))
+
+    with w:
+        w.db.create(provider.publish_ad("Ad", "Massage", {}, None, {}, "00000-0000-0000-00000001"))
+        w.db.flush()
+
+    assert w.db.db.read_models.published_ads() == []
+    assert w.db.db.read_models.provider(provider.uuid).published_ads == 0
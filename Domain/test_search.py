@@ -0,0 +1,63 @@
+import commands
+import handlers
+import messagebus
+import search
+import user
+from test_helpers import make_worker
+
+
+def test_tokenize():
+    assert search.tokenize("Épilation, MASSAGE relaxant") == {"epilation", "massage", "relaxant"}
+    assert search.tokenize(None) == set()
+
+
+def test_search_follows_handlers():
+    w, provider = make_worker(search_index=search.AdSearchIndex())
+    brussels = user.Location("Rue Neuve", 1, "Bruxelles", 1000, "Brabant", "Belgium")
+    paris = user.Location("Rue de Rivoli", 2, "Paris", 75001, "Ile-de-France", "France")
+    massage = handlers.publish_advertisement(commands.PublishAdvertisement("Massage relaxant", "Une heure de détente", brussels, {"massage": "1h"}, {"massage": 60}, provider.uuid), w)
+    haircut = handlers.publish_advertisement(commands.PublishAdvertisement("Coiffure", "Coupe et brushing", paris, {"coiffure": "30min"}, {"coiffure": 25}, provider.uuid), w)
+
+    assert [ad.uuid for ad in w.search_index.search("detente").ads] == [massage.uuid]
+    assert [ad.uuid for ad in w.search_index.search(country="france").ads] == [haircut.uuid]
+    assert [ad.uuid for ad in w.search_index.search(max_price=30).ads] == [haircut.uuid]
+    assert w.search_index.search("massage", city="Paris").total == 0
+    assert w.search_index.search().total == 2
+
+    handlers.update_ad_prices(commands.UpdateAdvertisementPrices(provider.uuid, massage.uuid, {"massage": 20}), w)
+    assert w.search_index.search(max_price=30).total == 2
+
+    handlers.update_ad_location(commands.UpdateAdvertisementLocation(provider.uuid, massage.uuid, paris), w)
+    assert w.search_index.search(city="Paris").total == 2
+    assert w.search_index.search(city="Bruxelles").total == 0
+
+    handlers.un_publish_advertisement(commands.UnPublishAdvertisement(provider.uuid, massage.uuid), w)
+    assert w.search_index.search("massage").total == 0
+
+    handlers.delete_ad(commands.DeleteAdvertisement(provider.uuid, haircut.uuid), w)
+    assert len(w.search_index) == 0
+
+
+def test_pagination_newest_first():
+    w, provider = make_worker(search_index=search.AdSearchIndex())
+    bus = messagebus.MessageBus(w)
+    bus.handle_batch([commands.PublishAdvertisement(f"Ad {i}", "Massage", None, {}, {}, provider.uuid) for i in range(45)])
+
+    first = w.search_index.search("massage", per_page=20)
+    last = w.search_index.search("massage", page=3, per_page=20)
+
+    assert first.total == 45
+    assert len(first.ads) == 20
+    assert len(last.ads) == 5
+    assert first.ads[0].date_published >= first.ads[-1].date_published >= last.ads[0].date_published
+
+
+def test_failed_command_is_not_indexed():
+    w, provider = make_worker(search_index=search.AdSearchIndex())
+    provider.vip = False
+    ad = handlers.publish_advertisement(commands.PublishAdvertisement("Ad", "Massage", None, {}, {}, provider.uuid), w)
+
+    results = messagebus.MessageBus(w).handle_batch([commands.UpdateAdvertisementPublishedDate(provider.uuid, ad.uuid)])
+
+    assert not results[0].ok
+    assert w.search_index.search("massage").ads[0].date_published == ad.date_published
@@ -0,0 +1,140 @@
+import collections
+import sqlite3
+
+import pytest
+
+import commands
+import database
+import handlers
+import messagebus
+import sharding
+import user
+import worker
+
+
+SHARDS = 3
+
+
+def make_worker(tmp_path) -> worker.ShardedSqliteWorker:
+    return worker.ShardedSqliteWorker([str(tmp_path / f"shard{i}.sqlite3") for i in range(SHARDS)])
+
+
+def make_users(w, count: int = 6):
+    providers = [user.Provider(f"provider{i}", f"provider-{i}", None, None, [], False, True, None) for i in range(count)]
+    visitors = [user.Visitor(f"visitor{i}", f"visitor-{i}", None, None, None, None, None, {}, False, []) for i in range(count)]
+    with w:
+        for u in providers + visitors:
+            w.db.create(u)
+        w.commit()
+    return providers, visitors
+
+
+def _stored_on(w, uuid: str) -> list:
+    return [i for i, connection in enumerate(w.connections) if connection.execute("SELECT 1 FROM domain_object WHERE uuid = ?", (uuid,)).fetchone()]
+
+
+def test_shard_index_is_stable_and_spread():
+    assert sharding.shard_index("provider-1", 8) == sharding.shard_index("provider-1", 8)
+    counts = collections.Counter(sharding.shard_index(f"user-{i}", 4) for i in range(4000))
+    assert all(800 < count < 1200 for count in counts.values())
+
+
+def test_ads_live_with_their_provider(tmp_path):
+    w = make_worker(tmp_path)
+    providers, _ = make_users(w)
+    ads = [handlers.publish_advertisement(commands.PublishAdvertisement("Ad", "Description", None, None, {"hour": 100}, provider.uuid), w)
+           for provider in providers]
+
+    for provider, ad in zip(providers, ads):
+        assert _stored_on(w, ad.uuid) == _stored_on(w, provider.uuid) == [sharding.shard_index(provider.uuid, SHARDS)]
+
+    other = make_worker(tmp_path)  # Nothing located yet
+    handlers.update_ad_prices(commands.UpdateAdvertisementPrices(providers[1].uuid, ads[1].uuid, {"hour": 80}), other)
+    assert other.db.read(ads[1].uuid).prices == {"hour": 80}
+    assert [ad.uuid for ad in other.db.read(providers[1].uuid)._ads] == [ads[1].uuid]
+    handlers.delete_ad(commands.DeleteAdvertisement(providers[1].uuid, ads[1].uuid), other)
+    assert make_worker(tmp_path).db.read(ads[1].uuid) is None
+
+
+def test_scatter_gather_listings(tmp_path):
+    w = make_worker(tmp_path)
+    providers, visitors = make_users(w)
+    ads = [handlers.publish_advertisement(commands.PublishAdvertisement(f"Ad {i}", "Description", None, None, {}, provider.uuid), w)
+           for i, provider in enumerate(providers)]
+    comments = [handlers.add_comment(commands.AddComment("ad-x", visitor.uuid, "Comment"), w) for visitor in visitors]
+    assert len({shard for visitor in visitors for shard in _stored_on(w, visitor.uuid)}) > 1
+
+    models = w.db.db.read_models
+    assert [ad.uuid for ad in models.published_ads(1, 4) + models.published_ads(2, 4)] == [ad.uuid for ad in reversed(ads)]
+    assert models.provider(providers[0].uuid).published_ads == 1
+    assert models.ad(ads[2].uuid).title == "Ad 2"
+
+    first = w.db.db.target_comments_page("ad-x", limit=4)
+    second = w.db.db.target_comments_page("ad-x", before=first.cursor, limit=4)
+    assert [c.uuid for c in first.comments + second.comments] == [c.uuid for c in reversed(comments)]
+    assert second.cursor is None
+
+
+def test_claim_across_shards(tmp_path):
+    w = make_worker(tmp_path)
+    _, visitors = make_users(w)
+    moderator = user.Moderator("moddude", "moderator", None, None)
+    with w:
+        w.db.create(moderator)
+        w.commit()
+    reports = [handlers.report(commands.Report(visitor.uuid, "ad-x", "Spam"), w) for visitor in visitors]
+
+    claimed = [handlers.claim_report(commands.ClaimReport(moderator.uuid), w).uuid for _ in reports]
+
+    assert claimed == [report.uuid for report in reports]
+    assert w.report_queue.counts() == {"NEW": 0, "PENDING": len(reports), "CLOSED": 0}
+
+
+def test_rollback_every_shard(tmp_path):
+    w = make_worker(tmp_path)
+    providers, visitors = make_users(w)
+
+    with pytest.raises(RuntimeError):
+        with w:
+            w.db.update(user.Visitor("renamed", visitors[0].uuid, None, None, None, None, None, {}, False, []))
+            w.db.update(user.Provider("renamed", providers[1].uuid, None, None, [], False, True, None))
+            w.db.flush()
+            raise RuntimeError
+
+    other = make_worker(tmp_path)
+    assert other.db.read(visitors[0].uuid).username == "visitor0"
+    assert other.db.read(providers[1].uuid).username == "provider1"
+
+
+class FailingCommit:
+    """ A connection whose COMMIT fails, as if another process held the lock for too long. """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, *args):
+        if sql == "COMMIT":
+            raise sqlite3.OperationalError("database is locked")
+        return self.connection.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def test_partial_commit_is_not_retried(tmp_path):
+    w = make_worker(tmp_path)
+    providers, _ = make_users(w)
+    last = next(provider for provider in providers if sharding.shard_index(provider.uuid, SHARDS) == 0)  # Committed last
+    other = next(provider for provider in providers if sharding.shard_index(provider.uuid, SHARDS) != 0)
+    w.connections[0] = FailingCommit(w.connections[0])
+    batch = [commands.PublishAdvertisement("Ad", "Description", None, None, {}, provider.uuid) for provider in (other, last)]
+
+    with pytest.raises(database.PartialCommit):
+        messagebus.MessageBus(w, backoff=0).handle_batch(batch)
+
+    stored = make_worker(tmp_path)
+    assert len(stored.db.read(other.uuid)._ads) == 1  # Once, not once per attempt
+    assert len(stored.db.read(last.uuid)._ads) == 0
+
+    with pytest.raises(sqlite3.OperationalError):  # Nothing was committed: a conflict, retried then raised
+        messagebus.MessageBus(w, backoff=0).handle_batch(batch[1:])
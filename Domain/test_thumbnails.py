@@ -0,0 +1,38 @@
+import concurrent.futures
+import io
+
+import pytest
+
+import blobs
+import events
+import thumbnails
+
+
+def test_original_until_rendered(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, "Image", None)
+    store = blobs.BlobStore(str(tmp_path))
+    pipeline = thumbnails.ThumbnailPipeline(store)
+    ref = store.put(b"\x89PNG\r\n\x1a\n not really a picture")
+
+    pipeline.on_pictures_uploaded(events.PicturesUploaded("owner", (ref,)))
+
+    assert not pipeline.available
+    assert pipeline.variant(ref, "thumb") == ref.name
+    assert pipeline.variant(ref, "unknown") == ref.name
+
+
+def test_render_variants(tmp_path):
+    image = pytest.importorskip("PIL.Image")
+    picture = io.BytesIO()
+    image.new("RGB", (2000, 1000), "red").save(picture, "JPEG")
+    store = blobs.BlobStore(str(tmp_path))
+    ref = store.put(picture.getvalue())
+    pipeline = thumbnails.ThumbnailPipeline(store, executor=concurrent.futures.ProcessPoolExecutor(max_workers=1))
+
+    pipeline.generate([ref], timeout=60)
+
+    with image.open(pipeline.path(ref, "thumb")) as thumb:
+        assert thumb.size == (200, 100)
+    assert pipeline.variant(ref, "web") == pipeline.name(ref, "web")
+    assert pipeline.submit([ref]) == []  # Already rendered
+    pipeline.shutdown()
@@ -0,0 +1,125 @@
+"""
+    By Etienne Quenon
+"""
+
+import concurrent.futures
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional
+import blobs
+import events
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: without it the pictures are served as uploaded
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+SIZES = {"thumb": 200, "web": 1280}  # Type Dict[str, int], variant name -> longest side in pixels
+
+
+def _extension(ref: blobs.BlobRef) -> str:
+    # Pictures that may have transparency stay PNG, the others become JPEG.
+    return ".png" if ref.extension in (".png", ".gif") else ".jpg"
+
+
+def _render(source: str, target: str, longest_side: int):
+    """ Runs in a worker process of the pool, it must stay a module-level function. """
+    with Image.open(source) as image:
+        image.thumbnail((longest_side, longest_side))
+        if target.endswith(".jpg") and image.mode != "RGB":
+            image = image.convert("RGB")
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix=os.path.splitext(target)[1])
+        os.close(fd)
+        try:
+            image.save(temporary, quality=85, optimize=True)
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, target)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+class ThumbnailPipeline:
+    """
+        Resized variants of the stored pictures, rendered in a process pool and cached on disk next to the blobs.
+        A variant is named after the content hash of its picture, so it is rendered once whoever uploads the picture.
+    """
+
+    def __init__(self, store: blobs.BlobStore, sizes: Dict[str, int] = None, executor: concurrent.futures.Executor = None):
+        self.store = store
+        self.sizes = dict(sizes or SIZES)
+        self._executor = executor
+        self._pending = {}  # Type Dict[str, concurrent.futures.Future], variant name -> rendering
+        self._lock = threading.RLock()  # The done callbacks run in a thread of the executor, or right away when already done
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def name(self, ref: blobs.BlobRef, size: str) -> str:
+        return f"variants/{size}/{ref.digest[:2]}/{ref.digest[2:4]}/{ref.digest}{_extension(ref)}"
+
+    def path(self, ref: blobs.BlobRef, size: str) -> str:
+        return os.path.join(self.store.root, *self.name(ref, size).split("/"))
+
+    def variant(self, ref: blobs.BlobRef, size: str) -> str:
+        """ Name (relative to the store root) of the variant to serve, the original picture while it isn't rendered. """
+        if size in self.sizes and os.path.exists(self.path(ref, size)):
+            return self.name(ref, size)
+        return ref.name
+
+    def submit(self, refs: Iterable[blobs.BlobRef]) -> List[concurrent.futures.Future]:
+        """ Renders the missing variants of refs in the background. """
+        if not self.available:
+            return []
+        futures = []
+        with self._lock:
+            for ref in refs:
+                self._submit(ref, futures)
+        return futures
+
+    def _submit(self, ref: blobs.BlobRef, futures: list):
+        for size, longest_side in self.sizes.items():
+            name = self.name(ref, size)
+            pending = self._pending.get(name)
+            if pending is not None:
+                futures.append(pending)
+                continue
+            target = self.path(ref, size)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            future = self._get_executor().submit(_render, self.store.path(ref), target, longest_side)
+            self._pending[name] = future
+            futures.append(future)
+            future.add_done_callback(lambda done, name=name: self._done(name, done))
+
+    def generate(self, refs: Iterable[blobs.BlobRef], timeout: Optional[float] = None):
+        """ Like submit, but waits for the variants. """
+        for future in concurrent.futures.as_completed(self.submit(refs), timeout=timeout):
+            future.result()
+
+    def on_pictures_uploaded(self, event: events.PicturesUploaded):
+        """ events.EventBus subscriber. """
+        self.submit(event.pictures)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor()
+        return self._executor
+
+    def _done(self, name: str, future: concurrent.futures.Future):
+        with self._lock:
+            if self._pending.get(name) is future:
+                del self._pending[name]
+        if future.exception() is not None:
+            logger.error("Rendering %s failed", name, exc_info=future.exception())
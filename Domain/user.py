@@ -3,11 +3,71 @@
 """
 
 import datetime
+import itertools
 from dataclasses import dataclass, field
-from typing import Set, List
+from typing import Set, List, Iterable, Optional
 
 
-@dataclass(frozen=False)
+SMS_PER_DAY = 50
+
+
+class UuidIndex:
+    """ Insertion-ordered list of domain objects, indexed by their uuid (or any other key attribute). """
+    __slots__ = ("_key", "_items")
+
+    def __init__(self, items: Iterable = (), key: str = "uuid"):
+        self._key = key
+        self._items = {getattr(item, key): item for item in items}  # Type Dict[str, object]
+
+    def get(self, uuid: str, default=None):
+        return self._items.get(uuid, default)
+
+    def append(self, item):
+        self._items[getattr(item, self._key)] = item
+
+    def remove(self, item):
+        del self._items[getattr(item, self._key)]
+
+    def pop(self, uuid: str, *default):
+        return self._items.pop(uuid, *default)
+
+    def __contains__(self, item) -> bool:
+        """ Accepts a key as well as an item. """
+        return getattr(item, self._key, item) in self._items
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __reversed__(self):
+        return reversed(self._items.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, position: int):
+        size = len(self._items)
+        if position < 0:
+            position += size
+        if not 0 <= position < size:
+            raise IndexError(position)
+        if position < size // 2:
+            return next(itertools.islice(iter(self._items.values()), position, None))
+        return next(itertools.islice(reversed(self._items.values()), size - 1 - position, None))
+
+    def __eq__(self, other):
+        if isinstance(other, UuidIndex):
+            return list(self) == list(other)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<UuidIndex {list(self._items.values())!r}>"
+
+
+@dataclass(frozen=False, slots=True)
 class Report:
     target_uuid: str
     owner_uuid: str
@@ -15,7 +75,11 @@ class Report:
     content: str
     status: str
     uuid: str
-    comment: list = field(default_factory=list)  # List[Comment]
+    comment: UuidIndex = field(default_factory=UuidIndex)  # UuidIndex[Comment]
+
+    def __post_init__(self):
+        if not isinstance(self.comment, UuidIndex):
+            self.comment = UuidIndex(self.comment)
 
 
 def user_active(func):
@@ -28,6 +92,8 @@ def user_active(func):
 
 
 class User:
+    __slots__ = ("username", "uuid", "password", "e_mail", "_active")
+
     def __init__(self, username: str, uuid: str, password: str, e_mail: str):
         self.username = username
         self.uuid = uuid
@@ -65,7 +131,7 @@ class User:
         self._active = True
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Location:
     street: str
     number: int
@@ -73,9 +139,11 @@ class Location:
     zip_code: int
     state: str
     country: str
+    latitude: float = None
+    longitude: float = None
 
 
-@dataclass(unsafe_hash=True)
+@dataclass(frozen=True, slots=True)
 class Billing:
     card_number: str
     expiry_date: datetime.date
@@ -83,13 +151,22 @@ class Billing:
     fullname: str
 
 
-@dataclass(unsafe_hash=True)
+@dataclass(frozen=True, slots=True)
 class PremiumAdvertisement:
     provider_uuid: str
     ad_uuid: str
     date_published: datetime.datetime
     expiry_date: datetime.datetime
 
+    @property
+    def uuid(self) -> str:
+        return self.uuid_of(self.ad_uuid)
+
+    @staticmethod
+    def uuid_of(ad_uuid: str) -> str:
+        """ A promotion is stored under its own uuid, derived from the uuid of the Ad. """
+        return f"premium:{ad_uuid}"
+
 
 class NotVip(Exception):
     """ Only a VIP Provider can do this ! """
@@ -103,6 +180,14 @@ class AlreadyPublished(Exception):
     """ This Ad is already published ! """
 
 
+class AdNotFound(Exception):
+    """ Couldn't find this Ad ! """
+
+
+class AdNotExpired(Exception):
+    """ This Ad didn't expire yet ! """
+
+
 class AdvertisementAlreadyPromoted(Exception):
     """ This Ad is already promoted ! """
 
@@ -123,7 +208,7 @@ class UserNotActive(Exception):
     """ This User is not active ! """
 
 
-@dataclass(unsafe_hash=True)
+@dataclass(unsafe_hash=True, slots=True)
 class Advertisement:
     title: str
     description: str
@@ -137,37 +222,44 @@ class Advertisement:
     uuid: str
 
 
-@dataclass(unsafe_hash=True)
+@dataclass(frozen=True, slots=True)
 class PrivatePicture:
-    picture: bytes
+    picture: object  # blobs.BlobRef once stored, bytes before
     date_published: datetime.datetime
 
 
 class Provider(User):
+    __slots__ = ("birthday", "address", "profile_pic", "verified", "vip", "_ads", "_billing", "_premium_ads", "_private_pics")
+
     def __init__(self, username: str, uuid: str, password: str, e_mail: str, ads: List[Advertisement], verified: bool, vip: bool, billing: Billing):
         self.birthday: datetime.date
         self.address: str
         self.profile_pic: bytes
         self.verified = verified
         self.vip = vip
-        self._ads = ads
+        self._ads = UuidIndex(ads)  # Type UuidIndex[Advertisement]
         self._billing = billing
-        self._premium_ads = []  # Type List[PremiumAdvertisement]
+        self._premium_ads = UuidIndex(key="ad_uuid")  # Type UuidIndex[PremiumAdvertisement]
         self._private_pics = []  # Type List[PrivatePicture]
         super().__init__(username, uuid, password, e_mail)
 
+    def _find_ad(self, ad_uuid: str) -> Advertisement:
+        ad = self._ads.get(ad_uuid)
+        if ad is None:
+            raise AdNotFound
+        return ad
+
     @user_active
     def publish_ad(self, title: str, description: str, prices: dict, location: Location, services: dict, ad_uuid):
-        ad = [ad for ad in self._ads if ad.uuid == ad_uuid]
-        if not ad:
-            self._ads.append(Advertisement(title, description, datetime.datetime.now(), datetime.datetime.now() + datetime.timedelta(days=7), location, services, prices, self.uuid, True, ad_uuid))
-            return self._ads[-1]
-        else:
+        if ad_uuid in self._ads:
             raise AdAlreadyExist
+        ad = Advertisement(title, description, datetime.datetime.now(), datetime.datetime.now() + datetime.timedelta(days=7), location, services, prices, self.uuid, True, ad_uuid)
+        self._ads.append(ad)
+        return ad
 
     @user_active
     def un_publish_ad(self, ad_uuid: str):
-        ad = next(a for a in self._ads if a.uuid == ad_uuid)
+        ad = self._find_ad(ad_uuid)
         ad.published = False
         ad.date_published = None
         ad.expiry_date = None
@@ -176,7 +268,7 @@ class Provider(User):
     @user_active
     def update_ad_published_date(self, ad_uuid: str):
         if self.vip:
-            ad = next(a for a in self._ads if a.uuid == ad_uuid)
+            ad = self._find_ad(ad_uuid)
             ad.date_published = datetime.datetime.now()
             ad.expiry_date = ad.date_published + datetime.timedelta(days=7)
             return ad
@@ -191,37 +283,54 @@ class Provider(User):
         self._billing = Billing(card_number, expiry_date, secret_code, fullname)
         return self._billing
 
-    def get_ad(self, ad_uuid):
-        return next((a for a in self._ads if a.uuid == ad_uuid), None)
+    def get_ad(self, ad_uuid) -> Optional[Advertisement]:
+        return self._ads.get(ad_uuid)
 
     @user_active
-    def update_ad_location(self, ad_uuid: str, street: str, number: int, city: str, zip_code: int, state: str, country: str):
-        ad = next(a for a in self._ads if a.uuid == ad_uuid)
-        ad.localisation = Location(street, number, city, zip_code, state, country)
+    def update_ad_location(self, ad_uuid: str, street: str, number: int, city: str, zip_code: int, state: str, country: str, latitude: float = None, longitude: float = None):
+        ad = self._find_ad(ad_uuid)
+        ad.localisation = Location(street, number, city, zip_code, state, country, latitude, longitude)
         return ad
 
     @user_active
     def update_ad_services(self, ad_uuid: str, offers: dict):
-        ad = next(a for a in self._ads if a.uuid == ad_uuid)
+        ad = self._find_ad(ad_uuid)
         ad.service = offers
         return ad
 
     @user_active
     def update_ad_prices(self, ad_uuid: str, prices: dict):
-        ad = next(a for a in self._ads if a.uuid == ad_uuid)
+        ad = self._find_ad(ad_uuid)
         ad.prices = prices
         return ad
 
     @user_active
     def delete_ad(self, ad_uuid):
-        ad = next(a for a in self._ads if a.uuid == ad_uuid)
-        self._ads.remove(ad)
+        if self._ads.pop(ad_uuid, None) is None:
+            raise AdNotFound
+
+    def expire_ad(self, ad_uuid: str, now: datetime.datetime) -> Advertisement:
+        # Not restricted to active users, the ads of a disabled Provider expire as well.
+        ad = self._find_ad(ad_uuid)
+        if not ad.published or ad.expiry_date is None or ad.expiry_date > now:
+            raise AdNotExpired
+        ad.published = False
+        ad.date_published = None
+        ad.expiry_date = None
+        return ad
+
+    def expire_premium_ad(self, ad_uuid: str, now: datetime.datetime) -> PremiumAdvertisement:
+        premium_ad = self._premium_ads.get(ad_uuid)
+        if premium_ad is None:
+            raise AdNotFound
+        if premium_ad.expiry_date is not None and premium_ad.expiry_date > now:
+            raise AdNotExpired
+        return self._premium_ads.pop(ad_uuid)
 
     def promote_ad_to_premium(self, ad_uuid):
         if self.vip:
-            ad_premium = [ad for ad in self._premium_ads if ad.ad_uuid == ad_uuid]
-            if not ad_premium:
-                ad = next(a for a in self._ads if a.uuid == ad_uuid)
+            if ad_uuid not in self._premium_ads:
+                ad = self._find_ad(ad_uuid)
                 ad_premium_promoted = PremiumAdvertisement(self.uuid, ad.uuid, datetime.datetime.now(), ad.expiry_date)
                 self._premium_ads.append(ad_premium_promoted)
                 return ad_premium_promoted
@@ -239,7 +348,7 @@ class Provider(User):
         self._private_pics = pictures
 
 
-@dataclass(unsafe_hash=True)
+@dataclass(unsafe_hash=True, slots=True)
 class Comment:
     target_uuid: str
     owner_uuid: str
@@ -250,27 +359,38 @@ class Comment:
 
 
 class Visitor(User):
+    __slots__ = ("birthday", "address", "profile_pic", "preferences", "is_premium", "_sms_sent", "comments")
+
     def __init__(self, username: str, uuid: str, password: str, e_mail: str, birthday: datetime.date, address: str, profile_pic: bytes, preferences: dict, is_premium: bool, comments):
         self.birthday = birthday
         self.address = address
-        self.profile_pic = profile_pic
+        self.profile_pic = profile_pic  # Type blobs.BlobRef once stored, bytes before
         self.preferences = preferences
         self.is_premium = is_premium
         self._sms_sent = 0
-        self.comments = comments  # Type List[Comment]
+        self.comments = comments if isinstance(comments, UuidIndex) else UuidIndex(comments)  # Type UuidIndex[Comment]
         super().__init__(username, uuid, password, e_mail)
 
     @user_active
-    def send_sms(self):
-        if self._sms_sent < 50:
+    def send_sms(self, limiter=None):
+        """ With a limiter (see ratelimit), the daily limit is counted there instead of in this object. """
+        if limiter is not None:
+            if not limiter.acquire(self.uuid):
+                raise SmsLimitWasReached
+        elif self._sms_sent < SMS_PER_DAY:
             self._sms_sent += 1
         else:
             raise SmsLimitWasReached
 
     @property
     def sms_sent(self) -> int:
+        """ Only counted when send_sms isn't given a limiter, see sms_sent_today. """
         return self._sms_sent
 
+    def sms_sent_today(self, limiter=None) -> int:
+        """ Read from the limiter that send_sms was given, if any. """
+        return limiter.count(self.uuid) if limiter is not None else self._sms_sent
+
     @user_active
     def add_comment(self, target_uuid: str, content: str, uuid: str) -> Comment:
         comment = Comment(target_uuid, self.uuid, datetime.datetime.now(), None, content, uuid)
@@ -279,7 +399,7 @@ class Visitor(User):
 
     @user_active
     def modify_comment(self, uuid: str, content: str) -> Comment:
-        comment = next((c for c in self.comments if uuid == c.uuid), None)
+        comment = self.comments.get(uuid)
         if not comment:
             raise CommentNotFound
         comment.content = content
@@ -287,14 +407,16 @@ class Visitor(User):
         return comment
 
     @user_active
-    def delete_comment(self, uuid: str):
-        comment = next((c for c in self.comments if uuid == c.uuid), None)
-        if not comment:
+    def delete_comment(self, uuid: str) -> Comment:
+        comment = self.comments.pop(uuid, None)
+        if comment is None:
             raise CommentNotFound
-        self.comments.remove(comment)
+        return comment
 
 
 class Admin(User):
+    __slots__ = ()
+
     def __init__(self, username: str, uuid: str, password: str, e_mail: str):
         super().__init__(username, uuid, password, e_mail)
 
@@ -308,6 +430,8 @@ class Admin(User):
 
 
 class Moderator(User):
+    __slots__ = ()
+
     def __init__(self, username: str, uuid: str, password: str, e_mail: str):
         super().__init__(username, uuid, password, e_mail)
 
@@ -3,20 +3,121 @@
 """
 from __future__ import annotations
 import abc
+import asyncio
+import os
+import uuid
+from typing import Callable, List
 import database
+import events
+import instrumentation
+import moderation
+import outbox
+import projections
+import ratelimit
+import sharding
+import user
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db.sqlite3")
+
+
+def _publish(w, committed_events):
+    if committed_events:
+        projections.update(w, committed_events)
+        if w.event_bus is not None:
+            w.event_bus.publish(committed_events)
 
 
 class AbstractWorker(abc.ABC):
-    db: database.AbstractDatabase
+    outbox: outbox.AbstractOutbox
+    search_index = None  # Type Optional[search.AdSearchIndex], kept up to date by the ad handlers when set
+    expiry = None  # Type Optional[expiry.ExpiryScheduler], idem
+    premium_feed = None  # Type Optional[feed.PremiumFeed], idem
+    comment_index = None  # Type Optional[comments.CommentIndex], kept up to date by the comment handlers when set
+    sms_limiter = None  # Type Optional[ratelimit.AbstractRateLimiter], without it the visitors count their own SMS
+    report_queue = None  # Type Optional[moderation.ReportQueue], required by the claim_report handler
+    page_versions = None  # Type Optional[invalidation.AbstractPageVersions], bumped by the ad and comment handlers when set
+    blob_store = None  # Type Optional[blobs.BlobStore], where the picture handlers store the pictures when set
+    event_bus = None  # Type Optional[events.EventBus], receives the events of every committed unit of work
+    metrics = None  # Type Optional[instrumentation.Metrics], times the commits (and the handlers run by a messagebus.MessageBus) when set
+    _units = ()  # Type Tuple[Tuple[bool, int, int]], ("committed" flag, notifications and events counts) per nested unit of work
+    _notifications = ()  # Type List[outbox.OutboxMessage], recorded by the current unit of work, a new list for each outermost unit
+    _events = ()  # Type List[events.Event], emitted by the current unit of work, idem
+
+    @property
+    def db(self) -> database.IdentityMap:
+        return self._db
+
+    @property
+    def in_unit_of_work(self) -> bool:
+        return bool(self._units)
+
+    @db.setter
+    def db(self, db: database.AbstractDatabase):
+        self._db = db if isinstance(db, database.IdentityMap) else database.IdentityMap(db)
 
     def __enter__(self) -> AbstractWorker:
+        # A nested "with w:" (e.g. a handler run by messagebus.handle_batch) joins the outer transaction as a savepoint.
+        # Pending writes are flushed first, so that rolling back to the savepoint only undoes the nested unit.
+        if self._units:
+            self.db.flush()
+            self.db.savepoint()
+            self._savepoint(f"unit_{len(self._units)}")
+        else:
+            self._notifications, self._events = [], []
+        self._units = self._units + ((False, len(self._notifications), len(self._events)),)
         return self
 
     def __exit__(self, *args):
-        self.rollback()
+        committed, notifications_count, events_count = self._units[-1]
+        self._units = self._units[:-1]
+        if not self._units:
+            self.db.discard()
+            self._notifications = ()
+            self._events = ()
+            self.rollback()
+        elif not committed:
+            self.db.rollback_to_savepoint()
+            del self._notifications[notifications_count:]
+            del self._events[events_count:]
+            self._rollback_to_savepoint(f"unit_{len(self._units)}")
+
+    def notify(self, to: str, message: str):
+        """ Queues a notification, it is written to the outbox on commit and sent later by an outbox.Dispatcher. """
+        self._notifications.append(outbox.OutboxMessage(to, message, str(uuid.uuid4())))
+
+    def emit(self, event: events.Event):
+        """ Records event, the projections of the worker and the event_bus subscribers get it once the outermost unit of work is committed. """
+        self._events.append(event)
+
+    def call(self, function: Callable, *args):
+        """ A blocking call of a handler (the blob store, the SMS limiter, ...), run in a thread by AbstractAsyncWorker. """
+        return function(*args)
 
     def commit(self):
-        self._commit()
+        if len(self._units) > 1:
+            self._release_savepoint(f"unit_{len(self._units) - 1}")
+            self.db.release_savepoint()
+            self._units = self._units[:-1] + ((True,) + self._units[-1][1:],)
+        else:
+            with instrumentation.timer(self.metrics, "worker.commit"):
+                self.db.flush()
+                if self._notifications:
+                    self.outbox.add(self._notifications)
+                    self._notifications = []
+                self._commit()
+            self.db.discard()
+            committed_events, self._events = self._events, []
+            _publish(self, committed_events)
+
+    def _savepoint(self, name: str):
+        pass
+
+    def _release_savepoint(self, name: str):
+        pass
+
+    def _rollback_to_savepoint(self, name: str):
+        pass
 
     @abc.abstractmethod
     def _commit(self):
@@ -25,3 +126,236 @@ class AbstractWorker(abc.ABC):
     @abc.abstractmethod
     def rollback(self):
         raise NotImplementedError
+
+
+class SqliteWorker(AbstractWorker):
+    def __init__(self, path: str = DEFAULT_PATH, metrics: instrumentation.Metrics = None):
+        self.connection = database.connect(path)
+        db = database.SqliteDatabase(self.connection)
+        if metrics is not None:
+            self.metrics = metrics
+            db = instrumentation.TimedDatabase(db, metrics)
+        self.db = db
+        self.report_queue = moderation.ReportQueue(self.connection)
+        self.outbox = outbox.SqliteOutbox(self.connection)
+        self.sms_limiter = ratelimit.SqliteRateLimiter(self.connection, user.SMS_PER_DAY)
+
+    def __enter__(self) -> AbstractWorker:
+        if not self._units:
+            self.connection.execute("BEGIN")
+        return super().__enter__()
+
+    def _commit(self):
+        self.connection.execute("COMMIT")
+
+    def rollback(self):
+        if self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+
+    def _savepoint(self, name: str):
+        self.connection.execute(f"SAVEPOINT {name}")
+
+    def _release_savepoint(self, name: str):
+        self.connection.execute(f"RELEASE SAVEPOINT {name}")
+
+    def _rollback_to_savepoint(self, name: str):
+        self.connection.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        self.connection.execute(f"RELEASE SAVEPOINT {name}")
+
+
+class ShardedSqliteWorker(AbstractWorker):
+    """
+        Unit of work over one SQLite file per shard, see sharding.ShardedDatabase.
+        A handler touching one provider (or one visitor) only writes on its shard; the rare unit writing on several shards
+        commits them one after the other, the first shard (holding the outbox and the rate limits) last.
+        Such a unit (e.g. a batch of messagebus.MessageBus) isn't atomic: when a COMMIT fails after a shard was written and committed,
+        database.PartialCommit is raised, which is not a conflict, so the unit isn't run again.
+    """
+
+    def __init__(self, paths: List[str], metrics: instrumentation.Metrics = None):
+        self.connections = [database.connect(path) for path in paths]
+        self._changes = []  # Type List[int], total_changes of every connection when the outermost unit of work began
+        db = sharding.ShardedDatabase([database.SqliteDatabase(connection) for connection in self.connections])
+        if metrics is not None:
+            self.metrics = metrics
+            db = instrumentation.TimedDatabase(db, metrics)
+        self.db = db
+        self.report_queue = sharding.ShardedReportQueue([moderation.ReportQueue(connection) for connection in self.connections])
+        self.outbox = outbox.SqliteOutbox(self.connections[0])
+        self.sms_limiter = ratelimit.SqliteRateLimiter(self.connections[0], user.SMS_PER_DAY)
+
+    def __enter__(self) -> AbstractWorker:
+        if not self._units:
+            # Deferred transactions: a shard is only locked once it is written.
+            for connection in self.connections:
+                connection.execute("BEGIN")
+            self._changes = [connection.total_changes for connection in self.connections]
+        return super().__enter__()
+
+    def _commit(self):
+        committed = 0  # Shards written and committed
+        for index in reversed(range(len(self.connections))):
+            connection = self.connections[index]
+            try:
+                connection.execute("COMMIT")
+            except Exception as e:
+                if committed:
+                    raise database.PartialCommit(f"Committed on {committed} shards, shard {index} failed: {e}") from e
+                raise
+            committed += connection.total_changes != self._changes[index]
+
+    def rollback(self):
+        for connection in self.connections:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+
+    def _savepoint(self, name: str):
+        for connection in self.connections:
+            connection.execute(f"SAVEPOINT {name}")
+
+    def _release_savepoint(self, name: str):
+        for connection in self.connections:
+            connection.execute(f"RELEASE SAVEPOINT {name}")
+
+    def _rollback_to_savepoint(self, name: str):
+        for connection in self.connections:
+            connection.execute(f"ROLLBACK TO SAVEPOINT {name}")
+            connection.execute(f"RELEASE SAVEPOINT {name}")
+
+
+class AbstractAsyncWorker(abc.ABC):
+    """ Unit of work for the async handlers, one instance per concurrent request. """
+    outbox: outbox.AbstractOutbox
+    search_index = None  # Type Optional[search.AdSearchIndex], kept up to date by the ad handlers when set
+    expiry = None  # Type Optional[expiry.ExpiryScheduler], idem
+    premium_feed = None  # Type Optional[feed.PremiumFeed], idem
+    comment_index = None  # Type Optional[comments.CommentIndex], kept up to date by the comment handlers when set
+    sms_limiter = None  # Type Optional[ratelimit.AbstractRateLimiter], without it the visitors count their own SMS
+    report_queue = None  # Type Optional[moderation.ReportQueue], required by the claim_report handler
+    page_versions = None  # Type Optional[invalidation.AbstractPageVersions], bumped by the ad and comment handlers when set
+    blob_store = None  # Type Optional[blobs.BlobStore], where the picture handlers store the pictures when set
+    event_bus = None  # Type Optional[events.EventBus], receives the events of every committed unit of work
+    metrics = None  # Type Optional[instrumentation.Metrics], times the commits when set
+    _units = ()  # Type Tuple[Tuple[bool, int, int]], as in AbstractWorker
+    _notifications = ()  # Type List[outbox.OutboxMessage], recorded by the current unit of work, a new list for each outermost unit
+    _events = ()  # Type List[events.Event], emitted by the current unit of work, idem
+
+    @property
+    def db(self) -> database.AsyncIdentityMap:
+        return self._db
+
+    @property
+    def in_unit_of_work(self) -> bool:
+        return bool(self._units)
+
+    @db.setter
+    def db(self, db: database.AbstractAsyncDatabase):
+        self._db = db if isinstance(db, database.AsyncIdentityMap) else database.AsyncIdentityMap(db)
+
+    async def __aenter__(self) -> AbstractAsyncWorker:
+        # Nested units of work join the outer transaction as savepoints, like in AbstractWorker.
+        if self._units:
+            await self.db.flush()
+            self.db.savepoint()
+            await self._savepoint(f"unit_{len(self._units)}")
+        else:
+            self._notifications, self._events = [], []
+        self._units = self._units + ((False, len(self._notifications), len(self._events)),)
+        return self
+
+    async def __aexit__(self, *args):
+        committed, notifications_count, events_count = self._units[-1]
+        self._units = self._units[:-1]
+        if not self._units:
+            self.db.discard()
+            self._notifications = ()
+            self._events = ()
+            await self.rollback()
+        elif not committed:
+            self.db.rollback_to_savepoint()
+            del self._notifications[notifications_count:]
+            del self._events[events_count:]
+            await self._rollback_to_savepoint(f"unit_{len(self._units)}")
+
+    def notify(self, to: str, message: str):
+        """ Queues a notification, it is written to the outbox on commit and sent later by an outbox.Dispatcher. """
+        self._notifications.append(outbox.OutboxMessage(to, message, str(uuid.uuid4())))
+
+    def emit(self, event: events.Event):
+        self._events.append(event)
+
+    def call(self, function: Callable, *args):
+        """ Awaitable running function(*args) in a thread, see AbstractWorker.call. """
+        return asyncio.to_thread(function, *args)
+
+    async def commit(self):
+        if len(self._units) > 1:
+            await self._release_savepoint(f"unit_{len(self._units) - 1}")
+            self.db.release_savepoint()
+            self._units = self._units[:-1] + ((True,) + self._units[-1][1:],)
+            return
+        with instrumentation.timer(self.metrics, "worker.commit"):
+            await self.db.flush()
+            if self._notifications:
+                await asyncio.to_thread(self.outbox.add, self._notifications)
+                self._notifications = []
+            await self._commit()
+        self.db.discard()
+        committed_events, self._events = self._events, []
+        _publish(self, committed_events)
+
+    async def _savepoint(self, name: str):
+        pass
+
+    async def _release_savepoint(self, name: str):
+        pass
+
+    async def _rollback_to_savepoint(self, name: str):
+        pass
+
+    @abc.abstractmethod
+    async def _commit(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def rollback(self):
+        raise NotImplementedError
+
+
+class AsyncSqliteWorker(AbstractAsyncWorker):
+    def __init__(self, path: str = DEFAULT_PATH, metrics: instrumentation.Metrics = None):
+        # Every call runs in a thread of the default executor, one at a time per worker.
+        self.connection = database.connect(path, check_same_thread=False)
+        db = database.SqliteDatabase(self.connection)
+        if metrics is not None:
+            self.metrics = metrics
+            db = instrumentation.TimedDatabase(db, metrics)
+        self.db = database.AsyncDatabase(db)
+        self.report_queue = moderation.ReportQueue(self.connection)
+        self.outbox = outbox.SqliteOutbox(self.connection)
+        self.sms_limiter = ratelimit.SqliteRateLimiter(self.connection, user.SMS_PER_DAY)
+
+    async def __aenter__(self) -> AbstractAsyncWorker:
+        if not self._units:
+            await asyncio.to_thread(self.connection.execute, "BEGIN")
+        return await super().__aenter__()
+
+    async def _commit(self):
+        await asyncio.to_thread(self.connection.execute, "COMMIT")
+
+    async def rollback(self):
+        if self.connection.in_transaction:
+            await asyncio.to_thread(self.connection.execute, "ROLLBACK")
+
+    async def _savepoint(self, name: str):
+        await asyncio.to_thread(self.connection.execute, f"SAVEPOINT {name}")
+
+    async def _release_savepoint(self, name: str):
+        await asyncio.to_thread(self.connection.execute, f"RELEASE SAVEPOINT {name}")
+
+    async def _rollback_to_savepoint(self, name: str):
+        await asyncio.to_thread(self._rollback_to, name)
+
+    def _rollback_to(self, name: str):
+        self.connection.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        self.connection.execute(f"RELEASE SAVEPOINT {name}")
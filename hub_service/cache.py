@@ -0,0 +1,43 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from hub_service import domain
+
+
+def _request_scopes(scopes, request):
+    for scope in scopes:
+        if callable(scope):
+            yield from scope(request)
+        else:
+            yield scope
+
+
+def cached_page(*scopes):
+    """
+        Caches the page of anonymous GET requests under the versions of scopes (see Domain/invalidation.py),
+        the Domain handlers invalidate them when the ads they show change.
+        A scope can also be a function of the request returning scopes, for the pages of a given ad or provider.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            versions = '.'.join(str(version) for version in domain.page_versions().versions(list(_request_scopes(scopes, request))))
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = f'page:{view.__name__}:{path}:{versions}'
+            cache = caches[settings.PAGE_CACHE]
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    # Rendered now, a TemplateResponse would otherwise be pickled before its content exists.
+                    if hasattr(response, 'render'):
+                        response.render()
+                    cache.set(key, response)
+            return response
+        return wrapper
+    return decorator
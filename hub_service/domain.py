@@ -0,0 +1,128 @@
+import sys
+import threading
+import time
+import types
+
+from django.conf import settings
+
+if str(settings.DOMAIN_DIR) not in sys.path:
+    sys.path.append(str(settings.DOMAIN_DIR))
+
+import blobs  # noqa: E402  (Domain modules, importable once DOMAIN_DIR is on the path)
+import database  # noqa: E402
+import events  # noqa: E402
+import feed  # noqa: E402
+import instrumentation  # noqa: E402
+import invalidation  # noqa: E402
+import projections  # noqa: E402
+import readmodels  # noqa: E402
+import search  # noqa: E402
+import sharding  # noqa: E402
+import thumbnails  # noqa: E402
+import worker  # noqa: E402
+
+
+# Projections shared by every request of this process, built from the database by load(). The handlers of this process keep
+# them up to date; the writes of other processes (site workers, manage.py bulk_ads, ...) show up once they are rebuilt.
+# The expiries aren't scheduled here (manage.py expire_ads reads them from the database), nor the comments indexed: no page shows them.
+search_index = search.AdSearchIndex()
+premium_feed = feed.PremiumFeed()
+blob_store = blobs.BlobStore(settings.MEDIA_ROOT / 'blobs')
+metrics = instrumentation.Metrics()  # Latency of the views, handlers, database calls and commits of this process
+event_bus = events.EventBus()  # Subscribe here to react to the committed domain events
+thumbnails_pipeline = thumbnails.ThumbnailPipeline(blob_store)  # Its process pool is only started by the first upload
+event_bus.subscribe(events.PicturesUploaded, thumbnails_pipeline.on_pictures_uploaded)
+
+_built_at = None  # time.monotonic() of the last build of the projections
+_load_lock = threading.Lock()
+_local = threading.local()  # sqlite3 connections can't be shared between the request threads
+
+
+def _path() -> str:
+    return str(settings.DATABASES['default']['NAME'])
+
+
+def _database() -> database.AbstractDatabase:
+    if settings.DOMAIN_SHARDS:
+        return sharding.ShardedDatabase([database.SqliteDatabase(database.connect(str(path))) for path in settings.DOMAIN_SHARDS])
+    return database.SqliteDatabase(database.connect(_path()))
+
+
+def get_worker() -> worker.AbstractWorker:
+    load()
+    if settings.DOMAIN_SHARDS:
+        w = worker.ShardedSqliteWorker([str(path) for path in settings.DOMAIN_SHARDS], metrics)
+    else:
+        w = worker.SqliteWorker(_path(), metrics)
+    w.search_index = search_index
+    w.premium_feed = premium_feed
+    w.page_versions = page_versions()
+    w.event_bus = event_bus
+    w.blob_store = blob_store
+    return w
+
+
+def page_versions() -> invalidation.SqlitePageVersions:
+    """ Versions of the cached pages, kept in the default database (even with shards) so that every process shares them. """
+    if not hasattr(_local, 'page_versions'):
+        _local.page_versions = invalidation.SqlitePageVersions(database.connect(_path()))
+    return _local.page_versions
+
+
+def read_models() -> readmodels.SqliteReadModels:
+    """ Flat ads and provider tables, for the views that only display them. """
+    if not hasattr(_local, 'read_models'):
+        _local.read_models = _database().read_models
+    return _local.read_models
+
+
+def _build():
+    """
+        Builds new projections from the database and swaps them in. The events committed by this process meanwhile were
+        applied to the old projections: they are recorded and applied to the new ones as well.
+    """
+    global search_index, premium_feed, _built_at
+    started = time.monotonic()
+    committed = []  # Type List[events.Event]
+    event_bus.subscribe(events.Event, committed.append)
+    try:
+        new = types.SimpleNamespace(search_index=search.AdSearchIndex(), premium_feed=feed.PremiumFeed(),
+                                    expiry=None, comment_index=None, page_versions=None)  # Only the projections, the pages were invalidated already
+        db = _database()
+        premium_ads = {premium_ad.ad_uuid: premium_ad for premium_ad in db.scan("premium")}
+        for ad in db.scan("advertisement"):
+            if ad.published:
+                new.search_index.add(ad)
+                if ad.uuid in premium_ads:
+                    new.premium_feed.add(premium_ads[ad.uuid], ad)
+        search_index, premium_feed = new.search_index, new.premium_feed
+    finally:
+        event_bus.unsubscribe(events.Event, committed.append)
+    projections.update(new, committed)
+    _built_at = started
+
+
+def _rebuild():
+    try:
+        _build()
+    finally:
+        _load_lock.release()
+
+
+def load():
+    """
+        Builds the projections on first use. With DOMAIN_PROJECTIONS_REFRESH set, they are rebuilt in the background once it
+        has elapsed, the current ones are served meanwhile.
+    """
+    if _built_at is not None:
+        refresh = settings.DOMAIN_PROJECTIONS_REFRESH
+        if refresh and time.monotonic() - _built_at >= refresh and _load_lock.acquire(blocking=False):
+            threading.Thread(target=_rebuild, daemon=True, name='projections-rebuild').start()
+        return
+    with _load_lock:
+        if _built_at is not None:
+            return
+        blob_store.create()
+        _build()
+        if settings.METRICS_LOG_INTERVAL:
+            instrumentation.LogExporter(metrics, reset=True).start(settings.METRICS_LOG_INTERVAL)
@@ -0,0 +1,19 @@
+import argparse
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hub_service import domain
+
+import bulk  # Domain module, importable once hub_service.domain put DOMAIN_DIR on the path
+
+
+class Command(BaseCommand):
+    help = 'Imports or exports the advertisements of the Domain database, through the workers of the site (see Domain/bulk.py).'
+
+    def add_arguments(self, parser):
+        bulk.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        status = bulk.run(argparse.Namespace(**options), domain.get_worker)
+        if status:
+            raise CommandError('Some ads were not imported')
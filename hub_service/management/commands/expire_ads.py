@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from hub_service import domain
+
+import expiry  # Domain modules, importable once hub_service.domain put DOMAIN_DIR on the path
+import messagebus
+
+
+class Command(BaseCommand):
+    help = 'Expires the advertisements and premium promotions due now. Run it periodically, e.g. every hour from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='expiries committed per transaction')
+
+    def handle(self, *args, **options):
+        w = domain.get_worker()
+        w.expiry = expiry.ExpiryScheduler()
+        w.expiry.schedule_stored(w.db.db)
+        bus = messagebus.MessageBus(w)
+        now = datetime.datetime.now()
+        expired = failed = 0
+        while True:
+            results = w.expiry.run_due(bus, now, options['batch_size'])
+            if not results:
+                break
+            expired += sum(result.ok for result in results)
+            failed += sum(not result.ok for result in results)
+        self.stdout.write(f'{expired} expired, {failed} failed')
@@ -0,0 +1,18 @@
+import time
+
+from hub_service import domain
+
+
+class TimingMiddleware:
+    """ Records the latency of every view in domain.metrics, as "view.<url name>". """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None:  # Unresolved URLs (404) aren't worth a histogram each
+            domain.metrics.observe(f'view.{match.view_name}', time.perf_counter() - start)
+        return response
@@ -1,17 +1,51 @@
+import hmac
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 
+from hub_service import domain
+from hub_service.cache import cached_page
 from hub_service.forms import SignUpForm
 
 
+@cached_page(domain.invalidation.ADS)
 def index(request):
-    return render(request, 'hub_service/index.html')
+    domain.load()
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+    return render(request, 'hub_service/index.html', {'premium_ads': domain.premium_feed.page(page)})
+
 
+def _advertisement_scopes(request):
+    """ The list of ads depends on every ad, the page of an ad only on the ad and its provider. """
+    ad_uuid = request.GET.get('uuid')
+    if ad_uuid is None:
+        return (domain.invalidation.ADS,)
+    ad = domain.read_models().ad(ad_uuid)
+    if ad is None:
+        return (domain.invalidation.ad_scope(ad_uuid),)
+    return domain.invalidation.ad_scope(ad_uuid), domain.invalidation.provider_scope(ad.owner_uuid)
 
+
+@cached_page(_advertisement_scopes)
 def advertisement(request):
-    return render(request, 'hub_service/advertisement.html')
+    models = domain.read_models()
+    ad_uuid = request.GET.get('uuid')
+    if ad_uuid is None:
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+        return render(request, 'hub_service/advertisement.html', {'ads': models.published_ads(page), 'page': page})
+    ad = models.ad(ad_uuid)
+    if ad is None:
+        raise Http404
+    return render(request, 'hub_service/advertisement.html', {'ad': ad, 'provider': models.provider(ad.owner_uuid)})
 
 
 @login_required
@@ -19,10 +53,12 @@ def profile(request):
     return render(request, 'hub_service/profile.html')
 
 
+@cached_page()
 def about(request):
     return render(request, 'hub_service/about.html')
 
 
+@cached_page()
 def contact(request):
     return render(request, 'hub_service/contact.html')
 
@@ -40,3 +76,18 @@ def signup(request):
     else:
         form = SignUpForm()
     return render(request, 'registration/signup.html', {'form': form})
+
+
+def _metrics_allowed(request) -> bool:
+    # Not by client address: behind a reverse proxy, every request would come from it.
+    if request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+def metrics(request):
+    if not _metrics_allowed(request):
+        raise Http404
+    text = domain.instrumentation.render_text(domain.metrics.snapshot())
+    return HttpResponse(text, content_type='text/plain; version=0.0.4')
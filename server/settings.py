@@ -35,6 +35,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'hub_service.middleware.TimingMiddleware',
 ]
 
 ROOT_URLCONF = 'server.urls'
@@ -105,11 +106,54 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded pictures, stored by the Domain blob store under MEDIA_ROOT / 'blobs'
+
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Use 'django.core.cache.backends.filebased.FileBasedCache' to share the pages between processes as well.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hub_service',
+        'TIMEOUT': 600,
+    }
+}
+
+# Where the pages are cached; their versions are counters in the Domain database, shared by every process (Domain/invalidation.py).
+PAGE_CACHE = 'default'
+
+# Domain layer (flat modules, imported by hub_service.domain)
+
+DOMAIN_DIR = BASE_DIR / 'Domain'
+
+# One SQLite file per shard, e.g. [BASE_DIR / f'shard{i}.sqlite3' for i in range(4)]; the Domain objects are partitioned
+# across them by owner uuid. Empty: they are stored in the default database. Never change the number of shards of existing data.
+
+DOMAIN_SHARDS = []
+
+# The search index and premium feed live in the memory of each process, kept up to date by its own handlers: the ads
+# written by other processes (other site workers, manage.py bulk_ads, ...) only show up once they are rebuilt from the database.
+# Set DOMAIN_PROJECTIONS_REFRESH to rebuild them every that many seconds; each rebuild reads every ad, keep it at 0 (never)
+# when a single process serves the site and imports through its workers.
+
+DOMAIN_PROJECTIONS_REFRESH = 0
+
+# Latency histograms: served as text at /metrics to staff users, and to scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+# (empty: staff only); logged every METRICS_LOG_INTERVAL seconds (0 to disable)
+
+# SECURITY WARNING: keep the metrics token used in production secret!
+METRICS_TOKEN = ''
+METRICS_LOG_INTERVAL = 60
+
 LOGOUT_REDIRECT_URL = 'index'
 LOGIN_REDIRECT_URL = 'index'
 